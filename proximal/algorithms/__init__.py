@@ -5,5 +5,6 @@ from . import linearized_admm as ladmm
 
 from .absorb import absorb_lin_op, absorb_offset
 from .problem import Problem
+from .autotune import ImplCache
 from .equil import equil
 from .merge import can_merge, merge_fns
@@ -114,6 +114,8 @@ def absorb_offset(prox_fn):
     ready = [new_lin_op]
     while len(ready) > 0:
         curr = ready.pop(0)
+        # The shallow copy shares its list of inputs with the original.
+        curr.input_nodes = list(curr.input_nodes)
         for idx, arg in enumerate(curr.input_nodes):
             if isinstance(arg, Constant):
                 curr.input_nodes[idx] = Constant(np.zeros(arg.shape))
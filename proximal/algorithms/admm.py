@@ -1,11 +1,13 @@
 from __future__ import division, print_function
 from proximal.lin_ops import CompGraph, scale, vstack
 from proximal.utils.timings_log import TimingsLog, TimingsEntry
+from proximal.utils import Impl
 from .invert import get_least_squares_inverse, get_diag_quads
+from .anderson import Anderson
 import numpy as np
 
 
-def partition(prox_fns, try_diagonalize=True):
+def partition(prox_fns, try_diagonalize=True, dtype=np.float64):
     """Divide the proxable functions into sets Psi and Omega.
     """
     # Merge these quadratic functions with the v update.
@@ -25,15 +27,11 @@ def partition(prox_fns, try_diagonalize=True):
     return psi_fns, quad_funcs
 
 
-def solve(psi_fns, omega_fns, rho=1.0,
-          max_iters=1000, eps_abs=1e-3, eps_rel=1e-3, x0=None,
-          lin_solver="cg", lin_solver_options=None,
-          try_diagonalize=True, try_fast_norm=False,
-          scaled=True, conv_check=100,
-          metric=None, convlog=None, verbose=0):
-    prox_fns = psi_fns + omega_fns
-    stacked_ops = vstack([fn.lin_op for fn in psi_fns])
-    K = CompGraph(stacked_ops)
+def get_v_update(psi_fns, omega_fns, rho, try_diagonalize=True, verbose=False,
+                 dtype=np.float64):
+    """Returns the least squares v update for rho, its quadratic lin ops and
+       its constant terms.
+    """
     # Rescale so (rho/2)||x - b||^2_2
     rescaling = np.sqrt(2. / rho)
     quad_ops = []
@@ -44,15 +42,66 @@ def solve(psi_fns, omega_fns, rho=1.0,
         const_terms.append(fn.b.flatten() * rescaling)
     # Check for fast inverse.
     op_list = [func.lin_op for func in psi_fns] + quad_ops
-    stacked_ops = vstack(op_list)
 
     # Get optimize inverse (tries spatial and frequency diagonalization)
-    v_update = get_least_squares_inverse(op_list, None, try_diagonalize, verbose)
+    v_update = get_least_squares_inverse(op_list, None, try_diagonalize, verbose,
+                                         dtype=dtype)
+    return v_update, quad_ops, const_terms
+
+
+def get_quad_diag(v_update, quad_ops):
+    """Returns the diagonal (or frequency diagonal) of the v update and the
+       part of it due to the quadratic lin ops.
+
+       Returns None if the v update is solved iteratively.
+    """
+    if v_update.diag is not None:
+        diag, freq = v_update.diag, False
+    elif v_update.freq_diag is not None and v_update.implementation == Impl['numpy']:
+        diag, freq = v_update.freq_diag, True
+    else:
+        return None
+    if len(quad_ops) == 0:
+        return diag, np.zeros_like(diag)
+    quad_diag = list(vstack(quad_ops).get_diag(freq=freq).values())[0]
+    quad_diag = quad_diag * np.conj(quad_diag)
+    return diag, np.reshape(quad_diag, diag.shape).astype(diag.dtype)
+
+
+def solve(psi_fns, omega_fns, rho=1.0,
+          max_iters=1000, eps_abs=1e-3, eps_rel=1e-3, x0=None,
+          lin_solver="cg", lin_solver_options=None,
+          try_diagonalize=True, try_fast_norm=False,
+          scaled=True, conv_check=100,
+          metric=None, convlog=None, verbose=0, num_threads=1,
+          dtype=np.float64, sparse=False, implem=None,
+          adapt_rho=False, rho_mu=10.0, rho_scale=2.0, accel=None, accel_mem=5,
+          accel_restart=2.0):
+    """Solves the problem with ADMM.
+
+    With adapt_rho=True, rho is balanced on the check iterations: it is
+    multiplied by rho_scale if the primal residual is rho_mu times larger than
+    the dual one, and divided by it in the opposite case. Diagonal v updates
+    are rescaled in place, iterative ones are rebuilt for the new rho.
+
+    With accel="anderson", the iteration on (z, u) is Anderson accelerated
+    with a memory of accel_mem iterations. The history is dropped when the
+    fixed-point residual grows past accel_restart times its smallest value
+    since the last restart.
+    """
+    prox_fns = psi_fns + omega_fns
+    stacked_ops = vstack([fn.lin_op for fn in psi_fns])
+    K = CompGraph.cached(stacked_ops, num_threads=num_threads, dtype=dtype,
+                         sparse=sparse, implem=implem)
+    v_update, quad_ops, const_terms = get_v_update(psi_fns, omega_fns, rho,
+                                                   try_diagonalize, verbose, dtype)
 
     # Initialize everything to zero.
-    v = np.zeros(K.input_size)
-    z = np.zeros(K.output_size)
-    u = np.zeros(K.output_size)
+    # z and u are views of the state of the fixed-point iteration.
+    v = np.zeros(K.input_size, dtype=dtype)
+    state = np.zeros(2 * K.output_size, dtype=dtype)
+    z = state[:K.output_size]
+    u = state[K.output_size:]
 
     # Initialize
     if x0 is not None:
@@ -60,9 +109,31 @@ def solve(psi_fns, omega_fns, rho=1.0,
         K.forward(v, z)
 
     # Buffers.
-    Kv = np.zeros(K.output_size)
-    KTu = np.zeros(K.input_size)
-    s = np.zeros(K.input_size)
+    Kv = np.zeros(K.output_size, dtype=dtype)
+    KTu = np.zeros(K.input_size, dtype=dtype)
+    s = np.zeros(K.input_size, dtype=dtype)
+    r = np.zeros(K.output_size, dtype=dtype)
+    # Work buffers, so iterations update everything in place.
+    z_prev = np.zeros(K.output_size, dtype=dtype)
+    Kv_u = np.zeros(K.output_size, dtype=dtype)
+    # The right hand side of the v update ends with the constant terms.
+    tmp = np.hstack([z] + const_terms).astype(dtype)
+    z_u = tmp[:K.output_size]
+    if adapt_rho:
+        # The quadratics are the only part of the v update that depends on rho:
+        # diag(rho) = psi_diag + (rho_0/rho)*quad_diag, and the constant terms
+        # scale by rho_0/rho.
+        rho_0 = rho
+        const_0 = tmp[K.output_size:].copy()
+        diags = get_quad_diag(v_update, quad_ops)
+        if diags is not None:
+            diag, quad_diag = diags
+            psi_diag = diag - quad_diag
+
+    if accel == "anderson":
+        accel = Anderson(state, accel_mem, accel_restart)
+    elif accel is not None:
+        raise RuntimeError("Acceleration %s unknown" % accel)
 
     # Log for prox ops.
     prox_log = TimingsLog(prox_fns)
@@ -80,36 +151,44 @@ def solve(psi_fns, omega_fns, rho=1.0,
         if convlog is not None:
             convlog.tic()
 
-        z_prev = z.copy()
+        if i % conv_check == 0:
+            np.copyto(z_prev, z)
 
         # Update v.
-        tmp = np.hstack([z - u] + const_terms)
+        np.subtract(z, u, out=z_u)
         v = v_update.solve(tmp, x_init=v, lin_solver=lin_solver, options=lin_solver_options)
 
         # Update z.
         K.forward(v, Kv)
-        Kv_u = Kv + u
+        np.add(Kv, u, out=Kv_u)
         offset = 0
         for fn in psi_fns:
             slc = slice(offset, offset + fn.lin_op.size, None)
             Kv_u_slc = np.reshape(Kv_u[slc], fn.lin_op.shape)
             # Apply and time prox.
             prox_log[fn].tic()
-            z[slc] = fn.prox(rho, Kv_u_slc, i).flatten()
+            np.copyto(np.reshape(z[slc], fn.lin_op.shape), fn.prox(rho, Kv_u_slc, i))
             prox_log[fn].toc()
             offset += fn.lin_op.size
         # Update u.
-        u += Kv - z
+        u += Kv
+        u -= z
 
         # Check convergence.
         if i % conv_check == 0:
-            r = Kv - z
+            np.subtract(Kv, z, out=r)
             K.adjoint(u, KTu)
-            K.adjoint(rho * (z - z_prev), s)
+            # Kv_u is free until the next iteration.
+            np.subtract(z, z_prev, out=Kv_u)
+            Kv_u *= rho
+            K.adjoint(Kv_u, s)
             eps_pri = np.sqrt(K.output_size) * eps_abs + eps_rel * \
                 max([np.linalg.norm(Kv), np.linalg.norm(z)])
             eps_dual = np.sqrt(K.input_size) * eps_abs + eps_rel * np.linalg.norm(KTu) * rho
 
+        if accel is not None:
+            accel.update()
+
         # Convergence log
         if convlog is not None:
             convlog.toc()
@@ -132,9 +211,36 @@ def solve(psi_fns, omega_fns, rho=1.0,
 
         iter_timing.toc()
         # Exit if converged.
-        if np.linalg.norm(r) <= eps_pri and np.linalg.norm(s) <= eps_dual:
+        if i % conv_check == 0 and \
+                np.linalg.norm(r) <= eps_pri and np.linalg.norm(s) <= eps_dual:
             break
 
+        # Balance the residuals.
+        if adapt_rho and i % conv_check == 0:
+            if np.linalg.norm(r) > rho_mu * np.linalg.norm(s):
+                factor = rho_scale
+            elif np.linalg.norm(s) > rho_mu * np.linalg.norm(r):
+                factor = 1.0 / rho_scale
+            else:
+                continue
+            rho *= factor
+            # u is the dual variable scaled by 1/rho.
+            u /= factor
+            if accel is not None:
+                # The iteration changed with rho.
+                accel.reset()
+            if diags is not None:
+                np.multiply(quad_diag, rho_0 / rho, out=diag)
+                diag += psi_diag
+                np.multiply(const_0, rho_0 / rho, out=tmp[K.output_size:])
+            else:
+                v_update, quad_ops, const_terms = get_v_update(
+                    psi_fns, omega_fns, rho, try_diagonalize, verbose, dtype)
+                if len(const_terms) > 0:
+                    tmp[K.output_size:] = np.hstack(const_terms)
+            if verbose > 0:
+                print("iter %d: rho = %.3e" % (i, rho))
+
     # Print out timings info.
     if verbose > 0:
         print(iter_timing)
@@ -0,0 +1,66 @@
+# Anderson acceleration of the fixed-point iterations of the solvers.
+import numpy as np
+
+
+class Anderson(object):
+    """Type-II Anderson acceleration of a fixed-point iteration x = T(x).
+
+    The solver keeps its iterate in the buffer x and calls update() after
+    each application of T. The accelerator replaces T(x) in place by the
+    combination of the last mem+1 values of T whose residuals T(x) - x
+    cancel best. If the residual grows beyond restart times the smallest
+    residual since the last restart, the history is dropped and the plain
+    T(x) is kept.
+    """
+
+    def __init__(self, x, mem=5, restart=2.0):
+        if mem < 1 or restart < 1:
+            raise RuntimeError("Anderson acceleration needs mem >= 1 and restart >= 1")
+        self.x = x
+        self.mem = mem
+        self.restart = restart
+        # Input of the current application of T.
+        self.x_in = x.copy()
+        # Residual and value of T of the last iteration.
+        self.f = np.zeros_like(x)
+        self.f_prev = np.zeros_like(x)
+        self.g_prev = np.zeros_like(x)
+        # Differences of the last mem residuals and values of T.
+        self.dF = np.zeros((mem, x.size), dtype=x.dtype)
+        self.dG = np.zeros((mem, x.size), dtype=x.dtype)
+        self.restarts = 0
+        self.reset()
+
+    def reset(self):
+        """Drops the history, for instance when the iteration changed.
+        """
+        self.count = 0
+        self.pos = 0
+        self.norm_min = np.inf
+        self.x_in[:] = self.x
+
+    def update(self):
+        """Accelerates the value T(x) stored in x.
+        """
+        np.subtract(self.x, self.x_in, out=self.f)
+        norm = np.linalg.norm(self.f)
+        if norm > self.restart * self.norm_min:
+            # Restart on residual increase.
+            self.count = 0
+            self.pos = 0
+            self.norm_min = norm
+            self.restarts += 1
+        elif self.norm_min < np.inf:
+            np.subtract(self.f, self.f_prev, out=self.dF[self.pos])
+            np.subtract(self.x, self.g_prev, out=self.dG[self.pos])
+            self.count = min(self.count + 1, self.mem)
+            self.pos = (self.pos + 1) % self.mem
+        self.norm_min = min(self.norm_min, norm)
+        self.f_prev[:] = self.f
+        self.g_prev[:] = self.x
+
+        if self.count > 0:
+            # gamma = argmin ||f - dF^T gamma||, x = g - dG^T gamma
+            gamma = np.linalg.lstsq(self.dF[:self.count].T, self.f, rcond=None)[0]
+            self.x -= gamma.dot(self.dG[:self.count])
+        self.x_in[:] = self.x
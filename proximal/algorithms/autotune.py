@@ -0,0 +1,173 @@
+import copy as cp
+import hashlib
+import timeit
+import numpy as np
+from proximal.lin_ops import Variable, Constant
+from proximal.prox_fns import ProxFn
+from proximal.halide.halide import halide_installed
+from proximal.utils.utils import Impl
+from proximal.utils.norm_cache import NormCache
+
+
+class ImplCache(NormCache):
+    """The fastest implementation of lin ops and prox fns, kept in memory and,
+    if a cache directory is set, on disk.
+
+    Choices are stored under a digest of the type of the lin op or prox fn,
+    its shapes and the implementations it was timed with.
+    """
+
+    prefixes = ('impl-',)
+
+    def get_impl(self, key):
+        """Returns the implementation stored for key, else None.
+        """
+        entry = self.load('impl-' + key)
+        if entry is not None:
+            return int(entry[0])
+        return None
+
+    def set_impl(self, key, implem):
+        self.store('impl-' + key, np.array([implem]))
+
+
+# Cache used by autotune.
+impl_cache = ImplCache()
+
+# Errors of implementations that do not support their arguments, like the
+# array checks of Halide, or that fail to build.
+UNSUPPORTED_ERRORS = (ValueError, NotImplementedError, RuntimeError, OSError)
+
+
+def available_implementations():
+    """The implementations that can run on this machine.
+    """
+    implems = [Impl['numpy']]
+    if halide_installed():
+        implems.append(Impl['halide'])
+    return implems
+
+
+def tune_key(obj, implems, dtype=np.float64):
+    """A digest of the type and shapes of a lin op or prox fn, and the float
+    type it runs with.
+    """
+    if isinstance(obj, ProxFn):
+        shapes = (obj.lin_op.shape,)
+    else:
+        shapes = tuple(node.shape for node in obj.input_nodes) + (obj.shape,)
+    cls = type(obj)
+    data = (cls.__module__, cls.__name__, shapes, tuple(implems), np.dtype(dtype).str)
+    return hashlib.sha1(repr(data).encode('utf-8')).hexdigest()
+
+
+def trial_copy(obj, implem):
+    """Returns a copy of obj running implem.
+
+    The parameters and temporaries are copied, so running the copy leaves obj
+    untouched. The inputs are shared.
+    """
+    shared = ['input_nodes', 'orig_node', 'lin_op']
+    trial = cp.copy(obj)
+    state = dict((name, val) for name, val in obj.__dict__.items()
+                 if name not in shared)
+    trial.__dict__.update(cp.deepcopy(state))
+    trial.set_implementation(implem)
+    return trial
+
+
+def time_implementation(obj, implem, repeats=3, dtype=np.float64):
+    """Seconds obj takes to run with implem, or inf if implem is not available
+    or does not support obj.
+
+    Lin ops are timed on a forward and an adjoint pass, prox fns on a prox
+    evaluation. The first run is not timed, as it may compile code.
+    """
+    if implem not in available_implementations():
+        return np.inf
+    trial = trial_copy(obj, implem)
+    if isinstance(obj, ProxFn):
+        v = np.random.randn(*obj.lin_op.shape).astype(dtype)
+
+        def run():
+            trial.prox(1.0, v.copy(), 0)
+    else:
+        inputs = [np.random.randn(*node.shape).astype(dtype)
+                  for node in obj.input_nodes]
+        outputs = [np.zeros(obj.shape, dtype=dtype)]
+        adjoints = [np.zeros(node.shape, dtype=dtype)
+                    for node in obj.input_nodes]
+
+        def run():
+            trial.forward(inputs, outputs)
+            trial.adjoint(outputs, adjoints)
+    try:
+        run()
+        best = np.inf
+        for _ in range(repeats):
+            start = timeit.default_timer()
+            run()
+            best = min(best, timeit.default_timer() - start)
+    except UNSUPPORTED_ERRORS:
+        return np.inf
+    return best
+
+
+def tune(obj, cache=None, implems=None, repeats=3, dtype=np.float64):
+    """Sets the implementation of a lin op or prox fn to the fastest one.
+
+    Only the implementations obj has for its shapes are timed. Choices are
+    looked up in the cache first and stored in it afterwards.
+
+    Returns
+    -------
+    int
+        The implementation chosen, or None if obj has no choice to make.
+    """
+    if cache is None:
+        cache = impl_cache
+    if implems is None:
+        implems = available_implementations()
+    implems = [implem for implem in obj.implementations() if implem in implems]
+    if len(implems) < 2:
+        return None
+    key = tune_key(obj, implems, dtype)
+    best = cache.get_impl(key)
+    if best not in implems:
+        times = [time_implementation(obj, implem, repeats, dtype)
+                 for implem in implems]
+        if np.isinf(min(times)):
+            return None
+        best = implems[int(np.argmin(times))]
+        cache.set_impl(key, best)
+    obj.set_implementation(best)
+    return best
+
+
+def tune_all(prox_fns, cache=None, implems=None, repeats=3, dtype=np.float64):
+    """Tunes the prox fns and every lin op they are applied to.
+
+    Returns
+    -------
+    dict
+        Map from each lin op or prox fn with a choice to make to the
+        implementation chosen.
+    """
+    choices = {}
+    visited = set()
+    ready = [fn.lin_op for fn in prox_fns]
+    while len(ready) > 0:
+        node = ready.pop()
+        if id(node) in visited:
+            continue
+        visited.add(id(node))
+        ready += node.input_nodes
+        if not isinstance(node, (Variable, Constant)):
+            implem = tune(node, cache, implems, repeats, dtype)
+            if implem is not None:
+                choices[node] = implem
+    for fn in prox_fns:
+        implem = tune(fn, cache, implems, repeats, dtype)
+        if implem is not None:
+            choices[fn] = implem
+    return choices
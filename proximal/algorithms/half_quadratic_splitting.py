@@ -6,7 +6,7 @@ from proximal.utils.timings_log import TimingsLog, TimingsEntry
 from .invert import get_least_squares_inverse, get_diag_quads
 
 
-def partition(prox_fns, try_diagonalize=True):
+def partition(prox_fns, try_diagonalize=True, dtype=np.float64):
     """Divide the proxable functions into sets Psi and Omega.
     """
     # Merge these quadratic functions with the v update.
@@ -32,10 +32,12 @@ def solve(psi_fns, omega_fns,
           eps_rel=1e-3, eps_abs=1e-3,
           lin_solver="cg", lin_solver_options=None,
           try_diagonalize=True, scaled=False, try_fast_norm=False,
-          metric=None, convlog=None, verbose=0):
+          conv_check=1, metric=None, convlog=None, verbose=0, num_threads=1,
+          dtype=np.float64, sparse=False, implem=None):
     prox_fns = psi_fns + omega_fns
     stacked_ops = vstack([fn.lin_op for fn in psi_fns])
-    K = CompGraph(stacked_ops)
+    K = CompGraph.cached(stacked_ops, num_threads=num_threads, dtype=dtype,
+                         sparse=sparse, implem=implem)
     # Rescale so (1/2)||x - b||^2_2
     rescaling = np.sqrt(2.)
     quad_ops = []
@@ -50,20 +52,25 @@ def solve(psi_fns, omega_fns,
     # Get optimize inverse (tries spatial and frequency diagonalization)
     op_list = [func.lin_op for func in psi_fns] + quad_ops
     stacked_ops = vstack(op_list)
-    x_update = get_least_squares_inverse(op_list, None,
-                                         try_diagonalize, verbose)
+    # The graph of the x update is built once, and only its scalars change
+    # with rho.
+    ls_graph = CompGraph(stacked_ops, dtype=dtype)
 
     # Initialize
     if x0 is not None:
         x = np.reshape(x0, K.input_size)
     else:
-        x = np.zeros(K.input_size)
+        x = np.zeros(K.input_size, dtype=dtype)
 
-    Kx = np.zeros(K.output_size)
+    Kx = np.zeros(K.output_size, dtype=dtype)
     w = Kx.copy()
 
     # Temporary iteration counts
     x_prev = x.copy()
+    w_prev = w.copy()
+    # The right hand side of the x update ends with the constant terms.
+    tmp = np.hstack([w] + const_terms).astype(dtype)
+    const_tmp = tmp[K.output_size:]
 
     # Log for prox ops.
     prox_log = TimingsLog(prox_fns)
@@ -82,42 +89,55 @@ def solve(psi_fns, omega_fns,
     i = 0
     while rho < rho_max and i < max_iters:
         iter_timing.tic()
-        if convlog is not None:
-            convlog.tic()
 
         # Update rho for quadratics
         for idx, op in enumerate(quad_ops):
             op.scalar = quad_weights[idx] / np.sqrt(rho)
-        x_update = get_least_squares_inverse(op_list, CompGraph(stacked_ops),
-                                             try_diagonalize, verbose)
+        if not ls_graph.update_scalars():
+            ls_graph = CompGraph(stacked_ops, dtype=dtype)
+        x_update = get_least_squares_inverse(op_list, None, try_diagonalize, verbose,
+                                             dtype=dtype, K=ls_graph)
+        offset = 0
+        for cterm in const_terms:
+            np.divide(cterm, np.sqrt(rho), out=const_tmp[offset:offset + cterm.size])
+            offset += cterm.size
 
         for ii in range(max_inner_iters):
             inner_iter_timing.tic()
+            if convlog is not None:
+                convlog.tic()
             # Update Kx.
             K.forward(x, Kx)
 
             # Prox update to get w.
             offset = 0
-            w_prev = w.copy()
+            check = ii % conv_check == 0
+            if check:
+                np.copyto(w_prev, w)
             for fn in psi_fns:
                 slc = slice(offset, offset + fn.lin_op.size, None)
                 # Apply and time prox.
                 prox_log[fn].tic()
-                w[slc] = fn.prox(rho, np.reshape(Kx[slc], fn.lin_op.shape), ii).flatten()
+                np.copyto(np.reshape(w[slc], fn.lin_op.shape),
+                          fn.prox(rho, np.reshape(Kx[slc], fn.lin_op.shape), ii))
                 prox_log[fn].toc()
                 offset += fn.lin_op.size
 
             # Update x.
-            x_prev[:] = x
-            tmp = np.hstack([w] + [cterm / np.sqrt(rho) for cterm in const_terms])
+            if check:
+                x_prev[:] = x
+            tmp[:K.output_size] = w
             x = x_update.solve(tmp, x_init=x, lin_solver=lin_solver, options=lin_solver_options)
 
             # Very basic convergence check.
-            r_x = np.linalg.norm(x_prev - x)
-            eps_x = eps_rel * np.prod(K.input_size)
+            if check:
+                x_prev -= x
+                r_x = np.linalg.norm(x_prev)
+                eps_x = eps_rel * np.prod(K.input_size)
 
-            r_w = np.linalg.norm(w_prev - w)
-            eps_w = eps_rel * np.prod(K.output_size)
+                w_prev -= w
+                r_w = np.linalg.norm(w_prev)
+                eps_w = eps_rel * np.prod(K.output_size)
 
             # Convergence log
             if convlog is not None:
@@ -127,7 +147,7 @@ def solve(psi_fns, omega_fns,
                 convlog.record_objective(objval)
 
             # Show progess
-            if verbose > 0:
+            if verbose > 0 and check:
                 # Evaluate objective only if required (expensive !)
                 objstr = ''
                 if verbose == 2:
@@ -142,7 +162,7 @@ def solve(psi_fns, omega_fns,
                       % (i, rho, ii, r_x, eps_x, r_w, eps_w, objstr, metstr))
 
             inner_iter_timing.toc()
-            if r_x < eps_x and r_w < eps_w:
+            if check and r_x < eps_x and r_w < eps_w:
                 break
 
         # Update rho
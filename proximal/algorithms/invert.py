@@ -71,7 +71,8 @@ def max_diag_set(prox_fns):
         return freq_diag
 
 
-def get_least_squares_inverse(op_list, b, try_freq_diagonalize=True, verbose=False):
+def get_least_squares_inverse(op_list, b, try_freq_diagonalize=True, verbose=False,
+                              dtype=np.float64, K=None):
     if len(op_list) == 0:
         return None
     # Are all the operators diagonal?
@@ -82,7 +83,7 @@ def get_least_squares_inverse(op_list, b, try_freq_diagonalize=True, verbose=Fal
 
         diag = list(stacked.get_diag(freq=False).values())[0]
         diag = diag * np.conj(diag)
-        x_update = least_squares(stacked, b, diag=diag)
+        x_update = least_squares(stacked, b, diag=diag, dtype=dtype, K=K)
 
     # Are all the operators diagonal in the frequency domain?
     elif try_freq_diagonalize and stacked.is_gram_diag(freq=True):
@@ -96,10 +97,10 @@ def get_least_squares_inverse(op_list, b, try_freq_diagonalize=True, verbose=Fal
             dimstr = (' with dimensionality %d' % dims) if dims is not None else ''
             print('Optimized for diagonal frequency inverse' + dimstr)
 
-        x_update = least_squares(stacked, b,
-                                 freq_diag=diag, freq_dims=dims, implem=implem)
+        x_update = least_squares(stacked, b, freq_diag=diag, freq_dims=dims,
+                                 dtype=dtype, implem=implem, K=K)
     else:
 
-        x_update = least_squares(stacked, b)
+        x_update = least_squares(stacked, b, dtype=dtype, K=K)
 
     return x_update
@@ -2,11 +2,12 @@ from __future__ import division, print_function
 from proximal.lin_ops import CompGraph, est_CompGraph_norm, Variable, vstack
 from proximal.utils.timings_log import TimingsLog, TimingsEntry
 from .invert import get_least_squares_inverse, max_diag_set
+from .anderson import Anderson
 import numpy as np
 import warnings
 
 
-def partition(prox_fns, try_diagonalize=True):
+def partition(prox_fns, try_diagonalize=True, dtype=np.float64):
     """Divide the proxable functions into sets Psi and Omega.
     """
     # Omega must be a single function.
@@ -33,7 +34,8 @@ def partition(prox_fns, try_diagonalize=True):
 
         b = np.hstack(const_terms)
         # Get optimize inverse (tries spatial and frequency diagonalization)
-        x_update = get_least_squares_inverse(quad_ops, b, try_diagonalize)
+        x_update = get_least_squares_inverse(quad_ops, b, try_diagonalize,
+                                             dtype=dtype)
         omega_fns = [x_update]
 
     psi_fns = [func for func in prox_fns if func not in split_fn + quad_fns]
@@ -44,30 +46,54 @@ def solve(psi_fns, omega_fns, lmb=1.0, mu=None, quad_funcs=None,
           max_iters=1000, eps_abs=1e-3, eps_rel=1e-3,
           lin_solver="cg", lin_solver_options=None,
           try_diagonalize=True, try_fast_norm=True, scaled=False,
-          metric=None, convlog=None, verbose=0):
+          conv_check=1, metric=None, convlog=None, verbose=0, num_threads=1,
+          dtype=np.float64, sparse=False, implem=None, accel=None, accel_mem=5,
+          accel_restart=2.0):
+    """Solves the problem with linearized ADMM.
+
+    Convergence is checked every conv_check iterations. Larger values save
+    two K.adjoint per iteration, but may stop later.
+
+    With accel="anderson", the iteration on (v, z, u) is Anderson accelerated
+    with a memory of accel_mem iterations. The history is dropped when the
+    fixed-point residual grows past accel_restart times its smallest value
+    since the last restart.
+    """
 
     # Can only have one omega function.
     assert len(omega_fns) <= 1
     prox_fns = psi_fns + omega_fns
     stacked_ops = vstack([fn.lin_op for fn in psi_fns])
-    K = CompGraph(stacked_ops)
+    K = CompGraph.cached(stacked_ops, num_threads=num_threads, dtype=dtype,
+                         sparse=sparse, implem=implem)
     # Select optimal parameters if wanted
     if lmb is None or mu is None:
         lmb, mu = est_params_lin_admm(K, lmb, verbose, scaled, try_fast_norm)
 
     # Initialize everything to zero.
-    v = np.zeros(K.input_size)
-    z = np.zeros(K.output_size)
-    u = np.zeros(K.output_size)
+    # v, z and u are views of the state of the fixed-point iteration.
+    state = np.zeros(K.input_size + 2 * K.output_size, dtype=dtype)
+    v = state[:K.input_size]
+    z = state[K.input_size:K.input_size + K.output_size]
+    u = state[K.input_size + K.output_size:]
 
     # Buffers.
-    Kv = np.zeros(K.output_size)
-    KTu = np.zeros(K.input_size)
-    s = np.zeros(K.input_size)
-
-    Kvzu = np.zeros(K.output_size)
-    v_prev = np.zeros(K.input_size)
-    z_prev = np.zeros(K.output_size)
+    Kv = np.zeros(K.output_size, dtype=dtype)
+    KTu = np.zeros(K.input_size, dtype=dtype)
+    s = np.zeros(K.input_size, dtype=dtype)
+
+    Kvzu = np.zeros(K.output_size, dtype=dtype)
+    v_prev = np.zeros(K.input_size, dtype=dtype)
+    z_prev = np.zeros(K.output_size, dtype=dtype)
+    r = np.zeros(K.output_size, dtype=dtype)
+    # Work buffers, so iterations update everything in place.
+    Kv_u = np.zeros(K.output_size, dtype=dtype)
+    x_init = np.zeros(K.input_size, dtype=dtype)
+
+    if accel == "anderson":
+        accel = Anderson(state, accel_mem, accel_restart)
+    elif accel is not None:
+        raise RuntimeError("Acceleration %s unknown" % accel)
 
     # Log for prox ops.
     prox_log = TimingsLog(prox_fns)
@@ -86,41 +112,55 @@ def solve(psi_fns, omega_fns, lmb=1.0, mu=None, quad_funcs=None,
             convlog.tic()
 
         v_prev[:] = v
-        z_prev[:] = z
+        if i % conv_check == 0:
+            z_prev[:] = z
 
         # Update v
         K.forward(v, Kv)
-        Kvzu[:] = Kv - z + u
+        np.subtract(Kv, z, out=Kvzu)
+        Kvzu += u
         K.adjoint(Kvzu, v)
-        v[:] = v_prev - (mu / lmb) * v
+        # v = v_prev - (mu / lmb) * v
+        v *= -mu / lmb
+        v += v_prev
 
         if len(omega_fns) > 0:
-            v[:] = omega_fns[0].prox(1.0 / mu, v, x_init=v_prev.copy(),
-                                     lin_solver=lin_solver, options=lin_solver_options)
+            fn = omega_fns[0]
+            np.copyto(x_init, v_prev)
+            np.copyto(np.reshape(v, fn.lin_op.shape),
+                      fn.prox(1.0 / mu, np.reshape(v, fn.lin_op.shape), x_init=x_init,
+                              lin_solver=lin_solver, options=lin_solver_options))
 
         # Update z.
         K.forward(v, Kv)
-        Kv_u = Kv + u
+        np.add(Kv, u, out=Kv_u)
         offset = 0
         for fn in psi_fns:
             slc = slice(offset, offset + fn.lin_op.size, None)
             Kv_u_slc = np.reshape(Kv_u[slc], fn.lin_op.shape)
             # Apply and time prox.
             prox_log[fn].tic()
-            z[slc] = fn.prox(1.0 / lmb, Kv_u_slc, i).flatten()
+            np.copyto(np.reshape(z[slc], fn.lin_op.shape), fn.prox(1.0 / lmb, Kv_u_slc, i))
             prox_log[fn].toc()
             offset += fn.lin_op.size
 
         # Update u.
-        u += Kv - z
-        K.adjoint(u, KTu)
+        u += Kv
+        u -= z
 
         # Check convergence.
-        r = Kv - z
-        K.adjoint((1.0 / lmb) * (z - z_prev), s)
-        eps_pri = np.sqrt(K.output_size) * eps_abs + eps_rel * \
-            max([np.linalg.norm(Kv), np.linalg.norm(z)])
-        eps_dual = np.sqrt(K.input_size) * eps_abs + eps_rel * np.linalg.norm(KTu) / (1.0 / lmb)
+        if i % conv_check == 0:
+            np.subtract(Kv, z, out=r)
+            K.adjoint(u, KTu)
+            np.subtract(z, z_prev, out=Kvzu)
+            Kvzu *= 1.0 / lmb
+            K.adjoint(Kvzu, s)
+            eps_pri = np.sqrt(K.output_size) * eps_abs + eps_rel * \
+                max([np.linalg.norm(Kv), np.linalg.norm(z)])
+            eps_dual = np.sqrt(K.input_size) * eps_abs + eps_rel * np.linalg.norm(KTu) / (1.0 / lmb)
+
+        if accel is not None:
+            accel.update()
 
         # Convergence log
         if convlog is not None:
@@ -130,7 +170,7 @@ def solve(psi_fns, omega_fns, lmb=1.0, mu=None, quad_funcs=None,
             convlog.record_objective(objval)
 
         # Show progess
-        if verbose > 0:
+        if verbose > 0 and i % conv_check == 0:
             # Evaluate objective only if required (expensive !)
             objstr = ''
             if verbose == 2:
@@ -143,7 +183,9 @@ def solve(psi_fns, omega_fns, lmb=1.0, mu=None, quad_funcs=None,
                 i, np.linalg.norm(r), eps_pri, np.linalg.norm(s), eps_dual, objstr, metstr))
 
         iter_timing.toc()
-        if np.linalg.norm(r) <= eps_pri and np.linalg.norm(s) <= eps_dual:
+        # Exit if converged.
+        if i % conv_check == 0 and \
+                np.linalg.norm(r) <= eps_pri and np.linalg.norm(s) <= eps_dual:
             break
 
     # Print out timings info.
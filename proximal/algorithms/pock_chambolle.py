@@ -7,9 +7,10 @@ from proximal.utils.timings_log import TimingsLog, TimingsEntry
 from proximal.utils.utils import graph_visualize
 from proximal.utils.cuda_codegen import NumpyAdapter
 from .invert import get_least_squares_inverse, max_diag_set
+from .anderson import Anderson
 import numpy as np
 
-def partition(prox_fns, try_diagonalize=True):
+def partition(prox_fns, try_diagonalize=True, dtype=np.float64):
     """Divide the proxable functions into sets Psi and Omega.
     """
     # Omega must be a single function.
@@ -36,7 +37,8 @@ def partition(prox_fns, try_diagonalize=True):
 
         b = np.hstack(const_terms)
         # Get optimize inverse (tries spatial and frequency diagonalization)
-        x_update = get_least_squares_inverse(quad_ops, b, try_diagonalize)
+        x_update = get_least_squares_inverse(quad_ops, b, try_diagonalize,
+                                             dtype=dtype)
         omega_fns = [x_update]
 
     psi_fns = [func for func in prox_fns if func not in split_fn + quad_fns]
@@ -74,30 +76,66 @@ def solve(psi_fns, omega_fns, tau=None, sigma=None, theta=None,
           max_iters=1000, eps_abs=1e-3, eps_rel=1e-3, x0=None,
           lin_solver="cg", lin_solver_options=None, conv_check=100,
           try_diagonalize=True, try_fast_norm=False, scaled=True,
-          metric=None, convlog=None, verbose=0, callback=None, adapter = NumpyAdapter()):
+          metric=None, convlog=None, verbose=0, callback=None, adapter=None, num_threads=1,
+          dtype=np.float64, sparse=False, implem=None,
+          linesearch=False, ls_shrink=0.7, ls_delta=0.99, gamma=0.0,
+          accel=None, accel_mem=5, accel_restart=2.0):
+    """Solves the problem with the primal-dual algorithm of Chambolle and Pock.
+
+    With linesearch=True the step sizes are chosen by the linesearch of
+    Malitsky and Pock instead, which needs no estimate of the norm of K.
+    tau is then the initial primal step and sigma/tau the fixed ratio of the
+    dual to the primal step. Each rejected step is shrunk by ls_shrink and
+    costs one more K.adjoint. If the omega function is gamma-strongly convex,
+    gamma > 0 accelerates the linesearch accordingly.
+
+    With accel="anderson", the iteration on (x, xbar, y) is Anderson
+    accelerated with a memory of accel_mem iterations. The history is dropped
+    when the fixed-point residual grows past accel_restart times its smallest
+    value since the last restart. This needs fixed steps and the numpy
+    implementation.
+    """
 
     # Can only have one omega function.
     assert len(omega_fns) <= 1
     prox_fns = psi_fns + omega_fns
     stacked_ops = vstack([fn.lin_op for fn in psi_fns])
-    K = CompGraph(stacked_ops)
+    K = CompGraph.cached(stacked_ops, num_threads=num_threads, dtype=dtype,
+                         sparse=sparse, implem=implem)
+    if adapter is None:
+        adapter = NumpyAdapter(dtype)
 
     #graph_visualize(prox_fns)
 
+    # The prox functions write offset + factor*prox into out.
     if adapter.implem() == 'numpy':
         K_forward = K.forward
         K_adjoint = K.adjoint
-        prox_off_and_fac = lambda offset, factor, fn, *args, **kw: offset + factor*fn.prox(*args, **kw)
-        prox = lambda fn, *args, **kw: fn.prox(*args, **kw)
+
+        def prox_off_and_fac(out, offset, factor, fn, *args, **kw):
+            out = np.reshape(out, fn.lin_op.shape)
+            np.multiply(fn.prox(*args, **kw), factor, out=out)
+            out += offset
+
+        def prox(out, fn, *args, **kw):
+            np.copyto(np.reshape(out, fn.lin_op.shape), fn.prox(*args, **kw))
     elif adapter.implem() == 'pycuda':
         K_forward = K.forward_cuda
         K_adjoint = K.adjoint_cuda
-        prox_off_and_fac = lambda offset, factor, fn, *args, **kw: fn.prox_cuda(*args, offset=offset, factor=factor, **kw)
-        prox = lambda fn, *args, **kw: fn.prox_cuda(*args, **kw)
+
+        def prox_off_and_fac(out, offset, factor, fn, *args, **kw):
+            out[:] = adapter.flatten(fn.prox_cuda(*args, offset=offset, factor=factor, **kw))
+
+        def prox(out, fn, *args, **kw):
+            out[:] = adapter.flatten(fn.prox_cuda(*args, **kw))
     else:
         raise RuntimeError("Implementation %s unknown" % adapter.implem())
     # Select optimal parameters if wanted
-    if tau is None or sigma is None or theta is None:
+    if linesearch:
+        tau = 1.0 if tau is None else tau
+        beta = 1.0 if sigma is None else sigma / tau
+        theta = 1.0
+    elif tau is None or sigma is None or theta is None:
         tau, sigma, theta = est_params_pc(K, tau, sigma, verbose, scaled, try_fast_norm)
     elif callable(tau) or callable(sigma) or callable(theta):
         if scaled:
@@ -106,9 +144,20 @@ def solve(psi_fns, omega_fns, tau=None, sigma=None, theta=None,
             L = est_CompGraph_norm(K, try_fast_norm)
 
     # Initialize
-    x = adapter.zeros(K.input_size)
-    y = adapter.zeros(K.output_size)
-    xbar = adapter.zeros(K.input_size)
+    if accel is None:
+        x = adapter.zeros(K.input_size)
+        y = adapter.zeros(K.output_size)
+        xbar = adapter.zeros(K.input_size)
+    elif accel == "anderson":
+        if linesearch or adapter.implem() != 'numpy':
+            raise RuntimeError("Acceleration needs fixed steps and numpy")
+        # x, xbar and y are views of the state of the fixed-point iteration.
+        state = adapter.zeros(2 * K.input_size + K.output_size)
+        x = state[:K.input_size]
+        xbar = state[K.input_size:2 * K.input_size]
+        y = state[2 * K.input_size:]
+    else:
+        raise RuntimeError("Acceleration %s unknown" % accel)
     u = adapter.zeros(K.output_size)
     z = adapter.zeros(K.output_size)
 
@@ -119,6 +168,8 @@ def solve(psi_fns, omega_fns, tau=None, sigma=None, theta=None,
 
     K_forward(x, y)
     xbar[:] = x
+    if accel is not None:
+        accel = Anderson(state, accel_mem, accel_restart)
 
     # Buffers.
     Kxbar = adapter.zeros(K.output_size)
@@ -126,6 +177,20 @@ def solve(psi_fns, omega_fns, tau=None, sigma=None, theta=None,
     KTy = adapter.zeros(K.input_size)
     KTu = adapter.zeros(K.input_size)
     s = adapter.zeros(K.input_size)
+    r = adapter.zeros(K.output_size)
+    # Work buffers, so iterations update everything in place.
+    z_scaled = adapter.zeros(K.output_size)
+    tmp_y = adapter.zeros(K.output_size)
+    if linesearch:
+        # The linesearch extrapolates Kx and compares the new dual step with
+        # the previous one.
+        prev_y = adapter.zeros(K.output_size)
+        prev_KTy = adapter.zeros(K.input_size)
+        tau_KTy = adapter.zeros(K.input_size)
+        K_forward(x, Kx)
+        K_adjoint(y, KTy)
+        ctau = adapter.scalar(tau)
+        ctheta = adapter.scalar(theta)
 
     prev_x = x.copy()
     prev_Kx = Kx.copy()
@@ -142,6 +207,8 @@ def solve(psi_fns, omega_fns, tau=None, sigma=None, theta=None,
                               "calcx",
                               "omega_fn",
                               "xbar",
+                              "linesearch",
+                              "accel",
                               "conv_check"])
 
     # Convergence log for initial iterate
@@ -160,56 +227,112 @@ def solve(psi_fns, omega_fns, tau=None, sigma=None, theta=None,
         if convlog is not None:
             convlog.tic()
 
-        if callable(sigma):
-            csigma = sigma(i, L)
-        else:
-            csigma = sigma
-        if callable(tau):
-            ctau = tau(i, L)
-        else:
-            ctau = tau
-        if callable(theta):
-            ctheta = theta(i, L)
-        else:
-            ctheta = theta
+        if not linesearch:
+            if callable(sigma):
+                csigma = sigma(i, L)
+            else:
+                csigma = sigma
+            if callable(tau):
+                ctau = tau(i, L)
+            else:
+                ctau = tau
+            if callable(theta):
+                ctheta = theta(i, L)
+            else:
+                ctheta = theta
 
-        csigma = adapter.scalar(csigma)
-        ctau = adapter.scalar(ctau)
-        ctheta = adapter.scalar(ctheta)
+            csigma = adapter.scalar(csigma)
+            ctau = adapter.scalar(ctau)
+            ctheta = adapter.scalar(ctheta)
 
-        # Keep track of previous iterates
+        # Keep track of previous iterates. Only x is needed every iteration,
+        # the others only change in and are only read by the checks.
         iter_timing["copyprev"].tic()
+        check = i % conv_check in [0, conv_check - 1]
         adapter.copyto(prev_x, x)
-        adapter.copyto(prev_z, z)
-        adapter.copyto(prev_u, u)
-        adapter.copyto(prev_Kx, Kx)
+        if check:
+            adapter.copyto(prev_z, z)
+            adapter.copyto(prev_u, u)
+            if not linesearch:
+                adapter.copyto(prev_Kx, Kx)
+        if linesearch:
+            adapter.copyto(prev_y, y)
+            adapter.copyto(prev_KTy, KTy)
         iter_timing["copyprev"].toc()
 
-        # Compute z
-        iter_timing["calcz"].tic()
-        K_forward(xbar, Kxbar)
-        z = y + csigma * Kxbar
-        iter_timing["calcz"].toc()
+        if linesearch:
+            # Start from the largest step the last extrapolation allows.
+            prev_tau = ctau
+            if gamma > 0:
+                prev_beta = beta
+                beta = beta * (1.0 + gamma * prev_tau)
+                ctau = ctau * np.sqrt(prev_beta / beta)
+            ctau = adapter.scalar(ctau * np.sqrt(1.0 + ctheta))
+
+        while True:
+            # Compute z
+            iter_timing["calcz"].tic()
+            if linesearch:
+                ctheta = adapter.scalar(ctau / prev_tau)
+                csigma = adapter.scalar(beta * ctau)
+                # K xbar = Kx + theta*(Kx - prev_Kx)
+                adapter.copyto(Kxbar, Kx)
+                Kxbar -= prev_Kx
+                Kxbar *= ctheta
+                Kxbar += Kx
+            else:
+                K_forward(xbar, Kxbar)
+            adapter.copyto(z, Kxbar)
+            z *= csigma
+            z += prev_y if linesearch else y
+            adapter.copyto(z_scaled, z)
+            z_scaled *= adapter.scalar(1.0) / csigma
+            iter_timing["calcz"].toc()
+
+            # Update y.
+            offset = 0
+            for fn in psi_fns:
+                prox_log_tot[fn].tic()
+                slc = slice(offset, offset + fn.lin_op.size, None)
+                z_slc = adapter.reshape(z[slc], fn.lin_op.shape)
+                z_scaled_slc = adapter.reshape(z_scaled[slc], fn.lin_op.shape)
+                # Moreau identity: apply and time prox.
+                prox_log[fn].tic()
+                prox_off_and_fac(y[slc], z_slc, -csigma, fn, csigma, z_scaled_slc, i)
+                prox_log[fn].toc()
+                offset += fn.lin_op.size
+                prox_log_tot[fn].toc()
+            if offset < y.shape[0]:
+                y[offset:] = 0
+            if not linesearch:
+                break
 
-        # Update y.
-        offset = 0
-        for fn in psi_fns:
-            prox_log_tot[fn].tic()
-            slc = slice(offset, offset + fn.lin_op.size, None)
-            z_slc = adapter.reshape(z[slc], fn.lin_op.shape)
-            # Moreau identity: apply and time prox.
-            prox_log[fn].tic()
-            y[slc] = adapter.flatten( prox_off_and_fac(z_slc, -csigma, fn, csigma, z_slc / csigma, i) )
-            prox_log[fn].toc()
-            offset += fn.lin_op.size
-            prox_log_tot[fn].toc()
+            # Accept the step if
+            # sqrt(beta)*tau*||K^T(y - prev_y)|| <= delta*||y - prev_y||.
+            iter_timing["linesearch"].tic()
+            K_adjoint(y, KTy)
+            adapter.copyto(tau_KTy, KTy)
+            tau_KTy -= prev_KTy
+            adapter.copyto(tmp_y, y)
+            tmp_y -= prev_y
+            accept = np.sqrt(beta) * ctau * np.linalg.norm(adapter.to_np(tau_KTy)) <= \
+                ls_delta * np.linalg.norm(adapter.to_np(tmp_y))
+            iter_timing["linesearch"].toc()
+            if accept:
+                break
+            ctau = adapter.scalar(ctau * ls_shrink)
 
         iter_timing["calcx"].tic()
-        if offset < y.shape[0]:
-            y[offset:] = 0
         # Update x
-        K_adjoint(y, KTy)
-        x -= ctau * KTy
+        if linesearch:
+            adapter.copyto(prev_Kx, Kx)
+            adapter.copyto(tau_KTy, KTy)
+            tau_KTy *= ctau
+            x -= tau_KTy
+        else:
+            K_adjoint(y, KTy)
+            KTy *= ctau
+            x -= KTy
         iter_timing["calcx"].toc()
 
         iter_timing["omega_fn"].tic()
@@ -218,18 +341,29 @@ def solve(psi_fns, omega_fns, tau=None, sigma=None, theta=None,
             prox_log_tot[fn].tic()
             xtmp = adapter.reshape(x, fn.lin_op.shape)
             prox_log[fn].tic()
-            x[:] = adapter.flatten( prox(fn, adapter.scalar(1.0) / ctau, xtmp, x_init=prev_x,
-                                     lin_solver=lin_solver, options=lin_solver_options) )
+            prox(x, fn, adapter.scalar(1.0) / ctau, xtmp, x_init=prev_x,
+                 lin_solver=lin_solver, options=lin_solver_options)
             prox_log[fn].toc()
             prox_log_tot[fn].toc()
         iter_timing["omega_fn"].toc()
 
         iter_timing["xbar"].tic()
-        # Update xbar
-        adapter.copyto(xbar, x)
-        xbar += ctheta * (x - prev_x)
+        if linesearch:
+            # The next linesearch extrapolates Kx instead of xbar.
+            K_forward(x, Kx)
+        else:
+            # Update xbar
+            adapter.copyto(xbar, x)
+            xbar -= prev_x
+            xbar *= ctheta
+            xbar += x
         iter_timing["xbar"].toc()
 
+        if accel is not None:
+            iter_timing["accel"].tic()
+            accel.update()
+            iter_timing["accel"].toc()
+
         # Convergence log
         if convlog is not None:
             convlog.toc()
@@ -247,11 +381,21 @@ def solve(psi_fns, omega_fns, tau=None, sigma=None, theta=None,
         """
 
         # Residual based convergence check
-        if i % conv_check in [0, conv_check-1]:
+        if check:
             iter_timing["conv_check"].tic()
-            K_forward(x, Kx)
-            u = adapter.scalar(1.0) / csigma * y + ctheta * (Kx - prev_Kx)
-            z = prev_u + prev_Kx - adapter.scalar(1.0) / csigma * y
+            if not linesearch:
+                K_forward(x, Kx)
+            adapter.copyto(tmp_y, y)
+            tmp_y *= adapter.scalar(1.0) / csigma
+            # u = y/sigma + theta*(Kx - prev_Kx)
+            adapter.copyto(u, Kx)
+            u -= prev_Kx
+            u *= ctheta
+            u += tmp_y
+            # z = prev_u + prev_Kx - y/sigma
+            adapter.copyto(z, prev_u)
+            z += prev_Kx
+            z -= tmp_y
             iter_timing["conv_check"].toc()
 
         # Iteration order is different than
@@ -259,8 +403,12 @@ def solve(psi_fns, omega_fns, tau=None, sigma=None, theta=None,
         if i > 0 and i % conv_check == 0:
 
             # Check convergence
-            r = prev_Kx - z
-            K_adjoint(csigma * (z - prev_z), s)
+            adapter.copyto(r, prev_Kx)
+            r -= z
+            adapter.copyto(tmp_y, z)
+            tmp_y -= prev_z
+            tmp_y *= csigma
+            K_adjoint(tmp_y, s)
             eps_pri = np.sqrt(K.output_size) * eps_abs + eps_rel * \
                 max([np.linalg.norm(adapter.to_np(prev_Kx)), np.linalg.norm(adapter.to_np(z))])
 
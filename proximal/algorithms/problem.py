@@ -8,6 +8,7 @@ from proximal.lin_ops import Variable, CompGraph, est_CompGraph_norm, vstack
 from proximal.prox_fns import ProxFn
 from . import absorb
 from . import merge
+from .autotune import tune_all
 import numpy as np
 from numpy import linalg as LA
 
@@ -31,7 +32,7 @@ class Problem(object):
                  absorb=True, merge=True,
                  try_split=True, try_fast_norm=True, scale=True,
                  psi_fns=None, omega_fns=None,
-                 lin_solver="cg", solver="pc"):
+                 lin_solver="cg", solver="pc", dtype=np.float64):
         # Accept single function as argument.
         if isinstance(prox_fns, ProxFn):
             prox_fns = [prox_fns]
@@ -60,6 +61,8 @@ class Problem(object):
 
         self.solver = solver
         self.lin_solver = lin_solver
+        self.dtype = dtype  # Float type of the solver buffers.
+        self.tuning = None  # Options of autotune, if it was called.
 
     def set_absorb(self, absorb):
         """Try to absorb lin ops in prox fns?
@@ -79,6 +82,11 @@ class Problem(object):
         """
         self.implem = implem
 
+    def set_dtype(self, dtype=np.float64):
+        """Set the float type of the lin ops and solver buffers.
+        """
+        self.dtype = dtype
+
     def set_solver(self, solver):
         """Set the solver.
         """
@@ -89,10 +97,10 @@ class Problem(object):
         """
         self.lin_solver = lin_solver
 
-    def solve(self, solver=None, test_adjoints = False, test_norm = False, show_graph = False, *args, **kwargs):
-        if solver is None:
-            solver = self.solver
-
+    def transform(self):
+        """Returns the prox fns with lin ops and offsets absorbed and prox fns
+        merged, as set.
+        """
         if len(self.omega_fns + self.psi_fns) == 0:
             prox_fns = self.prox_fns
         else:
@@ -105,7 +113,39 @@ class Problem(object):
         if self.merge:
             prox_fns = merge.merge_all(prox_fns)
         # Absorb offsets.
-        prox_fns = [absorb.absorb_offset(fn) for fn in prox_fns]
+        return [absorb.absorb_offset(fn) for fn in prox_fns]
+
+    def autotune(self, cache=None, implems=None, repeats=3):
+        """Picks the fastest implementation of each lin op and prox fn.
+
+        Times the implementations each lin op and prox fn has on the shapes
+        of the problem and records the fastest one in cache, keyed by type
+        and shape. Later solves use the recorded choices instead of the
+        implementation set on the problem.
+
+        Parameters
+        ----------
+        cache : ImplCache, optional
+            Where to record the choices. Defaults to a cache on disk.
+        implems : list, optional
+            The implementations to try. Defaults to those installed.
+        repeats : int
+            The number of timed runs of each implementation.
+
+        Returns
+        -------
+        dict
+            Map from each lin op or prox fn with a choice to make to the
+            implementation chosen.
+        """
+        self.tuning = {'cache': cache, 'implems': implems, 'repeats': repeats}
+        return tune_all(self.transform(), dtype=self.dtype, **self.tuning)
+
+    def solve(self, solver=None, test_adjoints = False, test_norm = False, show_graph = False, *args, **kwargs):
+        if solver is None:
+            solver = self.solver
+
+        prox_fns = self.transform()
         # TODO more analysis of what solver to use.
         
         if show_graph:
@@ -120,10 +160,17 @@ class Problem(object):
             return fn.value
         elif solver in NAME_TO_SOLVER:
             module = NAME_TO_SOLVER[solver]
+            if module is hqs:
+                # The rho schedule of HQS is not a fixed-point iteration.
+                if kwargs.pop('accel', None) is not None:
+                    raise RuntimeError("Acceleration is not supported by HQS")
+                kwargs.pop('accel_mem', None)
+                kwargs.pop('accel_restart', None)
             if len(self.omega_fns + self.psi_fns) == 0:
                 if self.try_split and len(prox_fns) > 1 and len(self.variables()) == 1:
                     psi_fns, omega_fns = module.partition(prox_fns,
-                                                          self.try_diagonalize)
+                                                          self.try_diagonalize,
+                                                          self.dtype)
                 else:
                     psi_fns = prox_fns
                     omega_fns = []
@@ -131,7 +178,7 @@ class Problem(object):
                 psi_fns = self.psi_fns
                 omega_fns = self.omega_fns
             if test_norm:
-                L = CompGraph(vstack([fn.lin_op for fn in psi_fns]))
+                L = CompGraph.cached(vstack([fn.lin_op for fn in psi_fns]))
                 from numpy.random import random
 
                 output_mags = [NotImplemented]
@@ -151,8 +198,8 @@ class Problem(object):
                 
             # Scale the problem.
             if self.scale:
-                K = CompGraph(vstack([fn.lin_op for fn in psi_fns]),
-                              implem=self.implem)
+                K = CompGraph.cached(vstack([fn.lin_op for fn in psi_fns]),
+                                     implem=self.implem)
                 Knorm = est_CompGraph_norm(K, try_fast_norm=self.try_fast_norm)
                 for idx, fn in enumerate(psi_fns):
                     psi_fns[idx] = fn.copy(fn.lin_op / Knorm,
@@ -168,7 +215,7 @@ class Problem(object):
                 if test_adjoints is True:
                     test_adjoints = 1e-6
                 # test adjoints
-                L = CompGraph(vstack([fn.lin_op for fn in psi_fns]))
+                L = CompGraph.cached(vstack([fn.lin_op for fn in psi_fns]))
                 from numpy.random import random
                 
                 x = random(L.input_size)
@@ -194,13 +241,18 @@ class Problem(object):
                 else:
                     print("Adjoint test passed.", r)
                                     
+            if self.tuning is not None:
+                tune_all(psi_fns + omega_fns, dtype=self.dtype, **self.tuning)
             if self.implem == Impl['pycuda']:
                 kwargs['adapter'] = PyCudaAdapter()
+            elif self.implem == Impl['c']:
+                kwargs['implem'] = self.implem
             opt_val = module.solve(psi_fns, omega_fns,
                                    lin_solver=self.lin_solver,
                                    try_diagonalize=self.try_diagonalize,
                                    try_fast_norm=self.try_fast_norm,
                                    scaled=self.scale,
+                                   dtype=self.dtype,
                                    *args, **kwargs)
             # Unscale the variables.
             if self.scale:
@@ -0,0 +1,57 @@
+"""Benchmarks the construction of large computation graphs.
+
+Builds programmatically generated operator graphs with thousands of nodes
+and reports the time spent in CompGraph construction. Construction should
+scale linearly with the number of nodes.
+
+Run from the examples directory: python bench_comp_graph.py
+"""
+import sys
+sys.path.append('../../')
+
+import timeit
+import numpy as np
+from proximal.lin_ops import (Variable, CompGraph, conv, grad, mul_elemwise,
+                              subsample, vstack)
+
+
+def tiles_graph(num_tiles, tile_shape=(8, 8)):
+    """One variable per tile, each seen through a blur and a mask.
+    """
+    kernel = np.ones((3, 3)) / 9.
+    ops = []
+    for _ in range(num_tiles):
+        x = Variable(tile_shape)
+        mask = np.random.rand(*tile_shape)
+        ops.append(mul_elemwise(mask, conv(kernel, x)))
+        ops.append(grad(x))
+    return vstack(ops)
+
+
+def frames_graph(num_frames, frame_shape=(8, 8)):
+    """A single variable shared by all frames, each with its own operator.
+    """
+    x = Variable(frame_shape)
+    kernel = np.random.rand(3, 3)
+    ops = []
+    for _ in range(num_frames):
+        mask = np.random.rand(*frame_shape)
+        ops.append(subsample(mul_elemwise(mask, x) + conv(kernel, x), (2, 2)))
+    return vstack(ops)
+
+
+def time_construction(make_graph, size, repeats=3):
+    expr = make_graph(size)
+    best = min(timeit.repeat(lambda: CompGraph(expr), number=1, repeat=repeats))
+    return len(CompGraph(expr).nodes), best
+
+
+if __name__ == '__main__':
+    for name, make_graph in [('tiles', tiles_graph), ('frames', frames_graph)]:
+        print('%s graph' % name)
+        prev = None
+        for size in [250, 500, 1000, 2000]:
+            nodes, elapsed = time_construction(make_graph, size)
+            ratio = '' if prev is None else ', x%.2f' % (elapsed / prev)
+            print('  %5d nodes: %8.3f s%s' % (nodes, elapsed, ratio))
+            prev = elapsed
@@ -10,7 +10,7 @@ from .sum import sum, copy
 from .variable import Variable
 from .vstack import vstack, split
 from .hstack import hstack
-from .grad import grad
+from .grad import grad, laplacian
 from .warp import warp
 from .mul_color import mul_color
 from .reshape import reshape
@@ -1,4 +1,6 @@
 from .lin_op import LinOp
+import numpy as np
+from scipy.sparse.linalg import LinearOperator, eigsh
 
 
 def LinOpFactory(input_shape, output_shape, forward, adjoint, norm_bound=None):
@@ -15,7 +17,8 @@ def LinOpFactory(input_shape, output_shape, forward, adjoint, norm_bound=None):
     adjoint : function
         Applies the adjoint operator to an input array and writes to an output.
     norm_bound : float, optional
-        An upper bound on the spectral norm of the operator.
+        An upper bound on the spectral norm of the operator. Estimated from
+        forward and adjoint if not given.
     """
     def get_black_box(arg):
         return BlackBox(arg, input_shape, output_shape,
@@ -63,6 +66,27 @@ class BlackBox(LinOp):
             Magnitude of outputs.
         """
         if self._norm_bound is None:
-            return super(BlackBox, self).norm_bound(input_mags)
+            return self.estimate_norm() * input_mags[0]
         else:
             return self._norm_bound * input_mags[0]
+
+    def estimate_norm(self, tol=1e-3):
+        """Estimates the spectral norm of the operator.
+
+        Runs a Lanczos iteration on A^TA, which only applies the black box
+        rather than the whole computation graph.
+        """
+        arg = self.input_nodes[0]
+        output = np.zeros(self.shape)
+        result = np.zeros(arg.shape)
+
+        def AtA(x):
+            self.forward([np.reshape(x, arg.shape)], [output])
+            self.adjoint([output], [result])
+            return result.flatten()
+
+        size = int(np.prod(arg.shape))
+        if size == 1:
+            return np.sqrt(abs(AtA(np.ones(1))[0]))
+        A = LinearOperator((size, size), AtA, AtA)
+        return float(np.sqrt(np.abs(eigsh(A, k=1, which='LM', tol=tol)[0][0])))
@@ -1,15 +1,28 @@
 from .sum import copy
+from .sum import sum as sum_op
 from .edge import Edge
 from .variable import Variable
 from .constant import Constant
 from .vstack import split
 from ..utils.cuda_codegen import CudaSubGraph, gpuarray
+from ..utils.c_codegen import CSubGraph, c_compiler_available
 from .vstack import vstack
+from .scale import scale
+from .mul_elemwise import mul_elemwise
+from .conv import conv
 from proximal.utils.timings_log import TimingsLog
+from proximal.utils.utils import Impl
+from proximal.utils.norm_cache import norm_cache
 import copy as cp
-from collections import defaultdict
+import bisect
+import hashlib
+import heapq
+from itertools import chain
+from collections import defaultdict, deque, OrderedDict
+from multiprocessing.pool import ThreadPool
 import numpy as np
-from scipy.sparse.linalg import LinearOperator, eigs
+import scipy.sparse as sp
+from scipy.sparse.linalg import LinearOperator, eigsh
 
 class CompGraph(object):
     """A computation graph representing a composite lin op.
@@ -17,12 +30,36 @@ class CompGraph(object):
     
     instanceCnt = 0
 
-    def __init__(self, end, implem=None):
+    # Graphs built by CompGraph.cached, most recently used last. A cache_size
+    # of 0 disables the cache.
+    cache = OrderedDict()
+    cache_size = 16
+
+    # Largest number of nonzeros for which sparse graphs use a matrix.
+    sparse_max_nnz = 10**7
+
+    def __init__(self, end, implem=None, num_threads=1, dtype=np.float64,
+                 sparse=False):
+        self.num_threads = num_threads
+        self.dtype = dtype
+        self.implem = implem
+        self.pool = None
         self.instanceID = CompGraph.instanceCnt
         CompGraph.instanceCnt += 1
         self.orig_end = end
+        # Equal subtrees share one copy, fanned out like shared nodes.
+        # Subtrees without variables are zero and sums skip them.
+        subexprs, zeros = self.subexpressions(end)
+        root = self.skip_unary_sums(end, subexprs, zeros)
+        if not isinstance(root, Variable):
+            end = root
         self.end = cp.copy(end)
         self.end.orig_node = end.orig_node
+        # The scale nodes of the lin op tree and their copies, so the
+        # scalars can be updated in place. See update_scalars.
+        self.scale_copies = []
+        if isinstance(end, scale):
+            self.scale_copies.append((end, self.end))
         self.shape = self.end.shape
         # Construct via graph traversal.
         self.nodes = []
@@ -32,38 +69,47 @@ class CompGraph(object):
         self.output_edges = {}
         new_vars = []
         # Assumes all nodes have at most one output.
-        ready = [self.end]
-        done = []
+        ready = deque([self.end])
+        queued = set([self.end])
         node_to_copies = {}
         self.split_nodes = {}
         while len(ready) > 0:
-            curr = ready.pop(0)
-            done.append(curr)
+            curr = ready.popleft()
             if isinstance(curr, Variable):
                 # new_vars may contain specific variables more than once
                 new_vars.append(curr)
             # Zero out constants.
             self.nodes.append(curr)
             input_edges = []
-            for node in curr.input_nodes:
+            args = [self.skip_unary_sums(node, subexprs, zeros)
+                    for node in curr.input_nodes]
+            if isinstance(curr, sum_op):
+                nonzero = [node for node in args if subexprs[id(node)] not in zeros]
+                if 0 < len(nonzero) < len(args):
+                    args = curr.input_nodes = nonzero
+            for node in args:
                 # Zero out constants. Constants are handled in absorb_offset
-                if isinstance(node, Constant):
-                    node = Constant(np.zeros(curr.shape))
+                if subexprs[id(node)] in zeros:
+                    node = Constant(np.zeros(curr.shape if isinstance(curr, sum_op)
+                                             else node.shape))
                     node.orig_node = None
                     self.constants.append(node)
                 else:
                     # avoid copying too many nodes
-                    if not node in node_to_copies:                            
+                    subexpr = subexprs[id(node)]
+                    if not subexpr in node_to_copies:
                         cnode = cp.copy(node)
-                        node.orig_node = node.orig_node
-                        node_to_copies[node] = cnode
+                        node_to_copies[subexpr] = cnode
                     else:
-                        self.split_nodes[node_to_copies[node]] = True
-                    node = node_to_copies[node]
+                        self.split_nodes[node_to_copies[subexpr]] = True
+                    if isinstance(node, scale):
+                        self.scale_copies.append((node, node_to_copies[subexpr]))
+                    node = node_to_copies[subexpr]
                     # Default implementation.
                     if implem is not None:
                         node.implem = implem
-                if not node in ready and not node in done:
+                if node not in queued:
+                    queued.add(node)
                     ready.append(node)
                 edge = Edge(node, curr, node.shape)
                 input_edges.append(edge)
@@ -85,7 +131,7 @@ class CompGraph(object):
             self.input_edges[copy_node] = self.output_edges[n]
             self.output_edges[copy_node] = []
             self.nodes.append(copy_node)
-            for ns in outnodes:
+            for ns in OrderedDict.fromkeys(outnodes):
                 inedges = self.input_edges[ns]
                 newinedges = []
                 for e in inedges:
@@ -98,7 +144,10 @@ class CompGraph(object):
                 self.input_edges[ns] = newinedges            
 
         # Make copy node for each variable.
-        old_vars = self.orig_end.variables()
+        # The variables met in the traversal, unique and ordered by uuid
+        # like LinOp.variables().
+        old_vars = sorted(dict([(var.uuid, var) for var in new_vars]).values(),
+                          key=lambda var: var.uuid)
         id2copy = {}
         copy_nodes = []
         self.var_info = {}
@@ -114,6 +163,10 @@ class CompGraph(object):
             self.nodes.append(copy_node)
 
         # Replace variables with copy nodes in graph.
+        position = {}
+        for edges in self.input_edges.values():
+            for idx, edge in enumerate(edges):
+                position[edge] = idx
         for var in new_vars:
             copy_node = id2copy[var.uuid]
             for output_edge in self.output_edges[var]:
@@ -121,7 +174,7 @@ class CompGraph(object):
                 edge = Edge(copy_node, output_node, var.shape)
                 self.edges.append(edge)
                 self.output_edges[copy_node].append(edge)
-                idx = self.input_edges[output_node].index(output_edge)
+                idx = position[output_edge]
                 #print("Variable %s(%s): idx=%d" % (var.varname, var.uuid, idx))
                 self.input_edges[output_node][idx] = edge
 
@@ -143,11 +196,367 @@ class CompGraph(object):
         
         self.cuda_forward_subgraphs = None
         self.cuda_adjoint_subgraphs = None
-        
+        self.c_forward_subgraphs = None
+        self.c_adjoint_subgraphs = None
+
+        self.fuse_chains()
+        for node in self.nodes:
+            node.set_dtype(self.dtype)
+
         # A record of timings.
         self.forward_log = TimingsLog(self.nodes + [self])
         self.adjoint_log = TimingsLog(self.nodes + [self])
-        
+
+        self.plan_memory()
+        self.compile_schedule()
+
+        # Small operators run as a single sparse matrix product.
+        self.sparse_K = None
+        if sparse:
+            K = self.to_sparse(self.sparse_max_nnz)
+            if K is not NotImplemented:
+                self.sparse_K = K
+                self.sparse_KT = K.T.tocsr()
+
+    def __del__(self):
+        self.close()
+
+    def close(self):
+        """Terminates the thread pool of the graph.
+
+        The pool is started again if the graph is evaluated later.
+        """
+        if getattr(self, 'pool', None) is not None:
+            self.pool.terminate()
+            self.pool = None
+
+    @classmethod
+    def cached(cls, end, implem=None, num_threads=1, dtype=np.float64,
+               sparse=False):
+        """Returns a graph for end, reusing a previously built one if possible.
+
+        Graphs are matched on the structure of the lin op tree. Variables are
+        matched by identity and parameters by value, so a hit computes the
+        same operator and comes with its buffers already allocated. The cache
+        holds the cache_size most recently used graphs, and is disabled if
+        cache_size is 0.
+        """
+        if cls.cache_size <= 0:
+            return cls(end, implem=implem, num_threads=num_threads,
+                       dtype=dtype, sparse=sparse)
+        refs = []
+        key = (cls.structure_key(end, {}, refs), implem, num_threads,
+               np.dtype(dtype), sparse)
+        if key in cls.cache:
+            graph = cls.cache.pop(key)[0]
+        else:
+            graph = cls(end, implem=implem, num_threads=num_threads,
+                        dtype=dtype, sparse=sparse)
+            while len(cls.cache) >= cls.cache_size:
+                cls.cache.popitem(last=False)[1][0].close()
+        # Keep the matched objects alive so their ids are not reused.
+        cls.cache[key] = (graph, refs)
+        return graph
+
+    @classmethod
+    def clear_cache(cls):
+        """Drops all graphs built by CompGraph.cached.
+        """
+        while len(cls.cache) > 0:
+            cls.cache.popitem()[1][0].close()
+
+    def update_scalars(self):
+        """Updates the graph after the scalars of scale nodes in its lin op
+        tree were changed in place.
+
+        Returns False if the graph has to be built again instead, which is
+        the case for sparse graphs and for equal subtrees evaluated once that
+        now differ.
+        """
+        if self.sparse_K is not None:
+            return False
+        scalars = OrderedDict()
+        for orig, node in self.scale_copies:
+            if scalars.setdefault(node, orig.scalar) != orig.scalar:
+                return False
+        for node, scalar in scalars.items():
+            node.scalar = scalar
+        # Fuse the chains again, in the order they were fused.
+        for fused, inner, outer in self.fusions:
+            params = self.fuse_pair(inner, outer)
+            for name, value in params.__dict__.items():
+                if name not in ['input_nodes', 'orig_node', 'linop_id'] and \
+                   not name.startswith('tmp'):
+                    setattr(fused, name, value)
+            fused.set_dtype(self.dtype)
+        # The kernels and the gram operator are built again on demand.
+        self.cuda_forward_subgraphs = None
+        self.cuda_adjoint_subgraphs = None
+        self.c_forward_subgraphs = None
+        self.c_adjoint_subgraphs = None
+        self.gram_op = None
+        return True
+
+    @classmethod
+    def structure_key(cls, node, seen, refs):
+        """Returns a hashable key describing the lin op tree rooted at node.
+
+        seen maps the ids of visited nodes to their visiting order, so shared
+        subtrees are told apart from equal copies. Objects matched by
+        identity are appended to refs.
+        """
+        if id(node) in seen:
+            return ('shared', seen[id(node)])
+        seen[id(node)] = len(seen)
+        refs.append(node)
+        if isinstance(node, Variable):
+            return ('Variable', node.uuid, node.shape)
+        if isinstance(node, Constant):
+            # Constants are zeroed in the graph.
+            return ('Constant', node.shape)
+        children = tuple([cls.structure_key(arg, seen, refs)
+                          for arg in node.input_nodes])
+        return (type(node), cls.params_key(node, refs), children)
+
+    def norm_keys(self):
+        """Returns digests of the graph with and without its parameters.
+
+        Unlike the keys of CompGraph.cached, the digests are the same in
+        every run: variables are numbered in order of appearance and plain
+        functions by name and code. Returns (None, None) if some parameter
+        can only be matched by identity, like a closure.
+        """
+        variables = {}
+
+        def function_key(func):
+            code = getattr(func, '__code__', None)
+            if code is None or func.__closure__ is not None:
+                raise ValueError("Parameter without a stable key.")
+            digest = hashlib.sha1(code.co_code + repr(code.co_names).encode('utf-8'))
+            return ('function', func.__module__,
+                    getattr(func, '__qualname__', func.__name__), digest.hexdigest())
+
+        def canonical(item, params):
+            if isinstance(item, tuple):
+                if len(item) == 2 and item[0] == 'id':
+                    return function_key(objects.get(item[1]))
+                elif len(item) == 3 and item[0] == 'Variable':
+                    return ('Variable', variables.setdefault(item[1], len(variables)),
+                            item[2])
+                elif len(item) == 4 and item[0] == 'array' and not params:
+                    return item[:3]
+                return tuple([canonical(elem, params) for elem in item])
+            elif isinstance(item, type):
+                return item.__module__ + '.' + item.__name__
+            elif isinstance(item, np.generic):
+                item = item.item()
+            if not params and isinstance(item, (float, complex)):
+                return type(item).__name__
+            return item
+
+        refs = []
+        key = self.structure_key(self.orig_end, {}, refs)
+        objects = dict([(id(obj), obj) for obj in refs])
+        try:
+            digests = []
+            for params in [True, False]:
+                variables.clear()
+                text = repr((canonical(key, params), np.dtype(self.dtype).str))
+                digests.append(hashlib.sha1(text.encode('utf-8')).hexdigest())
+        except ValueError:
+            return None, None
+        return tuple(digests)
+
+    @classmethod
+    def params_key(cls, node, refs):
+        """Returns a hashable key for the parameters of a lin op.
+        """
+        params = []
+        for name in sorted(node.__dict__):
+            # Scratch buffers (tmp*) do not define the operator.
+            if name in ['input_nodes', 'orig_node', 'linop_id', 'implem'] or \
+               name.startswith('tmp'):
+                continue
+            params.append((name, cls.param_key(node.__dict__[name], refs)))
+        return tuple(params)
+
+    @classmethod
+    def subexpressions(cls, end):
+        """Numbers the subtrees of the lin op tree rooted at end by structure.
+
+        Returns a dict from node ids to numbers and the set of numbers of
+        subtrees without variables, which are zero in the graph. Subtrees
+        with the same lin op types, parameters and inputs get the same
+        number, so the graph evaluates them once.
+        """
+        numbers = {}
+        zeros = set()
+        keys = {}
+        refs = []
+        stack = [(end, False)]
+        while len(stack) > 0:
+            node, visited = stack.pop()
+            if id(node) in numbers:
+                continue
+            if not visited:
+                stack.append((node, True))
+                stack += [(arg, False) for arg in node.input_nodes]
+                continue
+            if isinstance(node, Variable):
+                key = ('Variable', node.uuid, node.shape)
+            elif (isinstance(node, Constant) or
+                  all([numbers[id(arg)] in zeros for arg in node.input_nodes])):
+                # Constants are zeroed in the graph, and so is any lin op
+                # of them.
+                key = ('Constant', node.shape)
+            else:
+                key = (type(node), cls.params_key(node, refs),
+                       tuple([numbers[id(arg)] for arg in node.input_nodes]))
+            numbers[id(node)] = keys.setdefault(key, len(keys))
+            if key[0] == 'Constant':
+                zeros.add(numbers[id(node)])
+        return numbers, zeros
+
+    @staticmethod
+    def skip_unary_sums(node, subexprs, zeros):
+        """Returns the input of node if it sums it with zeros only.
+
+        Repeats for chains of such sums. subexprs and zeros are as returned
+        by subexpressions.
+        """
+        while isinstance(node, sum_op):
+            nonzero = [arg for arg in node.input_nodes
+                       if subexprs[id(arg)] not in zeros]
+            if len(nonzero) != 1 or nonzero[0].shape != node.shape:
+                break
+            node = nonzero[0]
+        return node
+
+    @classmethod
+    def param_key(cls, value, refs):
+        """Returns a hashable key for a lin op parameter.
+        """
+        if value is None or isinstance(value, (bool, int, float, complex,
+                                               str, np.number)):
+            return value
+        if isinstance(value, (tuple, list)):
+            return tuple([cls.param_key(item, refs) for item in value])
+        if isinstance(value, np.ndarray) and value.dtype.kind in 'biufc':
+            digest = hashlib.sha1(np.ascontiguousarray(value)).hexdigest()
+            return ('array', value.shape, value.dtype.str, digest)
+        refs.append(value)
+        return ('id', id(value))
+
+    def fuse_chains(self):
+        """Collapses chains of lin ops into single nodes.
+
+        Chains of scale and mul_elemwise become one node multiplying by the
+        product of the weights, so each chain costs one pass over memory.
+        Chains of FFT convolutions with the same dims, and scales around
+        them, become one convolution whose OTF is the product of the OTFs,
+        so each chain costs one FFT pair.
+        """
+        # The fused nodes with the pairs they replace, for update_scalars.
+        self.fusions = []
+        # Nodes replaced by fused nodes, and nodes and edges fused away.
+        replaced = {}
+        removed = set()
+        removed_edges = set()
+        for outer in list(self.nodes):
+            if outer in removed:
+                continue
+            while True:
+                edges = self.input_edges.get(outer, [])
+                if len(edges) != 1 or \
+                   len(self.output_edges.get(edges[0].start, [])) != 1:
+                    break
+                inner = edges[0].start
+                fused = self.fuse_pair(inner, outer)
+                if fused is None:
+                    break
+                removed_edges.add(self.replace_chain(inner, outer, fused))
+                self.fusions.append((fused, inner, outer))
+                removed.update([inner, outer])
+                replaced[outer] = fused
+                outer = fused
+
+        def resolve(node):
+            while node in replaced:
+                node = replaced[node]
+            return node
+        nodes = [resolve(node) for node in self.nodes]
+        self.nodes = [node for node in nodes if node not in removed]
+        self.edges = [edge for edge in self.edges if edge not in removed_edges]
+
+    def fuse_pair(self, inner, outer):
+        """Returns a single node computing outer(inner(x)).
+
+        Returns None if the two nodes cannot be fused.
+        """
+        pair = [inner, outer]
+        convs = [node for node in pair if isinstance(node, conv)]
+        if all([isinstance(node, scale) for node in pair]):
+            fused = cp.copy(outer)
+            fused.scalar = inner.scalar * outer.scalar
+        elif all([isinstance(node, (scale, mul_elemwise)) for node in pair]):
+            weight = np.ones(outer.shape)
+            implem = Impl['numpy']
+            for node in pair:
+                if isinstance(node, scale):
+                    weight *= node.scalar
+                else:
+                    weight *= node.weight
+                    implem = node.implementation
+            fused = mul_elemwise(weight, inner.input_nodes[0], implem)
+            if implem != Impl['halide']:
+                # Keep the product in double precision instead of the single
+                # precision of Halide, set_dtype casts it for the graph.
+                fused.weight = weight
+            fused.orig_node = outer.orig_node
+        elif convs and all([isinstance(node, (scale, conv)) for node in pair]):
+            if any([node.use_halide() for node in convs]) or \
+               inner.shape != outer.shape or \
+               (len(convs) == 2 and inner.dims != outer.dims):
+                return None
+            fused = cp.copy(convs[-1])
+            otf = 1
+            for node in pair:
+                if isinstance(node, scale):
+                    otf = otf * node.scalar
+                    if fused.kernel is not None:
+                        fused.kernel = fused.kernel * node.scalar
+                else:
+                    otf = otf * node.forward_kernel
+            fused.forward_kernel = otf
+            fused.adjoint_kernel = otf.conj()
+            if len(convs) == 2:
+                # The spatial kernel is only needed by Halide.
+                fused.kernel = None
+                fused.initialized = True
+        else:
+            return None
+        fused.input_nodes = inner.input_nodes
+        return fused
+
+    def replace_chain(self, inner, outer, fused):
+        """Replaces the chain inner -> outer with the node fused.
+
+        Returns the edge between inner and outer. The caller drops it from
+        self.edges, and inner and outer from self.nodes.
+        """
+        in_edge = self.input_edges.pop(inner)[0]
+        mid_edge = self.output_edges.pop(inner)[0]
+        in_edge.end = fused
+        self.input_edges[fused] = [in_edge]
+        del self.input_edges[outer]
+        if outer is self.end:
+            self.end = fused
+        else:
+            self.output_edges[fused] = self.output_edges.pop(outer)
+            for edge in self.output_edges[fused]:
+                edge.start = fused
+        return mid_edge
+
     def input_nodes(self, node):
         return list([e.start for e in self.input_edges[node]])
 
@@ -180,13 +589,15 @@ class CompGraph(object):
         # Nodes who want to be isolated can either not implement the forward_cuda_kernel
         # function or override the function cuda_kernel_available(self) and return false.
         
+        end, input_nodes, output_nodes = self.kernel_graph()
+
         # forward direction
-        self.cuda_forward_subgraphs = CudaSubGraph(self.input_nodes, self.output_nodes, self.end)
+        self.cuda_forward_subgraphs = CudaSubGraph(input_nodes, output_nodes, end)
         self.cuda_forward_subgraphs.gen_code("forward_cuda_kernel")
         #print("Forward subgraphs:")
         #self.cuda_forward_subgraphs.visualize()
         
-        self.cuda_adjoint_subgraphs = CudaSubGraph(self.output_nodes, self.input_nodes, self.start)
+        self.cuda_adjoint_subgraphs = CudaSubGraph(output_nodes, input_nodes, self.start)
         self.cuda_adjoint_subgraphs.gen_code("adjoint_cuda_kernel")
         #print("Adjoint subgraphs:")
         #self.cuda_adjoint_subgraphs.visualize()
@@ -243,71 +654,584 @@ class CompGraph(object):
             if printt: print(t)
         return x
         
-    def forward(self, x, y):
-        """Evaluates the forward composition.
+    def kernel_graph(self):
+        """Returns the end node and the input and output node functions used
+           to generate kernels.
 
-        Reads from x and writes to y.
+        The adjoint kernels read the input of the graph in a vstack at the end,
+        so any other end node is wrapped in a vstack of its own.
         """
-        def forward_eval(node):
-            if node is self.start:
-                inputs = [x]
-            else:
-                inputs = self.get_inputs(node)
+        if isinstance(self.end, vstack):
+            return self.end, self.input_nodes, self.output_nodes
+        end = vstack([self.end])
 
-            if node is self.end:
-                outputs = [y]
-            else:
-                outputs = self.get_outputs(node)
-            # Run forward op and time it.
-            self.forward_log[node].tic()
-            node.forward(inputs, outputs)
-            #if node in self.split_nodes:
-            #    for io in range(1,len(outputs)):
-            #        np.copyto(outputs[io], outputs[0])
-            self.forward_log[node].toc()
-            
+        def input_nodes(node):
+            return [self.end] if node is end else self.input_nodes(node)
+
+        def output_nodes(node):
+            return [end] if node is self.end else self.output_nodes(node)
+        return end, input_nodes, output_nodes
+
+    def gen_c_code(self):
+        # Same as gen_cuda_code, but the kernels are built for the cpu. If
+        # the graph input has no kernel, the graph runs in numpy.
+        if not (c_compiler_available() and self.start.cuda_kernel_available()):
+            self.c_forward_subgraphs = NotImplemented
+            self.c_adjoint_subgraphs = NotImplemented
+            return
+        end, input_nodes, output_nodes = self.kernel_graph()
+        self.c_forward_subgraphs = CSubGraph(input_nodes, output_nodes, end)
+        self.c_forward_subgraphs.gen_code("forward_cuda_kernel", dtype=self.dtype)
+
+        self.c_adjoint_subgraphs = CSubGraph(output_nodes, input_nodes, self.start)
+        self.c_adjoint_subgraphs.gen_code("adjoint_cuda_kernel", dtype=self.dtype)
+
+    def run_c(self, subgraphs, x, y):
+        """Applies the C kernels in subgraphs, reading from x and writing to y.
+        """
+        x = np.ascontiguousarray(np.ravel(x), dtype=self.dtype)
+        out = y
+        if not (isinstance(y, np.ndarray) and y.dtype == self.dtype and
+                y.flags.c_contiguous):
+            out = np.empty(np.shape(y), dtype=self.dtype)
+        subgraphs.apply(x, np.ravel(out))
+        if out is not y:
+            np.copyto(y, out)
+        return y
+
+    def forward_c(self, x, y):
+        """Evaluates the forward composition with the C kernels.
+
+        Reads from x and writes to y.
+        """
+        if self.c_forward_subgraphs is None:
+            self.gen_c_code()
+        if self.c_forward_subgraphs is NotImplemented:
+            return self.forward(x, y, numpy=True)
         self.forward_log[self].tic()
-        # Evaluate forward graph and time it.
-        self.traverse_graph(forward_eval, True)
+        self.run_c(self.c_forward_subgraphs, x, y)
         self.forward_log[self].toc()
         return y
 
-    def adjoint(self, u, v):
-        """Evaluates the adjoint composition.
+    def adjoint_c(self, u, v):
+        """Evaluates the adjoint composition with the C kernels.
 
         Reads from u and writes to v.
         """
-        def adjoint_eval(node):
+        if self.c_adjoint_subgraphs is None:
+            self.gen_c_code()
+        if self.c_adjoint_subgraphs is NotImplemented:
+            return self.adjoint(u, v, numpy=True)
+        self.adjoint_log[self].tic()
+        self.run_c(self.c_adjoint_subgraphs, u, v)
+        self.adjoint_log[self].toc()
+        return v
+
+    def execution_steps(self, forward):
+        """Returns the step at which each node runs in the given direction.
+
+        Nodes run one per step, in traversal order. With several threads a
+        node runs one step after the last node it depends on, and the nodes
+        sharing a step run concurrently.
+        """
+        steps = {}
+
+        def visit(node):
+            if node in steps:
+                return
+            if self.num_threads > 1:
+                if forward:
+                    deps = [e.start for e in self.input_edges.get(node, [])]
+                else:
+                    deps = [e.end for e in self.output_edges.get(node, [])]
+                steps[node] = 1 + max([steps[dep] for dep in deps] + [-1])
+            else:
+                steps[node] = len(steps)
+        self.traverse_graph(visit, forward)
+        return steps
+
+    def plan_memory(self):
+        """Assigns the edge buffers to a small pool of reusable arenas.
+
+        Lin ops that only rearrange data (vstack, split, reshape, transpose)
+        become views: their edges alias a single buffer and the lin op is
+        dropped from the schedule. Liveness is computed over both the forward
+        and the adjoint execution steps. Buffers whose live ranges are
+        disjoint in both directions share an arena, and nodes that can run in
+        place write their output into their input buffer.
+        """
+        self.forward_steps = self.execution_steps(True)
+        self.adjoint_steps = self.execution_steps(False)
+        forward_pos = self.forward_steps
+        adjoint_pos = self.adjoint_steps
+        edges = [e for node in forward_pos for e in self.input_edges.get(node, [])]
+
+        # Stand-ins for the arrays passed to forward and adjoint.
+        self.start_edge = Edge(None, self.start, (self.input_size,))
+        self.end_edge = Edge(self.end, None, self.end.shape)
+
+        # Views form trees of edges hanging off a root buffer.
+        # view_children maps an edge to (node, views, child edges) entries.
+        view_parent = {}
+        self.view_children = defaultdict(list)
+        self.view_nodes = set()
+
+        def find(e):
+            while e in view_parent:
+                e = view_parent[e]
+            return e
+
+        def add_view(node, parent, children, views):
+            for child in children:
+                if child in view_parent or find(parent) is child:
+                    return
+            for child in children:
+                view_parent[child] = parent
+            self.view_children[parent].append((node, views, children))
+            if views is not self._same_buffer:
+                self.view_nodes.add(node)
+
+        def remove_view(entry, parent):
+            node, views, children = entry
+            self.view_children[parent].remove(entry)
+            self.view_nodes.discard(node)
+            for child in children:
+                del view_parent[child]
+
+        def valid_views(views, array, children):
+            arrays = views(array)
+            if arrays is NotImplemented:
+                return None
+            for child, view in zip(children, arrays):
+                if view.shape != tuple(child.shape) or \
+                   not np.may_share_memory(view, array):
+                    return None
+            return arrays
+
+        for node in forward_pos:
+            if node is self.start:
+                in_edges = [self.start_edge]
+            else:
+                in_edges = self.input_edges[node]
             if node is self.end:
-                outputs = [u]
+                out_edges = [self.end_edge]
+            else:
+                out_edges = self.output_edges[node]
+            if len(out_edges) == 1 and valid_views(
+                    node.input_views, np.empty(out_edges[0].shape), in_edges):
+                add_view(node, out_edges[0], in_edges, node.input_views)
+            elif len(in_edges) == 1 and valid_views(
+                    node.output_views, np.empty(in_edges[0].shape), out_edges):
+                add_view(node, in_edges[0], out_edges, node.output_views)
+
+        # Check the views against the layout of their parent. A view of a
+        # transposed buffer, for instance, may not be expressible.
+        all_edges = edges + [self.start_edge, self.end_edge]
+        contiguous = {}
+        probes = [(e, np.empty(e.shape)) for e in all_edges if e not in view_parent]
+        for edge, probe in probes:
+            contiguous[edge] = probe.flags.c_contiguous
+            for entry in list(self.view_children[edge]):
+                arrays = valid_views(entry[1], probe, entry[2])
+                if arrays is None:
+                    remove_view(entry, edge)
+                    probes += [(c, np.empty(c.shape)) for c in entry[2]]
+                else:
+                    probes += zip(entry[2], arrays)
+
+        # Nodes running in place never write to the caller's arrays.
+        external = (self.start_edge, self.end_edge)
+        for node in forward_pos:
+            if node is self.start or node is self.end or \
+               node in self.view_nodes or not node.can_run_in_place():
+                continue
+            in_edges = self.input_edges[node]
+            out_edges = self.output_edges[node]
+            if len(in_edges) != 1 or len(out_edges) != 1 or \
+               tuple(in_edges[0].shape) != tuple(out_edges[0].shape):
+                continue
+            in_edge, out_edge = in_edges[0], out_edges[0]
+            if find(in_edge) in external or find(out_edge) in external:
+                continue
+            if out_edge not in view_parent and contiguous[in_edge]:
+                add_view(node, in_edge, [out_edge], self._same_buffer)
+            elif in_edge not in view_parent and contiguous[out_edge]:
+                add_view(node, out_edge, [in_edge], self._same_buffer)
+
+        self.external_edges = set()
+        for root in external:
+            self.external_edges.update([e for e, _ in self._tree_views(root, None)])
+
+        # Live range of each buffer as (forward, adjoint) step intervals.
+        live = {}
+        for e in edges:
+            root = find(e)
+            if root in external:
+                continue
+            fwd = (forward_pos[e.start], forward_pos[e.end])
+            adj = (adjoint_pos[e.end], adjoint_pos[e.start])
+            if root in live:
+                (f0, f1), (a0, a1) = live[root]
+                fwd = (min(f0, fwd[0]), max(f1, fwd[1]))
+                adj = (min(a0, adj[0]), max(a1, adj[1]))
+            live[root] = (fwd, adj)
+
+        # Greedy best-fit assignment of buffers to arenas. The buffers of an
+        # arena have pairwise disjoint live ranges in both directions, and
+        # they are assigned by increasing forward start. So an arena is free
+        # once the forward range of its last buffer has ended, and a buffer
+        # fits a free arena if its adjoint range lies before or after all
+        # adjoint ranges of the arena. Free arenas are bucketed by size, and
+        # each bucket is indexed by the adjoint start and end of its arenas,
+        # so finding a fit costs a few heap operations per distinct size.
+        # Each arena is [size, roots, adjoint start, adjoint end, version].
+        # Heap entries pushed before an arena was last taken are stale.
+        arenas = []
+        busy = []  # Heap of (forward end, arena index).
+        sizes = []  # Sorted sizes of the buckets.
+        count = defaultdict(int)  # Number of free arenas per size.
+        ends = defaultdict(list)  # Heaps of (adjoint end, index, version).
+        starts = defaultdict(list)  # Heaps of (-adjoint start, index, version).
+
+        def fit(size, a0, a1):
+            for heap, fits in [(ends[size], lambda key: key < a0),
+                               (starts[size], lambda key: -key > a1)]:
+                while heap and arenas[heap[0][1]][4] != heap[0][2]:
+                    heapq.heappop(heap)
+                if heap and fits(heap[0][0]):
+                    return heap[0][1]
+            return None
+
+        for root in sorted(live, key=lambda r: live[r][0]):
+            size = int(root.size)
+            (f0, f1), (a0, a1) = live[root]
+            while busy and busy[0][0] < f0:
+                idx = heapq.heappop(busy)[1]
+                arena = arenas[idx]
+                if arena[0] not in count:
+                    bisect.insort(sizes, arena[0])
+                count[arena[0]] += 1
+                heapq.heappush(ends[arena[0]], (arena[3], idx, arena[4]))
+                heapq.heappush(starts[arena[0]], (-arena[2], idx, arena[4]))
+            pos = bisect.bisect_left(sizes, size)
+            best = None
+            for j in chain(range(pos, len(sizes)), range(pos - 1, -1, -1)):
+                if count[sizes[j]] > 0:
+                    best = fit(sizes[j], a0, a1)
+                    if best is not None:
+                        break
+            if best is None:
+                best = len(arenas)
+                arenas.append([size, [root], a0, a1, 0])
             else:
-                outputs = self.get_outputs(node)
+                arena = arenas[best]
+                count[arena[0]] -= 1
+                arena[0] = max(arena[0], size)
+                arena[1].append(root)
+                arena[2] = min(arena[2], a0)
+                arena[3] = max(arena[3], a1)
+                arena[4] += 1
+            heapq.heappush(busy, (f1, best))
+
+        self.arena_roots = [(arena[0], arena[1]) for arena in arenas]
+        self.arenas = []
+        for size, roots in self.arena_roots:
+            buf = np.zeros(int(size), dtype=self.dtype)
+            self.arenas.append(buf)
+            for root in roots:
+                data = np.reshape(buf[:int(root.size)], root.shape)
+                for e, view in self._tree_views(root, data):
+                    e.data = view
+
+    @staticmethod
+    def _same_buffer(array):
+        return [array]
+
+    def _tree_views(self, root, array):
+        """Returns (edge, array) pairs for root and all views of its buffer.
+
+        With array None only the edges are enumerated.
+        """
+        pairs = [(root, array)]
+        for edge, data in pairs:
+            for node, views, children in self.view_children.get(edge, []):
+                if data is None:
+                    pairs += [(child, None) for child in children]
+                else:
+                    pairs += zip(children, views(data))
+        return pairs
+
+    def compile_schedule(self):
+        """Flattens the graph into static forward and adjoint schedules.
+
+        Each schedule is a topologically ordered list of
+        (node, inputs, outputs, timing) entries, where inputs and outputs are
+        the lists of buffers handed to the node. View nodes are left out.
+        The arrays passed to forward/adjoint are bound into the buffer lists
+        of the edges that alias them, so replaying a schedule requires no
+        graph traversal.
+        """
+        self.forward_slots = defaultdict(list)
+        self.adjoint_slots = defaultdict(list)
+        self.forward_bound = {}
+        self.adjoint_bound = {}
+        self.forward_schedule = self.build_schedule(True, self.forward_slots,
+                                                    lambda e: e.data)
+        self.adjoint_schedule = self.build_schedule(False, self.adjoint_slots,
+                                                    lambda e: e.data)
+        self.batch_size = None
 
+        # Nodes sharing a step are independent and run concurrently.
+        self.forward_levels = self.group_steps(self.forward_schedule,
+                                               self.forward_steps)
+        self.adjoint_levels = self.group_steps(self.adjoint_schedule,
+                                               self.adjoint_steps)
+
+    def build_schedule(self, forward, slots, data):
+        """Returns the schedule entries for one direction.
+
+        data maps an edge to its buffer. The buffer lists holding the edges
+        aliasing the caller's arrays are recorded in slots.
+        """
+        def buffers(edges):
+            bufs = []
+            for e in edges:
+                slots[e].append((bufs, len(bufs)))
+                bufs.append(None if e in self.external_edges else data(e))
+            return bufs
+
+        order = []
+        self.traverse_graph(order.append, forward)
+        log = self.forward_log if forward else self.adjoint_log
+        schedule = []
+        for node in order:
+            if node in self.view_nodes:
+                continue
             if node is self.start:
-                inputs = [v]
+                in_edges = [self.start_edge]
+            else:
+                in_edges = self.input_edges[node]
+            if node is self.end:
+                out_edges = [self.end_edge]
+            else:
+                out_edges = self.output_edges[node]
+            if forward:
+                schedule.append((node, buffers(in_edges), buffers(out_edges),
+                                 log[node]))
+            else:
+                schedule.append((node, buffers(out_edges), buffers(in_edges),
+                                 log[node]))
+        return schedule
+
+    def plan_batch(self, n):
+        """Allocates the buffers and schedules for batches of n inputs.
+
+        Every arena grows a leading batch axis, so the batched buffers share
+        memory exactly as the buffers of a single evaluation do.
+        """
+        data = {}
+        self.batch_arenas = []
+        for size, roots in self.arena_roots:
+            buf = np.zeros(n * int(size), dtype=self.dtype)
+            self.batch_arenas.append(buf)
+            for root in roots:
+                root_data = np.reshape(buf[:n * int(root.size)],
+                                       (n,) + tuple(root.shape))
+                data.update(self._tree_views(root, root_data))
+        self.batch_forward_slots = defaultdict(list)
+        self.batch_adjoint_slots = defaultdict(list)
+        self.batch_forward_bound = {}
+        self.batch_adjoint_bound = {}
+        self.batch_forward_schedule = self.build_schedule(
+            True, self.batch_forward_slots, data.get)
+        self.batch_adjoint_schedule = self.build_schedule(
+            False, self.batch_adjoint_slots, data.get)
+        self.batch_size = n
+
+    @staticmethod
+    def group_steps(schedule, steps):
+        """Groups the schedule entries by execution step.
+        """
+        levels = defaultdict(list)
+        for entry in schedule:
+            levels[steps[entry[0]]].append(entry)
+        return [levels[step] for step in sorted(levels)]
+
+    def bind(self, root, array, slots, bound, read, lead=()):
+        """Binds a caller array to the edges that alias it in one schedule.
+
+        Returns a scratch buffer standing in for array if array cannot be
+        viewed with the shape of root, else None. lead holds the shape of any
+        leading batch axes.
+        """
+        shape = tuple(lead) + tuple(root.shape)
+        if root in bound and bound[root][0] is array:
+            scratch = bound[root][1]
+        else:
+            data = np.reshape(array, shape)
+            if data.flags.c_contiguous and np.may_share_memory(data, array):
+                scratch = None
+            else:
+                scratch = data = np.empty(shape, dtype=self.dtype)
+            for e, view in self._tree_views(root, data):
+                for bufs, idx in slots.get(e, []):
+                    bufs[idx] = view
+            bound[root] = (array, scratch)
+        if read and scratch is not None:
+            np.copyto(scratch, np.reshape(array, shape))
+        return scratch
+
+    @staticmethod
+    def run_forward(entry):
+        node, inputs, outputs, timing = entry
+        timing.tic()
+        node.forward(inputs, outputs)
+        timing.toc()
+
+    @staticmethod
+    def run_adjoint(entry):
+        node, inputs, outputs, timing = entry
+        timing.tic()
+        node.adjoint(inputs, outputs)
+        timing.toc()
+
+    def run_levels(self, levels, run):
+        """Runs the nodes of each level on the thread pool.
+        """
+        if self.pool is None:
+            self.pool = ThreadPool(self.num_threads)
+        for level in levels:
+            if len(level) == 1:
+                run(level[0])
             else:
-                inputs = self.get_inputs(node)
-            # Run adjoint op and time it.
-            self.adjoint_log[node].tic()
-            #if node in self.split_nodes:
-            #    for io in range(len(outputs)):
-            #        node.adjoint([outputs[io]], inputs)
-            #        assert(len(inputs) == 1)
-            #        if io == 0:
-            #            res = inputs[0].copy()
-            #        else:
-            #            res += inputs[0]
-            #    np.copyto(inputs[0], res)
-            #else:
-            if 1:
-                node.adjoint(outputs, inputs)
-            self.adjoint_log[node].toc()
-        # Evaluate adjoint graph and time it.
+                self.pool.map(run, level)
+
+    def forward(self, x, y, numpy=False):
+        """Evaluates the forward composition.
+
+        Reads from x and writes to y. Graphs with the C implementation run
+        their C kernels unless numpy is set.
+        """
+        if self.implem == Impl['c'] and self.sparse_K is None and not numpy:
+            return self.forward_c(x, y)
+        self.forward_log[self].tic()
+        if self.sparse_K is not None:
+            np.copyto(y, np.reshape(self.sparse_K.dot(np.ravel(x)), np.shape(y)))
+            self.forward_log[self].toc()
+            return y
+        self.bind(self.start_edge, x, self.forward_slots,
+                  self.forward_bound, True)
+        scratch = self.bind(self.end_edge, y, self.forward_slots,
+                            self.forward_bound, False)
+        # Replay the precompiled schedule and time each node.
+        if self.num_threads > 1:
+            self.run_levels(self.forward_levels, self.run_forward)
+        else:
+            for node, inputs, outputs, timing in self.forward_schedule:
+                timing.tic()
+                node.forward(inputs, outputs)
+                timing.toc()
+        if scratch is not None:
+            np.copyto(y, np.reshape(scratch, np.shape(y)))
+        self.forward_log[self].toc()
+        return y
+
+    def adjoint(self, u, v, numpy=False):
+        """Evaluates the adjoint composition.
+
+        Reads from u and writes to v. Graphs with the C implementation run
+        their C kernels unless numpy is set.
+        """
+        if self.implem == Impl['c'] and self.sparse_K is None and not numpy:
+            return self.adjoint_c(u, v)
         self.adjoint_log[self].tic()
-        self.traverse_graph(adjoint_eval, False)
+        if self.sparse_K is not None:
+            np.copyto(v, np.reshape(self.sparse_KT.dot(np.ravel(u)), np.shape(v)))
+            self.adjoint_log[self].toc()
+            return v
+        self.bind(self.end_edge, u, self.adjoint_slots,
+                  self.adjoint_bound, True)
+        scratch = self.bind(self.start_edge, v, self.adjoint_slots,
+                            self.adjoint_bound, False)
+        # Replay the precompiled schedule and time each node.
+        if self.num_threads > 1:
+            self.run_levels(self.adjoint_levels, self.run_adjoint)
+        else:
+            for node, inputs, outputs, timing in self.adjoint_schedule:
+                timing.tic()
+                node.adjoint(inputs, outputs)
+                timing.toc()
+        if scratch is not None:
+            np.copyto(v, np.reshape(scratch, np.shape(v)))
         self.adjoint_log[self].toc()
         return v
 
+    def forward_batch(self, X, Y):
+        """Evaluates the forward composition on a batch of inputs.
+
+        Reads from X, of shape (N, input_size), and writes to Y, of shape
+        (N, output_size). Lin ops run once on the whole batch wherever they
+        support it.
+        """
+        n = np.shape(X)[0]
+        if self.sparse_K is not None:
+            X = np.reshape(X, (n, self.input_size))
+            np.copyto(Y, np.reshape(self.sparse_K.dot(X.T).T, np.shape(Y)))
+            return Y
+        if self.batch_size != n:
+            self.plan_batch(n)
+        self.forward_log[self].tic()
+        self.bind(self.start_edge, X, self.batch_forward_slots,
+                  self.batch_forward_bound, True, (n,))
+        scratch = self.bind(self.end_edge, Y, self.batch_forward_slots,
+                            self.batch_forward_bound, False, (n,))
+        for node, inputs, outputs, timing in self.batch_forward_schedule:
+            timing.tic()
+            node.forward_batch(inputs, outputs)
+            timing.toc()
+        if scratch is not None:
+            np.copyto(Y, np.reshape(scratch, np.shape(Y)))
+        self.forward_log[self].toc()
+        return Y
+
+    def adjoint_batch(self, U, V):
+        """Evaluates the adjoint composition on a batch of inputs.
+
+        Reads from U, of shape (N, output_size), and writes to V, of shape
+        (N, input_size).
+        """
+        n = np.shape(U)[0]
+        if self.sparse_K is not None:
+            U = np.reshape(U, (n, self.output_size))
+            np.copyto(V, np.reshape(self.sparse_KT.dot(U.T).T, np.shape(V)))
+            return V
+        if self.batch_size != n:
+            self.plan_batch(n)
+        self.adjoint_log[self].tic()
+        self.bind(self.end_edge, U, self.batch_adjoint_slots,
+                  self.batch_adjoint_bound, True, (n,))
+        scratch = self.bind(self.start_edge, V, self.batch_adjoint_slots,
+                            self.batch_adjoint_bound, False, (n,))
+        for node, inputs, outputs, timing in self.batch_adjoint_schedule:
+            timing.tic()
+            node.adjoint_batch(inputs, outputs)
+            timing.toc()
+        if scratch is not None:
+            np.copyto(V, np.reshape(scratch, np.shape(V)))
+        self.adjoint_log[self].toc()
+        return V
+
+    def gram(self):
+        """Returns an operator applying K^TK with forward(x, y).
+
+        Gram matrices that simplify to a single lin op are applied without
+        the forward and adjoint traversals of K. See lin_ops.gram.Gram.
+        """
+        if getattr(self, 'gram_op', None) is None:
+            from .gram import Gram
+            self.gram_op = Gram(self)
+        return self.gram_op
+
     def traverse_graph(self, node_fn, forward):
         """Traverse the graph and apply the given function at each node.
 
@@ -347,6 +1271,62 @@ class CompGraph(object):
                 if (eval_map[node] == node_inputs_count):
                     ready.append(node)
 
+    def to_sparse(self, max_nnz=None):
+        """Returns the composite operator as a scipy.sparse CSR matrix.
+
+        The matrix maps the flattened input of forward to its flattened
+        output, and its transpose is the adjoint. It is composed from the
+        sparse blocks each lin op returns from get_sparse.
+
+        Parameters
+        ----------
+        max_nnz : int
+            Give up once a block has more nonzeros than this.
+
+        Returns
+        -------
+        scipy.sparse.csr_matrix
+            The operator, or NotImplemented if some lin op has no sparse
+            form or the matrix would be too large.
+        """
+        # The matrix mapping the graph input to the data of each edge.
+        mats = {self.start_edge: sp.identity(self.input_size, format='csr')}
+        result = [None]
+        failed = []
+
+        def node_sparse(node):
+            if failed:
+                return
+            if node is self.start:
+                # Split the input between the variables.
+                out_edges = self.output_edges[node]
+                offset = 0
+                for e in out_edges:
+                    mats[e] = mats[self.start_edge][offset:offset + e.size]
+                    offset += e.size
+                return
+            blocks = node.get_sparse()
+            if blocks is NotImplemented:
+                failed.append(node)
+                return
+            in_edges = self.input_edges.get(node, [])
+            out = sp.csr_matrix((node.size, self.input_size))
+            for block, e in zip(blocks, in_edges):
+                out = out + block.dot(mats[e])
+                if max_nnz is not None and out.nnz > max_nnz:
+                    failed.append(node)
+                    return
+            if node is self.end:
+                result[0] = out.tocsr()
+            else:
+                for e in self.output_edges[node]:
+                    mats[e] = out
+
+        self.traverse_graph(node_sparse, True)
+        if failed:
+            return NotImplemented
+        return result[0].astype(self.dtype)
+
     def norm_bound(self, final_output_mags):
         """Returns fast upper bound on ||K||.
 
@@ -376,6 +1356,22 @@ class CompGraph(object):
 
         self.traverse_graph(node_norm_bound, True)
 
+    def diag_norm(self):
+        """Returns ||K|| exactly if K^TK is diagonal, else None.
+
+        Only for graphs of a single variable, where ||K|| is the largest
+        magnitude of the diagonal representation (K^TK)^(1/2), in space or
+        in frequency.
+        """
+        end = self.orig_end
+        if len(end.variables()) != 1:
+            return None
+        for freq in [False, True]:
+            if end.is_gram_diag(freq):
+                diag = list(end.get_diag(freq).values())[0]
+                return float(np.max(np.abs(diag)))
+        return None
+
     def update_vars(self, val):
         """Map sections of val to variables.
         """
@@ -396,7 +1392,7 @@ class CompGraph(object):
         return self.__class__.__name__
 
 
-def est_CompGraph_norm(K, tol=1e-3, try_fast_norm=True):
+def est_CompGraph_norm(K, tol=1e-3, try_fast_norm=True, cache=None, warm_iters=10):
     """Estimates operator norm for L = ||K||.
 
     Parameters
@@ -405,29 +1401,72 @@ def est_CompGraph_norm(K, tol=1e-3, try_fast_norm=True):
         Accuracy of estimate if not trying for upper bound.
     try_fast_norm : bool
         Whether to try for a fast upper bound.
+    cache : NormCache
+        Where to look up and store estimates. Defaults to
+        proximal.utils.norm_cache.norm_cache.
+    warm_iters : int
+        Maximum number of power iterations from a cached eigenvector before
+        falling back to a Lanczos iteration.
 
     Returns
     -------
     float
         Estimate of ||K||.
     """
+    # Gram diagonal graphs have an exact norm.
+    Knorm = K.diag_norm()
+    if Knorm is not None:
+        return Knorm
+
     if try_fast_norm:
         output_mags = [NotImplemented]
         K.norm_bound(output_mags)
         if NotImplemented not in output_mags:
             return output_mags[0]
 
+    if cache is None:
+        cache = norm_cache
+    key, structure = K.norm_keys()
+    if key is not None:
+        Knorm = cache.get_norm(key, tol)
+        if Knorm is not None:
+            return Knorm
+        v0 = cache.get_vector(structure, K.input_size)
+    else:
+        v0 = None
+
     input_data = np.zeros(K.input_size)
-    output_data = np.zeros(K.output_size)
+    gram = K.gram()
 
     def KtK(x):
-        K.forward(x, output_data)
-        K.adjoint(output_data, input_data)
+        gram.forward(x, input_data)
         return input_data
 
     # Define linear operator
     A = LinearOperator((K.input_size, K.input_size),
                        KtK, KtK)
 
-    Knorm = np.sqrt(eigs(A, k=1, M=None, sigma=None, which='LM', tol=tol)[0].real)
-    return np.float(Knorm)
+    # Warm start: power iteration from the top eigenvector of a graph with
+    # the same structure, which is close if the parameters barely changed.
+    lam = None
+    if v0 is not None:
+        v = v0 / np.linalg.norm(v0)
+        for _ in range(warm_iters):
+            y = KtK(v)
+            lam = np.dot(v, y)
+            residual = np.linalg.norm(y - lam * v) / lam
+            v = y / np.linalg.norm(y)
+            if residual <= tol:
+                break
+        else:
+            lam = None
+        v0 = v
+    # Lanczos iteration on the symmetric K^TK otherwise.
+    if lam is None:
+        w, V = eigsh(A, k=1, M=None, sigma=None, which='LM', tol=tol, v0=v0)
+        lam, v = w[0], V[:, 0]
+    Knorm = float(np.sqrt(np.abs(lam)))
+    if key is not None:
+        cache.set_norm(key, tol, Knorm)
+        cache.set_vector(structure, v)
+    return Knorm
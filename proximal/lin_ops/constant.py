@@ -31,7 +31,17 @@ class Constant(LinOp):
         Reads from inputs and writes to outputs.
         """
         pass
-    
+
+    def can_batch(self):
+        """Do forward and adjoint broadcast over leading batch axes?
+        """
+        return True
+
+    def get_sparse(self):
+        """Returns the lin op as sparse matrices, one per input.
+        """
+        return []
+
     def cuda_additional_buffers(self):
         if np.all(self._value == 0.0):
             return []
@@ -60,6 +70,11 @@ float %(var)s = %(cname)s[%(index)s];
     def value(self):
         return self._value
 
+    def evaluate(self, memo):
+        """Returns the value of the lin op.
+        """
+        return self._value
+
     def is_diag(self, freq=False):
         """Is the lin op diagonal (in the frequency domain)?
         """
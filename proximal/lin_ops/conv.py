@@ -1,5 +1,7 @@
 from .lin_op import LinOp
+import copy as cp
 import numpy as np
+import scipy.sparse as sp
 from proximal.utils.utils import Impl, psf2otf, fftd, ifftd
 from proximal.halide.halide import Halide
 
@@ -52,26 +54,61 @@ class conv(LinOp):
             self.tmpout = np.zeros(arg.shape, dtype=np.float32, order='F')
             self.initialized = True
 
+    def set_implementation(self, im):
+        """Sets the implementation, redoing the kernel setup if it already
+        ran for another one.
+        """
+        prev = self.implementation
+        implem = super(conv, self).set_implementation(im)
+        if self.initialized and self.kernel is not None and implem != prev:
+            # The Halide setup overwrites the otf.
+            otf = psf2otf(self.kernel.astype(np.float64), self.shape, self.dims)
+            self.forward_kernel = otf.astype(np.result_type(otf, self.forward_kernel),
+                                             copy=False)
+            self.adjoint_kernel = self.forward_kernel.conj()
+            self.initialized = False
+        return implem
+
+    def set_dtype(self, dtype):
+        """Casts the parameters of the lin op to the given float type.
+        """
+        ctype = np.result_type(dtype, np.complex64)
+        self.forward_kernel = self.forward_kernel.astype(ctype, copy=False)
+        self.adjoint_kernel = self.adjoint_kernel.astype(ctype, copy=False)
+
+    def use_halide(self):
+        """Does the lin op run the Halide implementation?
+        """
+        return self.implementation == Impl['halide'] and \
+            (len(self.shape) == 2 or (len(self.shape) == 3 and self.dims == 2))
+
+    def implementations(self):
+        """The implementations the lin op has for its shape.
+        """
+        if len(self.shape) == 2 or (len(self.shape) == 3 and self.dims == 2):
+            return [Impl['numpy'], Impl['halide']]
+        return [Impl['numpy']]
+
     def forward(self, inputs, outputs):
         """The forward operator.
 
         Reads from inputs and writes to outputs.
         """
         self.init_kernel()
-        if self.implementation == Impl['halide'] and \
-                (len(self.shape) == 2 or (len(self.shape) == 3 and self.dims == 2)):
+        if self.use_halide():
 
             # Halide implementation
-            tmpin = np.asfortranarray(inputs[0].astype(np.float32))
+            tmpin = np.asfortranarray(inputs[0], dtype=np.float32)
             Halide('A_conv.cpp').A_conv(tmpin, self.kernel, self.tmpout)  # Call
             np.copyto(outputs[0], self.tmpout)
 
         else:
 
-            # Default numpy using FFT
-            X = fftd(inputs[0], self.dims)
+            # Default numpy using FFT, batched over any leading axes
+            lead = inputs[0].ndim - len(self.shape)
+            X = fftd(inputs[0], self.dims, lead)
             X *= self.forward_kernel
-            np.copyto(outputs[0], ifftd(X, self.dims).real)
+            np.copyto(outputs[0], ifftd(X, self.dims, lead).real)
 
     def adjoint(self, inputs, outputs):
         """The adjoint operator.
@@ -79,20 +116,68 @@ class conv(LinOp):
         Reads from inputs and writes to outputs.
         """
         self.init_kernel()
-        if self.implementation == Impl['halide'] and \
-                (len(self.shape) == 2 or (len(self.shape) == 3 and self.dims == 2)):
+        if self.use_halide():
 
             # Halide implementation
-            tmpin = np.asfortranarray(inputs[0].astype(np.float32))
+            tmpin = np.asfortranarray(inputs[0], dtype=np.float32)
             Halide('At_conv.cpp').At_conv(tmpin, self.kernel, self.tmpout)  # Call
             np.copyto(outputs[0], self.tmpout)
 
         else:
 
-            # Default numpy using FFT
-            U = fftd(inputs[0], self.dims)
+            # Default numpy using FFT, batched over any leading axes
+            lead = inputs[0].ndim - len(self.shape)
+            U = fftd(inputs[0], self.dims, lead)
             U *= self.adjoint_kernel
-            np.copyto(outputs[0], ifftd(U, self.dims).real)
+            np.copyto(outputs[0], ifftd(U, self.dims, lead).real)
+
+    def can_batch(self):
+        """Do forward and adjoint broadcast over leading batch axes?
+        """
+        return not self.use_halide()
+
+    def get_gram(self, arg):
+        """Returns a lin op applying the Gram matrix A^TA of the lin op to arg.
+
+        The Gram matrix is a convolution with the kernel |otf|^2.
+        """
+        if self.use_halide():
+            return NotImplemented
+        gram = cp.copy(self)
+        gram.forward_kernel = np.abs(self.forward_kernel)**2
+        gram.adjoint_kernel = gram.forward_kernel
+        # The spatial kernel is only needed by Halide.
+        gram.kernel = None
+        gram.initialized = True
+        gram.input_nodes = [arg]
+        gram.orig_node = gram
+        return gram
+
+    def get_sparse(self):
+        """Returns the lin op as sparse matrices, one per input.
+
+        The circulant matrix has one diagonal per tap of the kernel, so it is
+        only sparse for small kernels.
+        """
+        psf = ifftd(self.forward_kernel.astype(np.complex128), self.dims).real
+        tol = np.finfo(np.float64).eps * psf.size * np.amax(np.abs(psf))
+        dims = len(self.shape) if self.dims is None else self.dims
+        indices = np.reshape(np.arange(self.size), self.shape)
+        rows = []
+        cols = []
+        vals = []
+        # Output p sums psf[q] * input[p - q] over the taps q, per channel.
+        for tap in zip(*np.nonzero(np.abs(psf) > tol)):
+            channel = (Ellipsis,) + tuple(tap[dims:])
+            shifted = np.roll(indices, tap[:dims], axis=tuple(range(dims)))
+            rows.append(np.ravel(indices[channel]))
+            cols.append(np.ravel(shifted[channel]))
+            vals.append(np.full(rows[-1].size, psf[tap]))
+        if len(rows) == 0:
+            return [sp.csr_matrix((self.size, self.size))]
+        return [sp.csr_matrix((np.concatenate(vals),
+                               (np.concatenate(rows), np.concatenate(cols))),
+                              shape=(self.size, self.size))]
 
     def is_diag(self, freq=False):
         """Is the lin op diagonal (in the frequency domain)?
@@ -1,5 +1,6 @@
 from ..lin_ops import lin_op
 from ..utils.cuda_codegen import indent, ind2sub, sub2ind, float_constant, compile_cuda_kernel, cuda_function, PyCudaAdapter
+import copy as cp
 import numpy as np
 import logging
 import scipy.ndimage.filters
@@ -58,7 +59,7 @@ class conv_nofft(lin_op.LinOp):
 
     def trunc0_ND(self, x, s):
         slices = [slice(s[i],x.shape[i]-s[i]) for i in range(len(s))]
-        return x[slices]
+        return x[tuple(slices)]
         if s[0] == 0 and s[1] == 0:
             return x
         if s[0] == 0:
@@ -368,8 +369,16 @@ if( %(valididx)s )
         float
             Magnitude of outputs.
         """
-        res = np.sum(np.abs(self.kernel))*input_mags[0]
-        #print("norm_bound=", res)
-        return res
+        # ||kernel||_1 bounds the row sums of |A|, but the edge padding
+        # makes the boundary columns sum to more. Schur test:
+        # ||A||^2 <= max row sum of |A| * max column sum of |A|.
+        absolute = cp.copy(self)
+        absolute.kernel = np.abs(self.kernel)
+        ones = np.ones(self.shape)
+        row_sums = np.zeros(self.shape)
+        col_sums = np.zeros(self.shape)
+        absolute.forward([ones], [row_sums])
+        absolute.adjoint([ones], [col_sums])
+        return np.sqrt(np.max(row_sums) * np.max(col_sums)) * input_mags[0]
 
 
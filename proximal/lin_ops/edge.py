@@ -8,9 +8,19 @@ class Edge(object):
         self.start = start
         self.end = end
         self.shape = shape
-        self.data = np.zeros(self.shape)
+        self._data = None  # Allocated on first use or by the memory planner.
         self.mag = None  # Used to get norm bounds.
 
+    @property
+    def data(self):
+        if self._data is None:
+            self._data = np.zeros(self.shape)
+        return self._data
+
+    @data.setter
+    def data(self, val):
+        self._data = val
+
     @property
     def size(self):
         return np.prod(self.shape)
@@ -1,5 +1,6 @@
 from .lin_op import LinOp
 import numpy as np
+import scipy.sparse as sp
 from proximal.utils.utils import Impl
 from proximal.halide.halide import Halide
 from ..utils.cuda_codegen import indent
@@ -44,22 +45,23 @@ class grad(LinOp):
                 (len(self.shape) == 3 or len(self.shape) == 4) and self.dims == 2:
             # Halide implementation
             if len(self.shape) == 3:
-                tmpin = np.asfortranarray((inputs[0][..., np.newaxis]).astype(np.float32))
+                tmpin = np.asfortranarray(inputs[0][..., np.newaxis], dtype=np.float32)
             else:
-                tmpin = np.asfortranarray((inputs[0]).astype(np.float32))
+                tmpin = np.asfortranarray(inputs[0], dtype=np.float32)
 
             Halide('A_grad.cpp').A_grad(tmpin, self.tmpfwd)  # Call
             np.copyto(outputs[0], np.reshape(self.tmpfwd, self.shape))
 
         else:
 
-            # Input
+            # Input, with any leading batch axes
             f = inputs[0]
+            lead = f.ndim - (len(self.shape) - 1)
 
             # Build up index for shifted array
             ss = f.shape
             stack_arr = ()
-            for j in range(self.dims):
+            for j in range(lead, lead + self.dims):
 
                 # Add grad for this dimension (same as index)
                 il = ()
@@ -88,9 +90,9 @@ class grad(LinOp):
             if len(self.shape) == 3:
                 tmpin = np.asfortranarray(np.reshape(inputs[0],
                                                      (self.shape[0], self.shape[1],
-                                                      1, 2)).astype(np.float32))
+                                                      1, 2)), dtype=np.float32)
             else:
-                tmpin = np.asfortranarray(inputs[0].astype(np.float32))
+                tmpin = np.asfortranarray(inputs[0], dtype=np.float32)
 
             Halide('At_grad.cpp').At_grad(tmpin, self.tmpadj)  # Call
             np.copyto(outputs[0], np.reshape(self.tmpadj, self.shape[:-1]))
@@ -99,6 +101,7 @@ class grad(LinOp):
 
             # Compute comparison (Negative divergence)
             f = inputs[0]
+            lead = f.ndim - len(self.shape)
 
             outputs[0].fill(0.0)
             for j in range(self.dims):
@@ -106,6 +109,7 @@ class grad(LinOp):
                 # Get component
                 fj = f[..., j]
                 ss = fj.shape
+                j += lead
 
                 # Add grad for this dimension (same as index)
                 istart = ()
@@ -131,6 +135,43 @@ class grad(LinOp):
 
                 outputs[0] += (-fd)
 
+    def implementations(self):
+        """The implementations the lin op has for its shape.
+        """
+        if len(self.shape) in [3, 4] and self.dims == 2:
+            return [Impl['numpy'], Impl['halide']]
+        return [Impl['numpy']]
+
+    def can_batch(self):
+        """Do forward and adjoint broadcast over leading batch axes?
+        """
+        return not (self.implementation == Impl['halide'] and
+                    len(self.shape) in [3, 4] and self.dims == 2)
+
+    def get_gram(self, arg):
+        """Returns a lin op applying the Gram matrix A^TA of the lin op to arg.
+        """
+        return laplacian(arg, self.dims)
+
+    def get_sparse(self):
+        """Returns the lin op as sparse matrices, one per input.
+        """
+        ss = self.shape[:-1]
+        size = int(np.prod(ss))
+        block = sp.csr_matrix((self.size, size))
+        for j in range(self.dims):
+            # Forward difference along axis j, zero at the last entry.
+            diff = sp.diags([-1. * (np.arange(ss[j]) < ss[j] - 1), np.ones(ss[j] - 1)],
+                            [0, 1])
+            diff = sp.kron(sp.identity(int(np.prod(ss[:j]))),
+                           sp.kron(diff, sp.identity(int(np.prod(ss[j + 1:])))))
+            # Component j is interleaved along the last axis of the output.
+            place = sp.csr_matrix((np.ones(size),
+                                   (np.arange(size) * self.dims + j, np.arange(size))),
+                                  shape=(self.size, size))
+            block = block + place.dot(diff)
+        return [block.tocsr()]
+
     def forward_cuda_kernel(self, cg, num_tmp_vars, absidx, parent):
         innode = cg.input_nodes(self)[0]
         idxvars = ["idx_%d" % (num_tmp_vars+d) for d in range(self.dims)]
@@ -218,3 +259,79 @@ if( %(cidx)s == 0 )
         # ND gradient is permutation of stacked grad in axis 0, axis 1, etc.
         # so norm is 2*sqrt(dims)
         return 2 * np.sqrt(self.dims) * input_mags[0]
+
+
+class laplacian(LinOp):
+    """
+    negative laplacian -div(grad(X)), the Gram matrix of grad with the same
+    boundary handling. can be defined for different dimensions.
+    default is n-d laplacian.
+    """
+
+    def __init__(self, arg, dims=None):
+
+        if dims is not None:
+            self.dims = dims
+        else:
+            self.dims = len(arg.shape)
+
+        super(laplacian, self).__init__([arg], arg.shape)
+
+    def forward(self, inputs, outputs):
+        """The forward operator.
+
+        Reads from inputs and writes to outputs.
+        """
+        f = inputs[0]
+        lead = f.ndim - len(self.shape)
+        out = outputs[0]
+        out.fill(0.0)
+        for j in range(lead, lead + self.dims):
+            # Forward differences, zero past the last entry.
+            fd = np.diff(f, axis=j)
+            head = (slice(None),) * j + (slice(None, -1),)
+            tail = (slice(None),) * j + (slice(1, None),)
+            out[head] -= fd
+            out[tail] += fd
+
+    def adjoint(self, inputs, outputs):
+        """The adjoint operator.
+
+        Reads from inputs and writes to outputs.
+        """
+        self.forward(inputs, outputs)
+
+    def can_batch(self):
+        """Do forward and adjoint broadcast over leading batch axes?
+        """
+        return True
+
+    def get_sparse(self):
+        """Returns the lin op as sparse matrices, one per input.
+        """
+        block = sp.csr_matrix((self.size, self.size))
+        for j in range(self.dims):
+            n = self.shape[j]
+            # D^TD for the forward difference D along axis j.
+            deg = np.full(n, 2.)
+            deg[[0, -1]] = 1. if n > 1 else 0.
+            lap = sp.diags([-np.ones(n - 1), deg, -np.ones(n - 1)], [-1, 0, 1])
+            block = block + sp.kron(sp.identity(int(np.prod(self.shape[:j]))),
+                                    sp.kron(lap, sp.identity(int(np.prod(self.shape[j + 1:])))))
+        return [block.tocsr()]
+
+    def norm_bound(self, input_mags):
+        """Gives an upper bound on the magnitudes of the outputs given inputs.
+
+        Parameters
+        ----------
+        input_mags : list
+            List of magnitudes of inputs.
+
+        Returns
+        -------
+        float
+            Magnitude of outputs.
+        """
+        # The squared norm of grad.
+        return 4 * self.dims * input_mags[0]
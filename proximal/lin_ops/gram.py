@@ -0,0 +1,247 @@
+from .variable import Variable
+from .vstack import vstack
+from .scale import scale
+from .mul_elemwise import mul_elemwise
+from .conv import conv
+from .subsample import subsample
+import copy as cp
+import numpy as np
+
+
+class Gram(object):
+    """The Gram operator K^TK of a computation graph.
+
+    K^TK is the sum of K_i^TK_i over the blocks K_i stacked in K. Each block
+    is split as K_i = A_i(B_i), where the Gram matrix of A_i reduces to a
+    single lin op G_i (conv to |otf|^2, mul_elemwise to w^2, subsample to a
+    mask, grad to a laplacian). Blocks with the same inner expression B share
+    one term B^T (sum_i G_i) B. The blocks that do not simplify are applied
+    together as a forward pass followed by an adjoint pass.
+    """
+
+    def __init__(self, K):
+        from .comp_graph import CompGraph
+        self.K = K
+        self.input_size = K.input_size
+        self.output_size = K.input_size
+        self.dtype = K.dtype
+
+        end = K.orig_end
+        blocks = end.input_nodes if isinstance(end, vstack) else [end]
+        groups = {}
+        inners = []
+        rest = []
+        for block in blocks:
+            inner, gram = self.split_block(block)
+            if gram is None:
+                rest.append(block)
+            elif len(inner.variables()) > 0:
+                if id(inner) not in groups:
+                    groups[id(inner)] = []
+                    inners.append(inner)
+                groups[id(inner)].append(gram)
+        # A block that is the inner expression of others adds the identity to
+        # their Gram sum.
+        for block in rest:
+            if id(block) in groups:
+                groups[id(block)].append(scale(1.0, block))
+        rest = [block for block in rest if id(block) not in groups]
+
+        # Terms (graph or variable, Gram nodes, indices into x).
+        self.terms = []
+        if len(rest) == len(blocks):
+            self.terms.append((K, [], None))
+            inners = []
+        elif len(rest) > 0:
+            rest = rest[0] if len(rest) == 1 else vstack(rest)
+            inners.append(rest)
+            groups[id(rest)] = []
+        for inner in inners:
+            grams = self.merge(groups[id(inner)])
+            for gram in grams:
+                gram.set_dtype(self.dtype)
+            if isinstance(inner, Variable):
+                offset = K.var_info[inner.uuid]
+                index = slice(offset, offset + inner.size)
+                self.terms.append((inner, grams, index))
+            else:
+                graph = CompGraph.cached(inner, implem=K.implem,
+                                         dtype=self.dtype)
+                self.terms.append((graph, grams, self.gather_index(inner, graph)))
+
+        # Buffers for the input, output, Gram output and result of each term.
+        self.buffers = []
+        for graph, grams, index in self.terms:
+            out = np.zeros(graph.shape, dtype=self.dtype)
+            if isinstance(graph, Variable):
+                self.buffers.append((None, None, None, out, None))
+            else:
+                self.buffers.append((np.zeros(graph.input_size, dtype=self.dtype),
+                                     np.zeros(graph.output_size, dtype=self.dtype),
+                                     np.zeros(graph.output_size, dtype=self.dtype),
+                                     out,
+                                     np.zeros(graph.input_size, dtype=self.dtype)))
+
+    def split_block(self, block):
+        """Splits block into an inner expression and the Gram of the rest.
+
+        Returns
+        -------
+        tuple
+            The inner expression and a lin op applying the Gram matrix of the
+            outer part to it, or (block, None) if nothing simplifies.
+        """
+        inner = block
+        gram = None
+        while len(inner.input_nodes) == 1:
+            arg = inner.input_nodes[0]
+            if gram is None:
+                fused = inner.get_gram(arg)
+                fused = None if fused is NotImplemented else fused
+            else:
+                fused = self.sandwich(inner, gram)
+            if fused is None:
+                break
+            gram = fused
+            inner = arg
+        return inner, gram
+
+    @staticmethod
+    def weight(node):
+        """The weight of a scale or mul_elemwise node, else None.
+        """
+        if isinstance(node, scale):
+            return node.scalar
+        elif isinstance(node, mul_elemwise):
+            return node.weight
+        return None
+
+    @staticmethod
+    def fft_conv(node):
+        """Is node a convolution evaluated with FFTs?
+        """
+        return isinstance(node, conv) and not node.use_halide()
+
+    def sandwich(self, node, gram):
+        """Returns a lin op applying node^T gram node to the input of node.
+
+        Returns None if the product does not reduce to a single lin op.
+        """
+        arg = node.input_nodes[0]
+        weight = self.weight(gram)
+        if isinstance(node, scale):
+            if isinstance(gram, scale):
+                return scale(gram.scalar * node.scalar**2, arg)
+            elif weight is not None:
+                return mul_elemwise(weight * node.scalar**2, arg,
+                                    gram.implementation)
+            elif self.fft_conv(gram):
+                return self.with_otf(gram, gram.forward_kernel * node.scalar**2, arg)
+        elif isinstance(node, mul_elemwise) and weight is not None:
+            return mul_elemwise(np.square(node.weight) * weight, arg,
+                                node.implementation)
+        elif isinstance(node, subsample) and weight is not None:
+            # Zero fill the weight on the dropped pixels.
+            full = np.zeros(node.orig_shape)
+            full[node.get_selection()] = weight
+            return mul_elemwise(full, arg)
+        elif self.fft_conv(node):
+            otf = np.abs(node.forward_kernel)**2
+            if isinstance(gram, scale):
+                return self.with_otf(node, otf * gram.scalar, arg)
+            elif self.fft_conv(gram) and gram.dims == node.dims:
+                return self.with_otf(node, otf * gram.forward_kernel, arg)
+        return None
+
+    @staticmethod
+    def with_otf(node, otf, arg):
+        """Returns a copy of the conv node with the given otf, applied to arg.
+        """
+        fused = cp.copy(node)
+        fused.forward_kernel = otf
+        fused.adjoint_kernel = otf.conj()
+        fused.kernel = None
+        fused.initialized = True
+        fused.input_nodes = [arg]
+        fused.orig_node = fused
+        return fused
+
+    def merge(self, grams):
+        """Sums Gram nodes on the same input where the sum is a single node.
+        """
+        merged = []
+        for gram in grams:
+            for idx, other in enumerate(merged):
+                total = self.add(other, gram)
+                if total is not None:
+                    merged[idx] = total
+                    break
+            else:
+                merged.append(gram)
+        return merged
+
+    def add(self, lhs, rhs):
+        """Returns a single lin op computing lhs + rhs, or None.
+        """
+        arg = lhs.input_nodes[0]
+        weights = [self.weight(lhs), self.weight(rhs)]
+        if isinstance(lhs, scale) and isinstance(rhs, scale):
+            return scale(lhs.scalar + rhs.scalar, arg)
+        elif all([weight is not None for weight in weights]):
+            implem = [node.implementation for node in [lhs, rhs]
+                      if isinstance(node, mul_elemwise)][0]
+            return mul_elemwise(np.ones(lhs.shape) * (weights[0] + weights[1]),
+                                arg, implem)
+        convs = [node for node in [lhs, rhs] if self.fft_conv(node)]
+        if len(convs) == 2 and lhs.dims == rhs.dims:
+            return self.with_otf(lhs, lhs.forward_kernel + rhs.forward_kernel, arg)
+        elif len(convs) == 1 and (isinstance(lhs, scale) or isinstance(rhs, scale)):
+            node = convs[0]
+            scalar = rhs.scalar if node is lhs else lhs.scalar
+            return self.with_otf(node, node.forward_kernel + scalar, arg)
+        return None
+
+    def gather_index(self, inner, graph):
+        """Indices into x of the input of graph, or None if they are all of x.
+        """
+        index = np.zeros(graph.input_size, dtype=int)
+        for var in inner.variables():
+            offset = graph.var_info[var.uuid]
+            start = self.K.var_info[var.uuid]
+            index[offset:offset + var.size] = np.arange(start, start + var.size)
+        if np.array_equal(index, np.arange(self.input_size)):
+            return None
+        return index
+
+    def forward(self, x, y):
+        """Applies K^TK to x and writes the result to y.
+        """
+        y.fill(0.0)
+        for (graph, grams, index), buffers in zip(self.terms, self.buffers):
+            xin, t, u, out, r = buffers
+            if isinstance(graph, Variable):
+                xt = np.reshape(x[index], graph.shape)
+                for gram in grams:
+                    gram.forward([xt], [out])
+                    y[index] += np.ravel(out)
+                continue
+            if index is not None:
+                np.take(x, index, out=xin)
+            graph.forward(x if index is None else xin, t)
+            if len(grams) > 0:
+                u.fill(0.0)
+                for gram in grams:
+                    gram.forward([np.reshape(t, graph.shape)], [out])
+                    u += np.ravel(out)
+                graph.adjoint(u, r)
+            else:
+                graph.adjoint(t, r)
+            if index is not None:
+                y[index] += r
+            else:
+                y += r
+
+    def adjoint(self, x, y):
+        """K^TK is self-adjoint.
+        """
+        self.forward(x, y)
@@ -37,22 +37,37 @@ class LinOp(object):
             shape = (shape,)
         return tuple(shape)
 
+    def tree_nodes(self):
+        """Returns the nodes of the lin op tree, each once, in order of first
+        appearance.
+
+        Shared subtrees are visited once, not once per path.
+        """
+        nodes = []
+        visited = set()
+        stack = [self]
+        while len(stack) > 0:
+            node = stack.pop()
+            if id(node) not in visited:
+                visited.add(id(node))
+                nodes.append(node)
+                stack += reversed(node.input_nodes)
+        return nodes
+
     def variables(self):
         """Return the list of variables used in the LinOp.
         """
-        vars_ = []
-        for arg in self.input_nodes:
-            vars_ += arg.variables()
-        unordered = list(set(vars_))  # Make unique, order by uuid.
-        return sorted(unordered, key=lambda x: x.uuid)
+        from .variable import Variable
+        vars_ = [node for node in self.tree_nodes() if isinstance(node, Variable)]
+        # Order by uuid.
+        return sorted(vars_, key=lambda x: x.uuid)
 
     def constants(self):
-        """Returns a list of constants in the LinOp.
+        """Returns a list of constants in the LinOp, each once, in order of
+        appearance.
         """
-        consts = []
-        for arg in self.input_nodes:
-            consts += arg.constants()
-        return consts
+        from .constant import Constant
+        return [node for node in self.tree_nodes() if isinstance(node, Constant)]
 
     def is_constant(self):
         """Is the LinOp constant?
@@ -72,6 +87,93 @@ class LinOp(object):
     def implementation(self):
         return self.implementation
 
+    def implementations(self):
+        """The implementations the lin op has for its shape.
+        """
+        return [Impl['numpy']]
+
+    def can_run_in_place(self):
+        """Can the lin op write its output into the buffer of its input?
+        """
+        return False
+
+    def can_batch(self):
+        """Do forward and adjoint broadcast over leading batch axes?
+        """
+        return False
+
+    def forward_batch(self, inputs, outputs):
+        """The forward operator applied to each item of a batch.
+
+        Reads from inputs and writes to outputs. The leading axis of the
+        arrays indexes the batch.
+        """
+        if self.can_batch():
+            self.forward(inputs, outputs)
+        else:
+            for idx in range(outputs[0].shape[0]):
+                self.forward([data[idx] for data in inputs],
+                             [data[idx] for data in outputs])
+
+    def adjoint_batch(self, inputs, outputs):
+        """The adjoint operator applied to each item of a batch.
+
+        Reads from inputs and writes to outputs. The leading axis of the
+        arrays indexes the batch.
+        """
+        if self.can_batch():
+            self.adjoint(inputs, outputs)
+        else:
+            for idx in range(outputs[0].shape[0]):
+                self.adjoint([data[idx] for data in inputs],
+                             [data[idx] for data in outputs])
+
+    def get_sparse(self):
+        """Returns the lin op as sparse matrices.
+
+        Returns
+        -------
+        list
+            One scipy.sparse matrix per input, mapping the flattened input to
+            the flattened output, or NotImplemented.
+        """
+        return NotImplemented
+
+    def get_gram(self, arg):
+        """Returns a lin op applying the Gram matrix A^TA of the lin op to arg.
+
+        Only defined for lin ops with a single input. The result reads arg
+        in place of the lin op's input, so a Gram chain can be built around
+        an inner expression.
+
+        Returns
+        -------
+        LinOp
+            The Gram operator, or NotImplemented.
+        """
+        return NotImplemented
+
+    def set_dtype(self, dtype):
+        """Casts the parameters of the lin op to the given float type.
+        """
+        pass
+
+    def input_views(self, output):
+        """Returns views of the output buffer to use as the input buffers.
+
+        Lin ops that only rearrange their inputs return a list with one array
+        aliasing output per input, so no copy is needed at run time.
+        """
+        return NotImplemented
+
+    def output_views(self, input):
+        """Returns views of the input buffer to use as the output buffers.
+
+        Lin ops that only rearrange their input return a list with one array
+        aliasing input per output, so no copy is needed at run time.
+        """
+        return NotImplemented
+
     # might be overwritten by subclasses
     def cuda_kernel_available(self):
         return hasattr(self, 'forward_cuda_kernel') and hasattr(self, 'adjoint_cuda_kernel')
@@ -207,12 +309,20 @@ class LinOp(object):
 
     @property
     def value(self):
-        inputs = []
-        for node in self.input_nodes:
-            inputs.append(node.value)
-        output = np.zeros(self.shape)
-        self.forward(inputs, [output])
-        return output
+        return self.evaluate({})
+
+    def evaluate(self, memo):
+        """Returns the value of the lin op.
+
+        memo maps the ids of the nodes evaluated so far to their values, so
+        a subtree shared by several nodes is only evaluated once.
+        """
+        if id(self) not in memo:
+            inputs = [node.evaluate(memo) for node in self.input_nodes]
+            output = np.zeros(self.shape)
+            self.forward(inputs, [output])
+            memo[id(self)] = output
+        return memo[id(self)]
 
     def get_offset(self):
         """Get the constant offset.
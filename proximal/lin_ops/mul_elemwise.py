@@ -1,5 +1,6 @@
 from .lin_op import LinOp
 import numpy as np
+import scipy.sparse as sp
 from proximal.utils.utils import Impl
 from proximal.halide.halide import Halide
 
@@ -28,7 +29,7 @@ class mul_elemwise(LinOp):
         if self.implementation == Impl['halide'] and (len(self.shape) in [2, 3]):
 
             # Halide implementation
-            tmpin = np.asfortranarray(inputs[0].astype(np.float32))
+            tmpin = np.asfortranarray(inputs[0], dtype=np.float32)
             Halide('A_mask.cpp').A_mask(tmpin, self.weight, self.tmpout)  # Call
             np.copyto(outputs[0], self.tmpout)
 
@@ -43,6 +44,41 @@ class mul_elemwise(LinOp):
         """
         self.forward(inputs, outputs)
 
+    def set_dtype(self, dtype):
+        """Casts the parameters of the lin op to the given float type.
+        """
+        # Narrower weights need no cast, numpy upcasts them on the fly.
+        if np.dtype(dtype).itemsize < self.weight.dtype.itemsize:
+            self.weight = self.weight.astype(dtype)
+
+    def implementations(self):
+        """The implementations the lin op has for its shape.
+        """
+        if len(self.shape) in [2, 3]:
+            return [Impl['numpy'], Impl['halide']]
+        return [Impl['numpy']]
+
+    def can_run_in_place(self):
+        """Can the lin op write its output into the buffer of its input?
+        """
+        return True
+
+    def can_batch(self):
+        """Do forward and adjoint broadcast over leading batch axes?
+        """
+        return not (self.implementation == Impl['halide'] and
+                    len(self.shape) in [2, 3])
+
+    def get_sparse(self):
+        """Returns the lin op as sparse matrices, one per input.
+        """
+        return [sp.diags(np.ravel(self.weight).astype(np.float64), format='csr')]
+
+    def get_gram(self, arg):
+        """Returns a lin op applying the Gram matrix A^TA of the lin op to arg.
+        """
+        return mul_elemwise(np.square(self.weight), arg, self.implementation)
+
     def is_diag(self, freq=False):
         """Is the lin op diagonal (in the frequency domain)?
         """
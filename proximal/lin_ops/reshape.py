@@ -1,5 +1,6 @@
 from .lin_op import LinOp
 import numpy as np
+import scipy.sparse as sp
 
 
 class reshape(LinOp):
@@ -15,7 +16,8 @@ class reshape(LinOp):
 
         Reads from inputs and writes to outputs.
         """
-        shaped_input = np.reshape(inputs[0], self.shape)
+        lead = inputs[0].shape[:inputs[0].ndim - len(self.input_nodes[0].shape)]
+        shaped_input = np.reshape(inputs[0], lead + self.shape)
         np.copyto(outputs[0], shaped_input)
 
     def adjoint(self, inputs, outputs):
@@ -23,9 +25,31 @@ class reshape(LinOp):
 
         Reads from inputs and writes to outputs.
         """
-        shaped_input = np.reshape(inputs[0], self.input_nodes[0].shape)
+        lead = inputs[0].shape[:inputs[0].ndim - len(self.shape)]
+        shaped_input = np.reshape(inputs[0], lead + self.input_nodes[0].shape)
         np.copyto(outputs[0], shaped_input)
 
+    def can_run_in_place(self):
+        """Can the lin op write its output into the buffer of its input?
+        """
+        return True
+
+    def input_views(self, output):
+        """Returns views of the output buffer to use as the input buffers.
+        """
+        lead = output.shape[:output.ndim - len(self.shape)]
+        return [np.reshape(output, lead + self.input_nodes[0].shape)]
+
+    def can_batch(self):
+        """Do forward and adjoint broadcast over leading batch axes?
+        """
+        return True
+
+    def get_sparse(self):
+        """Returns the lin op as sparse matrices, one per input.
+        """
+        return [sp.identity(self.size, format='csr')]
+
     def is_diag(self, freq=False):
         """Is the lin op diagonal (in the frequency domain)?
         """
@@ -1,6 +1,7 @@
 from .lin_op import LinOp
 from ..utils.cuda_codegen import ReverseInOut, float_constant
 import numpy as np
+import scipy.sparse as sp
 
 
 class scale(LinOp):
@@ -40,6 +41,26 @@ class scale(LinOp):
         #print("scale:adjoint:cuda")
         return self.forward_cuda_kernel(ReverseInOut(cg), num_tmp_vars, abs_idx, parent)
         
+    def can_run_in_place(self):
+        """Can the lin op write its output into the buffer of its input?
+        """
+        return True
+
+    def can_batch(self):
+        """Do forward and adjoint broadcast over leading batch axes?
+        """
+        return True
+
+    def get_sparse(self):
+        """Returns the lin op as sparse matrices, one per input.
+        """
+        return [self.scalar * sp.identity(self.size, format='csr')]
+
+    def get_gram(self, arg):
+        """Returns a lin op applying the Gram matrix A^TA of the lin op to arg.
+        """
+        return scale(self.scalar**2, arg)
+
     def is_gram_diag(self, freq=False):
         """Is the lin  Gram diagonal (in the frequency domain)?
         """
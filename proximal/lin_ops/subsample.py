@@ -1,5 +1,6 @@
 from .lin_op import LinOp
 import numpy as np
+from proximal.utils.utils import selection_matrix
 from ..utils.cuda_codegen import indent, sub2ind, ind2sub
 
 class subsample(LinOp):
@@ -19,7 +20,7 @@ class subsample(LinOp):
         Reads from inputs and writes to outputs.
         """
         # Subsample.
-        selection = self.get_selection()
+        selection = self.get_selection(inputs[0].ndim - len(self.shape))
         np.copyto(outputs[0], inputs[0][selection])
 
     def adjoint(self, inputs, outputs):
@@ -28,8 +29,8 @@ class subsample(LinOp):
         Reads from inputs and writes to outputs.
         """
         # Fill in with zeros.
-        selection = self.get_selection()
-        outputs[0][:] *= 0
+        selection = self.get_selection(inputs[0].ndim - len(self.shape))
+        outputs[0].fill(0)
         outputs[0][selection] = inputs[0]
 
     def forward_cuda_kernel(self, cg, num_tmp_vars, abs_idx, parent):
@@ -41,6 +42,7 @@ class subsample(LinOp):
     def adjoint_cuda_kernel(self, cg, num_tmp_vars, abs_idx, parent):
         #print("subsample:adjoint:cuda")
         resvar = "var_%(num_tmp_vars)d" % locals()
+        num_tmp_vars += 1
         new_abs_idx = list(["(%s)/%d" % (ai, si) if type(ai) is str else ai//si for (ai,si) in zip(abs_idx, self.steps)])
         pcode, var, num_tmp_vars = cg.output_nodes(self)[0].adjoint_cuda_kernel(cg, num_tmp_vars, new_abs_idx, self)
         pcode = indent(pcode, 4)
@@ -55,14 +57,38 @@ if( %(sel)s )
 """ % locals()
         return code, resvar, num_tmp_vars
 
-    def get_selection(self):
+    def get_selection(self, lead=0):
         """Return a tuple of slices to index into numpy arrays.
+
+        The first lead axes (batch axes) are taken whole.
         """
-        selection = []
+        selection = [slice(None)] * lead
         for step in self.steps:
             selection.append(slice(None, None, step))
         return tuple(selection)
 
+    def can_batch(self):
+        """Do forward and adjoint broadcast over leading batch axes?
+        """
+        return True
+
+    def get_gram(self, arg):
+        """Returns a lin op applying the Gram matrix A^TA of the lin op to arg.
+
+        Subsampling followed by zero filling masks out the dropped pixels.
+        """
+        from .mul_elemwise import mul_elemwise
+        mask = np.zeros(self.orig_shape)
+        mask[self.get_selection()] = 1.
+        return mul_elemwise(mask, arg)
+
+    def get_sparse(self):
+        """Returns the lin op as sparse matrices, one per input.
+        """
+        size = int(np.prod(self.orig_shape))
+        indices = np.reshape(np.arange(size), self.orig_shape)
+        return [selection_matrix(indices[self.get_selection()], size)]
+
     def is_gram_diag(self, freq=False):
         """Is the lin op's Gram matrix diagonal (in the frequency domain)?
         """
@@ -1,6 +1,7 @@
 from .lin_op import LinOp
-from ..utils.cuda_codegen import ReverseInOut
+from ..utils.cuda_codegen import unwrap_node
 import numpy as np
+import scipy.sparse as sp
 
 
 class sum(LinOp):
@@ -17,7 +18,10 @@ class sum(LinOp):
         Reads from inputs and writes to outputs.
         """
         if len(inputs) > 1:
-            np.copyto(outputs[0], np.sum(inputs, 0))
+            # Accumulate in the output rather than stacking the inputs.
+            np.add(inputs[0], inputs[1], out=outputs[0])
+            for arg in inputs[2:]:
+                outputs[0] += arg
         else:
             np.copyto(outputs[0], inputs[0])
 
@@ -28,7 +32,17 @@ class sum(LinOp):
         """
         for output in outputs:
             np.copyto(output, inputs[0])
-            
+
+    def can_batch(self):
+        """Do forward and adjoint broadcast over leading batch axes?
+        """
+        return True
+
+    def get_sparse(self):
+        """Returns the lin op as sparse matrices, one per input.
+        """
+        return [sp.identity(self.size, format='csr')] * len(self.input_nodes)
+
     def forward_cuda_kernel(self, cg, num_tmp_variables, abs_idx, parent):
         #print("sum:forward:cuda")
         input_nodes = cg.input_nodes(self)
@@ -44,6 +58,13 @@ class sum(LinOp):
     def adjoint_cuda_kernel(self, cg, num_tmp_variables, abs_idx, parent):
         #print("sum:adjoint:cuda")
         code, var, num_tmp_variables = cg.output_nodes(self)[0].adjoint_cuda_kernel(cg, num_tmp_variables, abs_idx, self)
+        # The kernel covers all the inputs from parent.
+        count = len([n for n in cg.input_nodes(self) if unwrap_node(n) is parent])
+        if count > 1:
+            res = "var_%d" % num_tmp_variables
+            num_tmp_variables += 1
+            code += "float %(res)s = %(count)d * %(var)s;\n" % locals()
+            var = res
         return code, var, num_tmp_variables
 
     def is_diag(self, freq=False):
@@ -109,13 +130,33 @@ class copy(sum):
         """
         super(copy, self).forward(inputs, outputs)
         
+    def get_sparse(self):
+        """Returns the lin op as sparse matrices, one per input.
+
+        The copy maps its input to each of its outputs.
+        """
+        return [sp.identity(self.size, format='csr')]
+
     def forward_cuda_kernel(self, cg, num_tmp_variables, abs_idx, parent):
         #print("copy:forward:cuda")
-        return super(copy, self).adjoint_cuda_kernel(ReverseInOut(cg), num_tmp_variables, abs_idx, parent)
-        
+        return cg.input_nodes(self)[0].forward_cuda_kernel(cg, num_tmp_variables, abs_idx, self)
+
     def adjoint_cuda_kernel(self, cg, num_tmp_variables, abs_idx, parent):
         #print("copy:adjoint:cuda")
-        return super(copy, self).forward_cuda_kernel(ReverseInOut(cg), num_tmp_variables, abs_idx, parent)
+        res = "var_%d" % num_tmp_variables
+        num_tmp_variables += 1
+        code = "float %(res)s = 0; /*copy*/ \n" % locals()
+        # The kernel of an output covers all its inputs from the copy, so
+        # each output is visited once.
+        visited = []
+        for n in cg.output_nodes(self):
+            if unwrap_node(n) in visited:
+                continue
+            visited.append(unwrap_node(n))
+            icode, ivar, num_tmp_variables = n.adjoint_cuda_kernel(cg, num_tmp_variables, abs_idx, self)
+            code += icode
+            code += "%(res)s += %(ivar)s;\n" % locals()
+        return code, res, num_tmp_variables
 
     def norm_bound(self, input_mags):
         """Gives an upper bound on the magnitudes of the outputs given inputs.
@@ -1,6 +1,7 @@
 
 from .lin_op import LinOp
 import numpy as np
+from proximal.utils.utils import selection_matrix
 
 
 class transpose(LinOp):
@@ -19,7 +20,8 @@ class transpose(LinOp):
 
         Reads from inputs and writes to outputs.
         """
-        shaped_input = np.transpose(inputs[0], self.axes)
+        shaped_input = np.transpose(inputs[0],
+                                    self.batch_axes(self.axes, inputs[0].ndim))
         np.copyto(outputs[0], shaped_input)
 
     def adjoint(self, inputs, outputs):
@@ -27,9 +29,32 @@ class transpose(LinOp):
 
         Reads from inputs and writes to outputs.
         """
-        shaped_input = np.transpose(inputs[0], self.inverse)
+        shaped_input = np.transpose(inputs[0],
+                                    self.batch_axes(self.inverse, inputs[0].ndim))
         np.copyto(outputs[0], shaped_input)
 
+    def input_views(self, output):
+        """Returns views of the output buffer to use as the input buffers.
+        """
+        return [np.transpose(output, self.batch_axes(self.inverse, output.ndim))]
+
+    def can_batch(self):
+        """Do forward and adjoint broadcast over leading batch axes?
+        """
+        return True
+
+    def get_sparse(self):
+        """Returns the lin op as sparse matrices, one per input.
+        """
+        indices = np.reshape(np.arange(self.size), self.input_nodes[0].shape)
+        return [selection_matrix(np.transpose(indices, self.axes), self.size)]
+
+    def batch_axes(self, axes, ndim):
+        """Extends the permutation axes to keep any leading batch axes.
+        """
+        lead = ndim - len(axes)
+        return tuple(range(lead)) + tuple(lead + i for i in axes)
+
     def forward_cuda_kernel(self, cg, num_tmp_vars, absidx, parent):
         new_idx = [absidx[i] for i in self.inverse]
         return cg.input_nodes(self)[0].forward_cuda_kernel(cg, num_tmp_vars, new_idx, self)
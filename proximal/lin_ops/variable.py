@@ -60,6 +60,11 @@ class Variable(LinOp):
         """
         self._value = val
 
+    def evaluate(self, memo):
+        """Returns the value of the lin op.
+        """
+        return self._value
+
     def norm_bound(self, input_mags):
         """Gives an upper bound on the magnitudes of the outputs given inputs.
 
@@ -1,6 +1,7 @@
 from .lin_op import LinOp
-from ..utils.cuda_codegen import indent, sub2ind, ind2subCode, NodeReverseInOut, ReverseInOut
+from ..utils.cuda_codegen import indent, sub2ind, ind2subCode, ReverseInOut, unwrap_node
 import numpy as np
+import scipy.sparse as sp
 
 
 class vstack(LinOp):
@@ -17,10 +18,12 @@ class vstack(LinOp):
 
         Reads from inputs and writes to outputs.
         """
+        lead = outputs[0].shape[:-1]
         offset = 0
-        for idx, input_data in enumerate(inputs):
-            size = input_data.size
-            outputs[0][offset:size + offset] = input_data.flatten()
+        for input_data, shape in zip(inputs, self.input_shapes):
+            size = int(np.prod(shape))
+            outputs[0][..., offset:size + offset] = np.reshape(input_data,
+                                                               lead + (size,))
             offset += size
 
     def adjoint(self, inputs, outputs):
@@ -29,12 +32,40 @@ class vstack(LinOp):
         Reads from inputs and writes to outputs.
         """
         offset = 0
-        for idx, output_data in enumerate(outputs):
-            size = output_data.size
-            data = inputs[0][offset:size + offset]
-            output_data[:] = np.reshape(data, output_data.shape)
+        for output_data, shape in zip(outputs, self.input_shapes):
+            size = int(np.prod(shape))
+            data = inputs[0][..., offset:size + offset]
+            output_data[...] = np.reshape(data, output_data.shape)
             offset += size
 
+    def input_views(self, output):
+        """Returns views of the output buffer to use as the input buffers.
+        """
+        views = []
+        offset = 0
+        for shape in self.input_shapes:
+            size = int(np.prod(shape))
+            views.append(np.reshape(output[..., offset:size + offset],
+                                    output.shape[:-1] + shape))
+            offset += size
+        return views
+
+    def can_batch(self):
+        """Do forward and adjoint broadcast over leading batch axes?
+        """
+        return True
+
+    def get_sparse(self):
+        """Returns the lin op as sparse matrices, one per input.
+        """
+        blocks = []
+        offset = 0
+        for shape in self.input_shapes:
+            size = int(np.prod(shape))
+            blocks.append(sp.eye(self.size, size, -offset, format='csr'))
+            offset += size
+        return blocks
+
     def forward_cuda_kernel(self, cg, num_tmp_vars, abs_idx, parent):
         #print("vstack:forward:cuda")
         # multiple reshaped output in, linear index out
@@ -76,32 +107,29 @@ if( %(abs_idx)s >= %(offset)d && %(abs_idx)s < %(endoffset)d )
     def adjoint_cuda_kernel(self, cg, num_tmp_vars, abs_idx, parent):
         #print("vstack:adjoint:cuda")
         input_nodes = cg.input_nodes(self)
-        found = False
-        #idx = input_nodes.index(parent)
-        for idx,n in enumerate(input_nodes):
-            while isinstance(n, NodeReverseInOut):
-                n = n.n
-            if n is parent:
-                found = True
-                break
-        assert(found)
-        #print("vstack(%s):adjoint -> found parent idx=%d %s sizes=%s" %( repr(self), idx, repr(n), [x.size for x in input_nodes]))
-        offset = 0
-        for i in range(idx):
-            offset += input_nodes[i].size
-        shape = self.input_shapes[idx]
-        var = "idx_%d" % num_tmp_vars
+        # The kernel covers all the inputs from parent, each with its slice.
+        idxs = [idx for idx, n in enumerate(input_nodes) if unwrap_node(n) is parent]
+        assert(len(idxs) > 0)
+        res = "var_%d" % num_tmp_vars
         num_tmp_vars += 1
-        code = ("int %(var)s = %(offset)d + (" % locals()) + sub2ind(abs_idx, shape) + ");\n"
-        #print(" called by parent %s, idx=%d -> offset=%d, shape=%s, code=%s" % (n, idx, offset, shape,code))
-        try:
-            icode, var, num_tmp_vars = cg.output_nodes(self)[0].adjoint_cuda_kernel(cg, num_tmp_vars, [var], self)
-        except KeyError:
-            res = "var_%(num_tmp_vars)d" % locals()
+        code = "float %(res)s = 0; /*vstack*/\n" % locals()
+        for idx in idxs:
+            offset = 0
+            for i in range(idx):
+                offset += input_nodes[i].size
+            shape = self.input_shapes[idx]
+            var = "idx_%d" % num_tmp_vars
             num_tmp_vars += 1
-            icode = "float %(res)s = x[%(var)s];\n" % locals()
-            var = res
-        return code + icode, var, num_tmp_vars
+            code += ("int %(var)s = %(offset)d + (" % locals()) + sub2ind(abs_idx, shape) + ");\n"
+            try:
+                icode, ivar, num_tmp_vars = cg.output_nodes(self)[0].adjoint_cuda_kernel(cg, num_tmp_vars, [var], self)
+            except KeyError:
+                ivar = "var_%(num_tmp_vars)d" % locals()
+                num_tmp_vars += 1
+                icode = "float %(ivar)s = x[%(var)s];\n" % locals()
+            code += icode
+            code += "%(res)s += %(ivar)s;\n" % locals()
+        return code, res, num_tmp_vars
 
     def is_gram_diag(self, freq=False):
         """Is the lin op's Gram matrix diagonal (in the frequency domain)?
@@ -168,6 +196,16 @@ class split(vstack):
         """
         super(split, self).forward(inputs, outputs)
 
+    def input_views(self, output):
+        """Returns views of the output buffer to use as the input buffers.
+        """
+        return NotImplemented
+
+    def output_views(self, input):
+        """Returns views of the input buffer to use as the output buffers.
+        """
+        return super(split, self).input_views(input)
+
     def forward_cuda_kernel(self, cg, num_tmp_variables, abs_idx, parent):
         #print("split:forward:cuda")
         return super(split, self).adjoint_cuda_kernel(ReverseInOut(cg), num_tmp_variables, abs_idx, parent)
@@ -38,9 +38,9 @@ class warp(LinOp):
         self.tmpfwd = np.zeros((shape[0], shape[1],
                                 shape[2] if (len(shape) > 2) else 1,
                                 H.shape[2] if (len(H.shape) > 2) else 1),
-                               dtype=np.float32, order='FORTRAN')
+                               dtype=np.float32, order='F')
         self.tmpadj = np.zeros((shape[0], shape[1], shape[2] if (
-            len(shape) > 2) else 1), dtype=np.float32, order='FORTRAN')
+            len(shape) > 2) else 1), dtype=np.float32, order='F')
 
         # Halide homographies
         if len(H.shape) == 2:
@@ -54,6 +54,11 @@ class warp(LinOp):
 
         super(warp, self).__init__([arg], shape, implem)
 
+    def implementations(self):
+        """The implementations the lin op has for its shape.
+        """
+        return [Impl['numpy'], Impl['halide']]
+
     def forward(self, inputs, outputs):
         """The forward operator.
 
@@ -63,7 +68,7 @@ class warp(LinOp):
         if self.implementation == Impl['halide']:
 
             # Halide implementation
-            tmpin = np.asfortranarray(inputs[0].astype(np.float32))
+            tmpin = np.asfortranarray(inputs[0], dtype=np.float32)
             Halide('A_warp.cpp').A_warp(tmpin, self.Hinvf, self.tmpfwd)  # Call
             np.copyto(outputs[0], np.reshape(self.tmpfwd, self.shape))
 
@@ -99,9 +104,9 @@ class warp(LinOp):
 
             # Halide implementation
             if len(self.H.shape) == 2:
-                tmpin = np.asfortranarray(inputs[0][..., np.newaxis].astype(np.float32))
+                tmpin = np.asfortranarray(inputs[0][..., np.newaxis], dtype=np.float32)
             else:
-                tmpin = np.asfortranarray(inputs[0].astype(np.float32))
+                tmpin = np.asfortranarray(inputs[0], dtype=np.float32)
 
             Halide('At_warp.cpp').At_warp(tmpin, self.Hf, self.tmpadj)  # Call
             np.copyto(outputs[0], self.tmpadj)
@@ -128,4 +133,52 @@ class warp(LinOp):
                     # Necessary due to array layout in opencv
                     outputs[0] += warpedInput
 
-    # TODO what is the spectral norm of a warp?
+    def norm_bound(self, input_mags):
+        """Gives an upper bound on the magnitudes of the outputs given inputs.
+
+        Parameters
+        ----------
+        input_mags : list
+            List of magnitudes of inputs.
+
+        Returns
+        -------
+        float
+            Magnitude of outputs.
+        """
+        # The warps of a stack of homographies are stacked in the output.
+        if len(self.H.shape) == 2:
+            bounds = [self.warp_bound(self.H)]
+        else:
+            bounds = [self.warp_bound(self.H[:, :, j]) for j in range(self.H.shape[2])]
+        return np.linalg.norm(bounds, 2) * input_mags[0]
+
+    def warp_bound(self, H):
+        """Bounds the spectral norm of the bilinear warp with homography H.
+
+        Uses the Schur test ||A||^2 <= max_i sum_j |A_ij| * max_j sum_i |A_ij|.
+        Rows of the interpolation sum to at most one, and columns to about
+        the area change (Jacobian determinant) of the sampling map.
+        """
+        rows, cols = self.shape[:2]
+        # Output pixel (r, c) samples the input at H^-T (c, r, 1).
+        c, r = np.meshgrid(np.arange(cols), np.arange(rows))
+        pos = np.linalg.solve(H.T, np.stack([np.ravel(c), np.ravel(r), np.ones(c.size)]))
+        # OpenCV rounds the sample positions to 1/32 pixel.
+        sx = np.round(32 * pos[0] / pos[2]) / 32
+        sy = np.round(32 * pos[1] / pos[2]) / 32
+        x0 = np.floor(sx)
+        y0 = np.floor(sy)
+        fx = sx - x0
+        fy = sy - y0
+        row_sums = np.zeros(rows * cols)
+        col_sums = np.zeros(rows * cols)
+        for dy, wy in [(0, 1 - fy), (1, fy)]:
+            for dx, wx in [(0, 1 - fx), (1, fx)]:
+                yy = y0 + dy
+                xx = x0 + dx
+                inside = (yy >= 0) & (yy < rows) & (xx >= 0) & (xx < cols)
+                weight = (wy * wx)[inside]
+                row_sums[inside] += weight
+                np.add.at(col_sums, (yy * cols + xx)[inside].astype(int), weight)
+        return np.sqrt(np.max(row_sums) * np.max(col_sums))
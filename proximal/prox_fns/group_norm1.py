@@ -28,6 +28,14 @@ class group_norm1(ProxFn):
 
         super(group_norm1, self).__init__(lin_op, **kwargs)
 
+    def implementations(self):
+        """The implementations the prox fn has for its shape.
+        """
+        if len(self.lin_op.shape) in [3, 4] and self.lin_op.shape[-1] == 2 and \
+           self.group_dims == [len(self.lin_op.shape) - 1]:
+            return [Impl['numpy'], Impl['halide']]
+        return [Impl['numpy']]
+
     def _prox(self, rho, v, *args, **kwargs):
         """x = v *  (1 - (1/rho) * 1/||x||_g )_+
         """
@@ -39,9 +47,9 @@ class group_norm1(ProxFn):
             # Halide implementation
             if len(self.lin_op.shape) == 3:
                 tmpin = np.asfortranarray(np.reshape(
-                    v, (self.lin_op.shape[0], self.lin_op.shape[1], 1, 2)).astype(np.float32))
+                    v, (self.lin_op.shape[0], self.lin_op.shape[1], 1, 2)), dtype=np.float32)
             else:
-                tmpin = np.asfortranarray(v.astype(np.float32))
+                tmpin = np.asfortranarray(v, dtype=np.float32)
 
             Halide('prox_IsoL1.cpp').prox_IsoL1(tmpin, 1.0 / rho, self.tmpout)  # Call
             np.copyto(v, np.reshape(self.tmpout, self.lin_op.shape))
@@ -144,6 +152,11 @@ class weighted_group_norm1(group_norm1):
         self.weight = weight
         super(weighted_group_norm1, self).__init__(lin_op, group_dims, **kwargs)
 
+    def implementations(self):
+        """The implementations the prox fn has for its shape.
+        """
+        return [Impl['numpy']]
+
     def _prox(self, rho, v, it):
         """x = v *  (1 - (|W|/rho) * /||x||_g )_+
         """
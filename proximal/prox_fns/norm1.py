@@ -14,13 +14,20 @@ class norm1(ProxFn):
         self.v_sign = np.zeros(self.lin_op.shape, dtype=float)
         self.tmpout = np.zeros(self.lin_op.shape, dtype=np.float32, order='F')
 
+    def implementations(self):
+        """The implementations the prox fn has for its shape.
+        """
+        if len(self.lin_op.shape) in [2, 3, 4]:
+            return [Impl['numpy'], Impl['halide']]
+        return [Impl['numpy']]
+
     def _prox(self, rho, v, *args, **kwargs):
         """x = sign(v)*(|v| - 1/rho)_+
         """
 
         if self.implementation == Impl['halide'] and (len(self.lin_op.shape) in [2, 3, 4]):
             # Halide implementation
-            tmpin = np.asfortranarray(v.astype(np.float32))
+            tmpin = np.asfortranarray(v, dtype=np.float32)
             Halide('prox_L1.cpp').prox_L1(tmpin, 1. / rho, self.tmpout)
             np.copyto(v, self.tmpout)
 
@@ -48,6 +55,11 @@ class weighted_norm1(norm1):
         self.weight = weight
         super(weighted_norm1, self).__init__(lin_op, **kwargs)
 
+    def implementations(self):
+        """The implementations the prox fn has for its shape.
+        """
+        return [Impl['numpy']]
+
     def _prox(self, rho, v, *args, **kwargs):
         """x = sign(v)*(|v| - |W|/rho)_+
         """
@@ -37,6 +37,13 @@ class patch_NLM(ProxFn):
 
         super(patch_NLM, self).__init__(lin_op, **kwargs)
 
+    def implementations(self):
+        """The implementations the prox fn has for its shape.
+        """
+        if len(self.lin_op.shape) == 3 and self.lin_op.shape[2] == 3:
+            return [Impl['numpy'], Impl['halide']]
+        return [Impl['numpy']]
+
     def _prox(self, rho, v, *args, **kwargs):
         """x = denoise_gaussian_NLM( tonemap(v), sqrt(1/rho))
         """
@@ -45,7 +52,7 @@ class patch_NLM(ProxFn):
            len(self.lin_op.shape) == 3 and self.lin_op.shape[2] == 3:
 
             # Halide implementation
-            tmpin = np.asfortranarray(v.astype(np.float32))
+            tmpin = np.asfortranarray(v, dtype=np.float32)
             Halide('prox_NLM.cpp').prox_NLM(tmpin, 1. / rho, self.paramsh, self.tmpout)
             np.copyto(v, self.tmpout)
 
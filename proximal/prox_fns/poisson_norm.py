@@ -20,13 +20,20 @@ class poisson_norm(ProxFn):
 
         super(poisson_norm, self).__init__(lin_op, **kwargs)
 
+    def implementations(self):
+        """The implementations the prox fn has for its shape.
+        """
+        if len(self.lin_op.shape) in [2, 3, 4]:
+            return [Impl['numpy'], Impl['halide']]
+        return [Impl['numpy']]
+
     def _prox(self, rho, v, *args, **kwargs):
         """x = 1/2* ( v - 1./rho + sqrt( ||v - 1./rho||^2 + 4 * 1./rho * b ) )
         """
         if self.implementation == Impl['halide'] and (len(self.lin_op.shape) in [2, 3, 4]):
 
             # Halide implementation
-            tmpin = np.asfortranarray(v.astype(np.float32))
+            tmpin = np.asfortranarray(v, dtype=np.float32)
             Halide('prox_Poisson.cpp').prox_Poisson(
                 tmpin, self.maskh, self.bph, np.float32(1. / rho), self.tmpout)
             np.copyto(v, self.tmpout)
@@ -67,6 +74,11 @@ class weighted_poisson_norm(poisson_norm):
         self.weight = weight
         super(weighted_poisson_norm, self).__init__(lin_op, bp, **kwargs)
 
+    def implementations(self):
+        """The implementations the prox fn has for its shape.
+        """
+        return [Impl['numpy']]
+
     def _prox(self, rho, v, *args, **kwargs):
         """x = 1/2* ( v - |W|/rho + sqrt( ||v - |W|/rho||^2 + 4 * 1./rho * b ) )
         """
@@ -56,6 +56,11 @@ class ProxFn(object):
     def implementation(self, im):
         return self.implementation
 
+    def implementations(self):
+        """The implementations the prox fn has for its shape.
+        """
+        return [Impl['numpy']]
+
     def variables(self):
         """Return a list of the variables in the problem.
         """
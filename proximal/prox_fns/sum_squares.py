@@ -72,12 +72,17 @@ class weighted_sum_squares(sum_squares):
 class least_squares(sum_squares):
     """The function ||K*x||_2^2.
 
-       Here K is a computation graph (vector to vector lin op).
+       Here K is a computation graph (vector to vector lin op). A graph
+       already built for lin_op can be passed as K.
     """
 
     def __init__(self, lin_op, offset, diag=None, freq_diag=None,
-                 freq_dims=None, implem=Impl['numpy'], **kwargs):
-        self.K = CompGraph(lin_op)
+                 freq_dims=None, dtype=np.float64, implem=Impl['numpy'], K=None,
+                 **kwargs):
+        self.dtype = dtype
+        if K is None:
+            K = CompGraph.cached(lin_op, dtype=dtype)
+        self.K = K
         self.offset = offset
         self.diag = diag
         # TODO: freq diag is supposed to be True/False. What is going on below?
@@ -92,6 +97,8 @@ class least_squares(sum_squares):
 
             self.freq_shape = self.K.orig_end.variables()[0].shape
             self.freq_diag = np.reshape(self.freq_diag, self.freq_shape)
+            self.freq_diag = self.freq_diag.astype(
+                np.result_type(self.freq_diag, dtype), copy=False)
             if implem == Impl['halide'] and \
                     (len(self.freq_shape) == 2 or (len(self.freq_shape) == 2 and
                                                    self.freq_dims == 2)):
@@ -115,7 +122,8 @@ class least_squares(sum_squares):
         -------
         list
         """
-        return [self.offset, self.diag, self.orig_freq_diag, self.orig_freq_dims]
+        return [self.offset, self.diag, self.orig_freq_diag, self.orig_freq_dims,
+                self.dtype]
 
     def _prox(self, rho, v, b=None, lin_solver="cg", *args, **kwargs):
         """x = argmin_x ||K*x - self.offset - b||_2^2 + (rho/2)||x-v||_2^2.
@@ -129,7 +137,7 @@ class least_squares(sum_squares):
     def _eval(self, v):
         """Evaluate the function on v (ignoring parameters).
         """
-        Kv = np.zeros(self.K.output_size)
+        Kv = np.zeros(self.K.output_size, dtype=self.dtype)
         self.K.forward(v.ravel(), Kv)
         return super(least_squares, self)._eval(Kv - self.offset)
     
@@ -137,7 +145,7 @@ class least_squares(sum_squares):
         # KtK Operator is diagonal
         if self.diag is not None:
 
-            Ktb = np.zeros(self.K.input_size)
+            Ktb = np.zeros(self.K.input_size, dtype=self.dtype)
             self.K.adjoint(b, Ktb)
             if rho is None:
                 Ktb /= self.diag
@@ -149,7 +157,7 @@ class least_squares(sum_squares):
 
         # KtK operator is diagonal in frequency domain.
         elif self.freq_diag is not None:
-            Ktb = np.zeros(self.K.input_size)
+            Ktb = np.zeros(self.K.input_size, dtype=self.dtype)
             self.K.adjoint(b, Ktb)
 
             # Frequency inversion
@@ -158,7 +166,7 @@ class least_squares(sum_squares):
                      (len(self.freq_shape) == 2 and self.freq_dims == 2)):
 
                 Halide('fft2_r2c.cpp').fft2_r2c(np.asfortranarray(np.reshape(
-                    Ktb.astype(np.float32), self.freq_shape)), 0, 0, self.ftmp_halide)
+                    Ktb, self.freq_shape), dtype=np.float32), 0, 0, self.ftmp_halide)
 
                 Ktb = 1j * self.ftmp_halide[..., 1]
                 Ktb += self.ftmp_halide[..., 0]
@@ -167,7 +175,7 @@ class least_squares(sum_squares):
                     Ktb /= self.freq_diag
                 else:
                     Halide('fft2_r2c.cpp').fft2_r2c(np.asfortranarray(np.reshape(
-                        v.astype(np.float32), self.freq_shape)), 0, 0, self.ftmp_halide)
+                        v, self.freq_shape), dtype=np.float32), 0, 0, self.ftmp_halide)
 
                     vhat = self.ftmp_halide[..., 0] + 1j * self.ftmp_halide[..., 1]
                     Ktb *= 1.0 / rho
@@ -257,17 +265,16 @@ class least_squares(sum_squares):
     def solve_cg(self, b, rho=None, v=None, x_init=None, options=None):
         """Solve ||K*x - b||^2_2 + (rho/2)||x-v||_2^2.
         """
-        output_data = np.zeros(self.K.output_size)
+        gram = self.K.gram()
 
         def KtK(x, r):
-            self.K.forward(x, output_data)
-            self.K.adjoint(output_data, r)
+            gram.forward(x, r)
             if rho is not None:
                 r += rho * x
             return r
 
         # Compute Ktb
-        Ktb = np.zeros(self.K.input_size)
+        Ktb = np.zeros(self.K.input_size, dtype=self.dtype)
         self.K.adjoint(b, Ktb)
         if rho is not None:
             Ktb += rho * v
@@ -321,9 +328,9 @@ def cg(KtKfun, b, tol, num_iters, verbose, x_init=None, implem=Impl['numpy']):
 
     else:
         # Temp vars
-        x = np.zeros(b.shape)
-        r = np.zeros(b.shape)
-        Ap = np.zeros(b.shape)
+        x = np.zeros(b.shape, dtype=b.dtype)
+        r = np.zeros(b.shape, dtype=b.dtype)
+        Ap = np.zeros(b.shape, dtype=b.dtype)
 
     # Initialize x
     # Initialize everything to zero.
@@ -3,8 +3,10 @@ import proximal as px
 from proximal.lin_ops.vstack import vstack
 from proximal.algorithms import admm, pc, hqs, ladmm, absorb_offset
 from proximal.utils.cuda_codegen import PyCudaAdapter
+from proximal.utils.convergence_log import ConvergenceLog
 import cvxpy as cvx
 import numpy as np
+import tracemalloc
 
 
 class TestAlgs(BaseTest):
@@ -168,6 +170,70 @@ class TestAlgs(BaseTest):
         self.assertItemsAlmostEqual(x.value, [0])
         self.assertItemsAlmostEqual(y.value, [1])
 
+    def test_admm_adapt_rho(self):
+        """Test ADMM with residual balancing.
+        """
+        np.random.seed(1)
+        b = np.random.randn(20, 20)
+        w = np.random.rand(20, 20)
+        # Soft thresholding solves the problem.
+        sltn = np.sign(b) * np.maximum(np.abs(b) - w / 2, 0)
+        for rho in [1e-3, 1e3]:
+            x = px.Variable((20, 20))
+            psi_fns = [px.norm1(px.mul_elemwise(w, x))]
+            omega_fns = [px.sum_squares(x, b=b)]
+            admm.solve(psi_fns, omega_fns, rho=rho, adapt_rho=True, max_iters=1000,
+                       eps_abs=1e-6, eps_rel=1e-6, conv_check=10)
+            self.assertItemsAlmostEqual(x.value, sltn, places=4)
+
+        # Frequency diagonal and iterative inverses.
+        kernel = np.random.rand(3, 3)
+        values = []
+        for try_diagonalize in [True, False]:
+            x = px.Variable((20, 20))
+            psi_fns = [px.norm1(x)]
+            omega_fns = [px.sum_squares(px.conv(kernel, x), b=b)]
+            admm.solve(psi_fns, omega_fns, rho=1e-2, adapt_rho=True, max_iters=1000,
+                       eps_abs=1e-6, eps_rel=1e-6, conv_check=10,
+                       try_diagonalize=try_diagonalize)
+            values.append(x.value)
+        self.assertItemsAlmostEqual(values[0], values[1], places=3)
+
+    def test_anderson(self):
+        """Test Anderson acceleration of the fixed-point solvers.
+        """
+        np.random.seed(1)
+        b = np.random.randn(20, 20)
+        w = np.random.rand(20, 20)
+        # Soft thresholding solves the problem.
+        sltn = np.sign(b) * np.maximum(np.abs(b) - w / 2, 0)
+        for solver in [admm, pc, ladmm]:
+            iters = []
+            for accel in [None, "anderson"]:
+                x = px.Variable((20, 20))
+                psi_fns = [px.norm1(px.mul_elemwise(w, x))]
+                omega_fns = [px.sum_squares(x, b=b)]
+                convlog = ConvergenceLog()
+                solver.solve(psi_fns, omega_fns, max_iters=2000, eps_abs=1e-5,
+                             eps_rel=1e-5, conv_check=1, convlog=convlog, accel=accel)
+                self.assertItemsAlmostEqual(x.value, sltn, places=2)
+                iters.append(len(convlog.objective_val))
+            self.assertTrue(2 * iters[1] < iters[0])
+
+        # Through Problem.solve.
+        x = px.Variable((20, 20))
+        prob = px.Problem([px.norm1(px.grad(x)), px.sum_squares(x, b=b)])
+        prob.solve(solver="admm", eps_abs=1e-6, eps_rel=1e-6, max_iters=2000)
+        sltn = x.value.copy()
+        prob.solve(solver="admm", accel="anderson", accel_mem=10, accel_restart=4.0,
+                   eps_abs=1e-6, eps_rel=1e-6, max_iters=2000)
+        self.assertItemsAlmostEqual(x.value, sltn, places=3)
+        with self.assertRaises(RuntimeError):
+            prob.solve(solver="admm", accel="anderson", accel_restart=0.5)
+        # HQS is not a fixed-point iteration.
+        with self.assertRaises(RuntimeError):
+            prob.solve(solver="hqs", accel="anderson")
+
     def test_half_quadratic_splitting(self):
         """Test half quadratic splitting.
         """
@@ -272,6 +338,23 @@ class TestAlgs(BaseTest):
                            eps_rel=1e-5)
         self.assertItemsAlmostEqual(x.value, cvx_X.value, places=2)
 
+    def test_pock_chambolle_linesearch(self):
+        """Test the linesearch variant of Pock-Chambolle.
+        """
+        np.random.seed(1)
+        b = np.random.randn(20, 20)
+        w = np.random.rand(20, 20)
+        # Soft thresholding solves the problem.
+        sltn = np.sign(b) * np.maximum(np.abs(b) - w / 2, 0)
+        # The accelerated variant converges much faster.
+        for kw, places in [({}, 2), ({'tau': 100.0}, 2), ({'gamma': 2.0}, 4)]:
+            x = px.Variable((20, 20))
+            psi_fns = [px.norm1(px.mul_elemwise(w, x))]
+            omega_fns = [px.sum_squares(x, b=b)]
+            pc.solve(psi_fns, omega_fns, linesearch=True, max_iters=2000,
+                     eps_abs=1e-6, eps_rel=1e-6, conv_check=10, **kw)
+            self.assertItemsAlmostEqual(x.value, sltn, places=places)
+
     def test_equil(self):
         """Test equilibration.
         """
@@ -302,6 +385,57 @@ class TestAlgs(BaseTest):
             gamma * (np.linalg.norm(v)**2 + np.linalg.norm(u)**2)
         self.assertAlmostEqual((obj_val - sltn_val) / sltn_val, 0, places=3)
 
+    def test_allocations(self):
+        """Test that solver iterations update their buffers in place.
+        """
+        class AllocationLog(ConvergenceLog):
+            """Records the peak memory allocated during each iteration.
+            """
+            def __init__(self):
+                super(AllocationLog, self).__init__()
+                self.peaks = []
+
+            def tic(self):
+                self.start = tracemalloc.get_traced_memory()[0]
+                tracemalloc.reset_peak()
+                return super(AllocationLog, self).tic()
+
+            def toc(self):
+                self.peaks.append(tracemalloc.get_traced_memory()[1] - self.start)
+                return super(AllocationLog, self).toc()
+
+        np.random.seed(1)
+        n = 200
+        B = np.random.randn(n, n)
+        W = np.random.rand(n, n)
+        for solver in [pc, admm, ladmm, hqs]:
+            x = px.Variable((n, n))
+            psi_fns = [px.norm1(px.mul_elemwise(W, x)),
+                       px.norm1(px.subsample(x, (2, 2)))]
+            omega_fns = [px.sum_squares(x, b=B)]
+            log = AllocationLog()
+            tracemalloc.start()
+            try:
+                solver.solve(psi_fns, omega_fns, max_iters=5, convlog=log)
+            finally:
+                tracemalloc.stop()
+            # Only the x update may return a new array.
+            self.assertTrue(max(log.peaks[1:]) < 1.5 * B.nbytes)
+
+    def test_conv_check(self):
+        """Test that residuals are only computed on check iterations.
+        """
+        np.random.seed(1)
+        x = px.Variable((10, 10))
+        b = np.random.randn(10, 10)
+        psi_fns = [px.norm1(px.grad(x)), px.sum_squares(x, b=b)]
+        ladmm.solve(psi_fns, [], 0.1, 0.01, max_iters=20, conv_check=10,
+                    eps_abs=0, eps_rel=0)
+        K = px.CompGraph.cached(vstack([fn.lin_op for fn in psi_fns]))
+        # One forward and adjoint for v, one forward for z, two adjoints per check.
+        self.assertEqual(K.forward_log[K].evals, 2 * 20)
+        self.assertEqual(K.adjoint_log[K].evals, 20 + 2 * 2)
+
 if __name__ == "__main__":
     import sys
     if 'cuda' in sys.argv:
@@ -0,0 +1,617 @@
+from __future__ import division
+from proximal.tests.base_test import BaseTest
+from proximal.lin_ops import (Variable, conv, conv_nofft, grad, mul_elemwise,
+                              scale, subsample, vstack, reshape, transpose,
+                              laplacian, LinOpFactory, CompGraph,
+                              est_CompGraph_norm)
+from proximal.utils.norm_cache import NormCache
+from proximal.utils.c_codegen import c_compiler_available
+from proximal.utils.utils import Impl
+import numpy as np
+import os
+import shutil
+import tempfile
+
+
+class TestCompGraph(BaseTest):
+
+    def check_adjoint(self, K):
+        """Checks <K x, y> == <x, K^T y> for random x and y.
+        """
+        x = np.random.randn(K.input_size)
+        y = np.random.randn(K.output_size)
+        Kx = np.zeros(K.output_size)
+        KTy = np.zeros(K.input_size)
+        K.forward(x, Kx)
+        K.adjoint(y, KTy)
+        self.assertAlmostEqual(np.dot(Kx, y), np.dot(x, KTy))
+
+    def test_schedule(self):
+        """Test the precompiled execution schedule.
+        """
+        x = Variable((4, 5))
+        kernel = np.array([[1, 2], [3, 4]])
+        gx = grad(x)
+        K = CompGraph(vstack([conv(kernel, x), gx, 2 * gx,
+                              mul_elemwise(np.ones((4, 5)), x)]))
+
+        # Every node is scheduled exactly once in both directions.
+        # Variables are replaced by copy nodes and never evaluated,
+        # view nodes cost nothing at run time.
+        graph_nodes = set([n for n in K.nodes if not isinstance(n, Variable)])
+        self.assertTrue(K.start in K.view_nodes and K.end in K.view_nodes)
+        graph_nodes -= K.view_nodes
+        forward_nodes = [entry[0] for entry in K.forward_schedule]
+        adjoint_nodes = [entry[0] for entry in K.adjoint_schedule]
+        self.assertEqual(len(forward_nodes), len(set(forward_nodes)))
+        self.assertEqual(set(forward_nodes), graph_nodes)
+        self.assertEqual(set(adjoint_nodes), graph_nodes)
+
+        # Inputs are produced before they are consumed.
+        position = {node: idx for idx, node in enumerate(forward_nodes)}
+        for node in graph_nodes:
+            for node_in in K.input_nodes(node):
+                if node_in in position:
+                    self.assertTrue(position[node_in] < position[node])
+
+        # Repeated evaluations reuse the schedule.
+        val = np.random.randn(4, 5)
+        out = np.zeros(K.output_size)
+        K.forward(val.ravel(), out)
+        gval = np.zeros(gx.shape)
+        gx.forward([val], [gval])
+        offset = np.prod(x.shape)
+        self.assertItemsAlmostEqual(out[offset:offset + gval.size], gval)
+        out2 = np.zeros(K.output_size)
+        K.forward(val.ravel(), out2)
+        self.assertItemsAlmostEqual(out, out2)
+        self.check_adjoint(K)
+
+    def test_memory_planner(self):
+        """Test sharing of edge buffers between lin ops.
+        """
+        x = Variable((6, 5))
+        kernel = np.array([[1, 2], [3, 4]])
+        W = np.random.randn(6, 5)
+        expr = vstack([conv(kernel, 2 * mul_elemwise(W, conv(kernel, x))),
+                       grad(3 * x), mul_elemwise(W, x) * 0.5])
+        K = CompGraph(expr)
+        live_edges = [e for node in K.nodes for e in K.input_edges.get(node, [])]
+        buffers = set([id(arena) for arena in K.arenas])
+        self.assertTrue(len(buffers) < len(live_edges))
+        self.assertTrue(sum([a.size for a in K.arenas]) <
+                        sum([e.size for e in live_edges]))
+
+        # In place nodes share the buffer of their input, unless that would
+        # overwrite the arrays passed to forward/adjoint.
+        for node in K.nodes:
+            if node.can_run_in_place() and node is not K.end and \
+               K.output_edges[node][0] not in K.external_edges:
+                in_data = K.get_inputs(node)[0]
+                out_data = K.get_outputs(node)[0]
+                self.assertTrue(np.may_share_memory(in_data, out_data))
+
+        # Results match the unplanned evaluation.
+        val = np.random.randn(6, 5)
+        x.value = val
+        out = np.zeros(K.output_size)
+        K.forward(val.ravel(), out)
+        self.assertItemsAlmostEqual(out, expr.value)
+        K.forward(val.ravel(), out)
+        self.assertItemsAlmostEqual(out, expr.value)
+        self.check_adjoint(K)
+
+    def test_views(self):
+        """Test zero-copy views for vstack, split, reshape and transpose.
+        """
+        x = Variable((4, 5))
+        y = Variable(6)
+        kernel = np.array([[1, 2], [3, 4]])
+        cx = conv(kernel, x)
+        expr = vstack([reshape(cx, (5, 4)), transpose(grad(x), (2, 0, 1)),
+                       reshape(2 * y, (2, 3)),
+                       transpose(transpose(mul_elemwise(np.ones((4, 5)), x),
+                                           (1, 0)), (1, 0))])
+        K = CompGraph(expr)
+        for node in K.nodes:
+            if isinstance(node, (vstack, reshape)):
+                self.assertTrue(node in K.view_nodes)
+        scheduled = set([entry[0] for entry in K.forward_schedule])
+        self.assertFalse(scheduled & K.view_nodes)
+
+        # The convolution writes straight into the output array.
+        x.value = np.random.randn(4, 5)
+        y.value = np.random.randn(6)
+        val = np.concatenate([x.value.ravel(), y.value])
+        out = np.zeros(K.output_size)
+        K.forward(val, out)
+        self.assertItemsAlmostEqual(out, expr.value)
+        for node, inputs, outputs, timing in K.forward_schedule:
+            if node.orig_node is cx.orig_node:
+                self.assertTrue(np.may_share_memory(outputs[0], out))
+
+        # Arrays that cannot be viewed are copied.
+        strided = np.zeros(2 * K.output_size)[::2]
+        K.forward(val, strided)
+        self.assertItemsAlmostEqual(strided, expr.value)
+        val32 = val.astype(np.float32)
+        K.forward(val32, out)
+        self.assertItemsAlmostEqual(out, expr.value)
+
+        # The caller's arrays are left untouched.
+        u = np.random.randn(K.output_size)
+        u_orig = u.copy()
+        v = np.zeros(K.input_size)
+        K.adjoint(u, v)
+        self.assertItemsAlmostEqual(u, u_orig)
+        self.check_adjoint(K)
+
+    def test_elementwise_fusion(self):
+        """Test fusing chains of scale and mul_elemwise.
+        """
+        x = Variable((4, 5))
+        W1 = np.random.randn(4, 5)
+        W2 = np.random.randn(4, 5)
+        gx = 2 * (3 * grad(x))
+        shared = mul_elemwise(W2, x)
+        expr = vstack([scale(2, mul_elemwise(W1, scale(-3, mul_elemwise(W2, x)))),
+                       gx, 0.5 * shared, 4 * shared])
+        K = CompGraph(expr)
+        scales = [n for n in K.nodes if isinstance(n, scale)]
+        muls = [n for n in K.nodes if isinstance(n, mul_elemwise)]
+        # Chains are not fused through a node with several consumers.
+        self.assertEqual(len(scales), 3)
+        self.assertTrue(6 in [n.scalar for n in scales])
+        self.assertEqual(len(muls), 2)
+
+        x.value = np.random.randn(4, 5)
+        out = np.zeros(K.output_size)
+        K.forward(x.value.ravel(), out)
+        self.assertItemsAlmostEqual(out, expr.value)
+        self.check_adjoint(K)
+
+        # A chain at the end of the graph.
+        expr = 2 * mul_elemwise(W1, 3 * x)
+        K = CompGraph(expr)
+        self.assertEqual(len(K.forward_schedule), 2)
+        K.forward(x.value.ravel(), out[:x.size])
+        self.assertItemsAlmostEqual(out[:x.size], expr.value)
+        self.check_adjoint(K)
+
+        # Fused weights keep the precision of the graph.
+        expr = (1. / 3) * mul_elemwise(W1, x)
+        K = CompGraph(expr)
+        K.forward(x.value.ravel(), out[:x.size])
+        self.assertTrue(np.allclose(out[:x.size], expr.value.ravel(), rtol=1e-12, atol=0))
+        self.assertEqual(CompGraph(expr, dtype=np.float32).nodes[0].weight.dtype, np.float32)
+
+    def test_conv_fusion(self):
+        """Test fusing chains of convolutions in the frequency domain.
+        """
+        x = Variable((6, 5, 3))
+        k1 = np.random.randn(3, 3, 1)
+        k2 = np.random.randn(2, 2, 1)
+        blur = conv(k2, 2 * conv(k1, conv(k2, x, dims=2), dims=2), dims=2)
+        other = conv(k1, conv(np.random.randn(3, 3, 3), x), dims=2)
+        expr = vstack([blur, other])
+        K = CompGraph(expr)
+        convs = [n for n in K.nodes if isinstance(n, conv)]
+        # Convolutions with different dims are not fused.
+        self.assertEqual(len(convs), 3)
+        self.assertFalse([n for n in K.nodes if isinstance(n, scale)])
+
+        x.value = np.random.randn(6, 5, 3)
+        out = np.zeros(K.output_size)
+        K.forward(x.value.ravel(), out)
+        self.assertItemsAlmostEqual(out, expr.value)
+        self.check_adjoint(K)
+
+    def test_parallel(self):
+        """Test running independent branches on a thread pool.
+        """
+        x = Variable((8, 6))
+        kernel = np.random.randn(3, 3)
+        W = np.random.randn(8, 6)
+        expr = vstack([grad(conv(kernel, x)), mul_elemwise(W, x),
+                       conv(kernel, 2 * x)])
+        K = CompGraph(expr)
+        Kp = CompGraph(expr, num_threads=4)
+        self.assertTrue(max([len(level) for level in Kp.forward_levels]) > 1)
+        self.assertTrue(max([len(level) for level in Kp.adjoint_levels]) > 1)
+
+        # Nodes running concurrently never share an output buffer.
+        for levels in [Kp.forward_levels, Kp.adjoint_levels]:
+            for level in levels:
+                outputs = [out for entry in level for out in entry[2]]
+                for i, out1 in enumerate(outputs):
+                    for out2 in outputs[i + 1:]:
+                        self.assertFalse(np.may_share_memory(out1, out2))
+
+        val = np.random.randn(K.input_size)
+        out = np.zeros(K.output_size)
+        outp = np.zeros(K.output_size)
+        for _ in range(3):
+            K.forward(val, out)
+            Kp.forward(val, outp)
+            self.assertItemsAlmostEqual(out, outp)
+        self.check_adjoint(Kp)
+
+    def test_batch(self):
+        """Test evaluating the graph on a batch of inputs.
+        """
+        x = Variable((8, 6))
+        y = Variable((6, 8))
+        kernel = np.random.randn(3, 3)
+        W = np.random.randn(8, 6)
+        expr = vstack([grad(conv(kernel, x)), mul_elemwise(W, x),
+                       3 * transpose(y, (1, 0)) + reshape(x, (8, 6)),
+                       subsample(conv(kernel, x), (2, 3))])
+        K = CompGraph(expr)
+        self.assertTrue(all([entry[0].can_batch() for entry in K.forward_schedule]))
+
+        X = np.random.randn(5, K.input_size)
+        U = np.random.randn(5, K.output_size)
+        Y = np.zeros((5, K.output_size))
+        V = np.zeros((5, K.input_size))
+        for _ in range(2):
+            K.forward_batch(X, Y)
+            K.adjoint_batch(U, V)
+            for i in range(5):
+                self.assertItemsAlmostEqual(Y[i], K.forward(X[i], np.zeros(K.output_size)))
+                self.assertItemsAlmostEqual(V[i], K.adjoint(U[i], np.zeros(K.input_size)))
+
+        # Lin ops without batch support run once per item.
+        K = CompGraph(conv_nofft(kernel, x) + x)
+        self.assertFalse(all([entry[0].can_batch() for entry in K.forward_schedule]))
+        X = np.random.randn(3, K.input_size)
+        Y = K.forward_batch(X, np.zeros((3, K.output_size)))
+        for i in range(3):
+            self.assertItemsAlmostEqual(Y[i], K.forward(X[i], np.zeros(K.output_size)))
+
+    def test_cache(self):
+        """Test reusing graphs with the same structure.
+        """
+        CompGraph.clear_cache()
+        x = Variable((8, 6))
+        kernel = np.random.randn(3, 3)
+        W = np.random.randn(8, 6)
+
+        def expr(scalar):
+            return vstack([conv(kernel, x), scalar * mul_elemwise(W, x)])
+
+        K = CompGraph.cached(expr(2))
+        self.assertTrue(CompGraph.cached(expr(2)) is K)
+        self.assertTrue(CompGraph.cached(expr(2), dtype=np.float32) is not K)
+        K3 = CompGraph.cached(expr(3))
+        self.assertTrue(K3 is not K)
+        self.assertTrue(CompGraph.cached(vstack([conv(kernel + 1, x),
+                                                 2 * mul_elemwise(W, x)]))
+                        is not K)
+
+        # A shared subexpression is not the same graph as two equal copies.
+        y = conv(kernel, x)
+        self.assertTrue(CompGraph.cached(vstack([y, y])) is not
+                        CompGraph.cached(vstack([conv(kernel, x), conv(kernel, x)])))
+
+        val = np.random.randn(K.input_size)
+        out = np.zeros(K.output_size)
+        CompGraph(expr(3)).forward(val, out)
+        self.assertItemsAlmostEqual(K3.forward(val, np.zeros(K.output_size)), out)
+
+        # Parameters are compared by value.
+        W[0, 0] += 1
+        self.assertTrue(CompGraph.cached(expr(2)) is not K)
+
+        CompGraph.cache_size = 2
+        for scalar in range(4):
+            CompGraph.cached(expr(scalar))
+        self.assertEqual(len(CompGraph.cache), 2)
+        CompGraph.cache_size = 0
+        self.assertTrue(CompGraph.cached(expr(3)) is not CompGraph.cached(expr(3)))
+        self.assertEqual(len(CompGraph.cache), 2)
+        CompGraph.cache_size = 16
+        CompGraph.clear_cache()
+        self.assertEqual(len(CompGraph.cache), 0)
+
+    def test_update_scalars(self):
+        """Test updating a graph after changing scalars in place.
+        """
+        x = Variable((8, 6))
+        kernel = np.random.randn(3, 3)
+        W = np.random.randn(8, 6)
+        ops = [scale(2, conv(kernel, x)), scale(3, mul_elemwise(W, x)),
+               scale(4, scale(5, x))]
+        expr = vstack([grad(x)] + ops)
+        K = CompGraph(expr)
+        val = np.random.randn(K.input_size)
+        out = np.random.randn(K.output_size)
+        for scalar in [0.5, -1]:
+            for op in ops:
+                op.scalar *= scalar
+            self.assertTrue(K.update_scalars())
+            K2 = CompGraph(expr)
+            self.assertItemsAlmostEqual(K.forward(val, np.zeros(K.output_size)),
+                                        K2.forward(val, np.zeros(K.output_size)))
+            self.assertItemsAlmostEqual(K.adjoint(out, np.zeros(K.input_size)),
+                                        K2.adjoint(out, np.zeros(K.input_size)))
+
+        # Equal subtrees evaluated once cannot differ afterwards.
+        ops = [scale(2, x), scale(2, x)]
+        K = CompGraph(vstack(ops))
+        ops[0].scalar = 3
+        self.assertFalse(K.update_scalars())
+
+    def test_large_graph(self):
+        """Test building graphs with many branches over shared variables.
+        """
+        x = Variable((4, 4))
+        y = Variable(16)
+        kernel = np.random.randn(3, 3)
+        ops = []
+        for idx in range(200):
+            W = np.random.randn(4, 4)
+            ops.append(grad(mul_elemwise(W, x) + conv(kernel, x)))
+            if idx % 4 == 0:
+                ops.append(y * idx + reshape(x, 16))
+        expr = vstack(ops)
+        K = CompGraph(expr)
+        self.assertTrue(len(K.arenas) < len(K.edges) / 2)
+
+        val = np.random.randn(K.input_size)
+        out = np.zeros(K.output_size)
+        K.update_vars(val)
+        K.forward(val, out)
+        self.assertItemsAlmostEqual(out, expr.value)
+        self.check_adjoint(K)
+
+    def test_sparse(self):
+        """Test exporting the graph as a sparse matrix.
+        """
+        x = Variable((6, 5))
+        y = Variable(30)
+        kernel = np.random.randn(3, 3)
+        W = np.random.randn(6, 5)
+        expr = vstack([grad(conv(kernel, x)), 3 * mul_elemwise(W, x),
+                       transpose(x, (1, 0)), reshape(y, (6, 5)) + x,
+                       subsample(conv(kernel, conv(kernel, x)), (2, 2))])
+        K = CompGraph(expr)
+        M = K.to_sparse()
+        self.assertEqual(M.shape, (K.output_size, K.input_size))
+        self.assertTrue(M.nnz < M.shape[0] * M.shape[1] / 2)
+
+        val = np.random.randn(K.input_size)
+        uval = np.random.randn(K.output_size)
+        out = K.forward(val, np.zeros(K.output_size))
+        adj = K.adjoint(uval, np.zeros(K.input_size))
+        self.assertItemsAlmostEqual(M.dot(val), out)
+        self.assertItemsAlmostEqual(M.T.dot(uval), adj)
+
+        # Sparse graphs run a single product.
+        Ks = CompGraph(expr, sparse=True)
+        self.assertTrue(Ks.sparse_K is not None)
+        self.assertItemsAlmostEqual(Ks.forward(val, np.zeros(K.output_size)), out)
+        self.assertItemsAlmostEqual(Ks.adjoint(uval, np.zeros(K.input_size)), adj)
+        X = np.random.randn(3, K.input_size)
+        Y = Ks.forward_batch(X, np.zeros((3, K.output_size)))
+        self.assertItemsAlmostEqual(Y[1], K.forward(X[1], np.zeros(K.output_size)))
+
+        # Fall back to the graph without a sparse form or above the threshold.
+        self.assertEqual(CompGraph(conv_nofft(kernel, x)).to_sparse(), NotImplemented)
+        self.assertEqual(K.to_sparse(max_nnz=100), NotImplemented)
+        CompGraph.sparse_max_nnz = 100
+        self.assertTrue(CompGraph(expr, sparse=True).sparse_K is None)
+        CompGraph.sparse_max_nnz = 10**7
+
+    def test_gram(self):
+        """Test the fused Gram operator K^TK.
+        """
+        x = Variable((6, 5))
+        y = Variable((6, 5))
+        kernel = np.random.randn(3, 3)
+        W = np.random.randn(6, 5)
+        exprs = [conv(kernel, x), grad(x), mul_elemwise(W, x), subsample(x, (2, 3)),
+                 3 * x, subsample(mul_elemwise(W, conv(kernel, 2 * x)), (2, 2)),
+                 vstack([conv(kernel, x), grad(x), x + y, mul_elemwise(W, y),
+                         subsample(conv(kernel, y), (2, 2)), 2 * x - W]),
+                 vstack([x + y, x - y]), vstack([x, conv(kernel, x)]),
+                 vstack([grad(x), mul_elemwise(W, x), x])]
+        for expr in exprs:
+            K = CompGraph(expr)
+            val = np.random.randn(K.input_size)
+            ref = K.adjoint(K.forward(val, np.zeros(K.output_size)),
+                            np.zeros(K.input_size))
+            out = np.zeros(K.input_size)
+            K.gram().forward(val, out)
+            self.assertItemsAlmostEqual(out, ref)
+
+        # Blocks on the same variable share one term.
+        K = CompGraph(vstack([conv(kernel, x), grad(x), 3 * x]))
+        self.assertEqual(len(K.gram().terms), 1)
+        self.assertTrue(K.gram() is K.gram())
+
+        # The laplacian is the Gram matrix of grad.
+        lap = laplacian(x)
+        M = grad(x).get_sparse()[0]
+        self.assertItemsAlmostEqual(lap.get_sparse()[0].toarray(), M.T.dot(M).toarray())
+
+    def test_subexpressions(self):
+        """Test that equal subtrees are evaluated once.
+        """
+        x = Variable((6, 5))
+        kernel = np.random.randn(3, 3)
+        W = np.random.randn(6, 5)
+        expr = vstack([grad(conv(kernel, x)), grad(conv(kernel, x)),
+                       conv(kernel, x) + W, mul_elemwise(W, x), mul_elemwise(2 * W, x)])
+        K = CompGraph(expr)
+        names = [type(entry[0]).__name__ for entry in K.forward_schedule]
+        self.assertEqual(names.count('conv'), 1)
+        self.assertEqual(names.count('grad'), 1)
+        self.assertEqual(names.count('mul_elemwise'), 2)
+
+        val = np.random.randn(K.input_size)
+        x.value = np.reshape(val, x.shape)
+        out = K.forward(val, np.zeros(K.output_size))
+        self.assertItemsAlmostEqual(out, expr.value - expr.get_offset())
+        self.check_adjoint(K)
+
+    def test_zero_constants(self):
+        """Test that constant offsets are removed from the graph.
+        """
+        x = Variable((6, 5))
+        kernel = np.random.randn(3, 3)
+        b = np.random.randn(6, 5)
+        expr = vstack([conv(kernel, x) - b, 2 * x + b, grad(x + b - b),
+                       mul_elemwise(b, x - b)])
+        K = CompGraph(expr)
+        names = [type(entry[0]).__name__ for entry in K.forward_schedule]
+        self.assertEqual(names.count('sum'), 0)
+        self.assertEqual(names.count('Constant'), 0)
+
+        val = np.random.randn(K.input_size)
+        x.value = np.reshape(val, x.shape)
+        out = K.forward(val, np.zeros(K.output_size))
+        self.assertItemsAlmostEqual(out, expr.value - expr.get_offset())
+        self.check_adjoint(K)
+
+    def test_norm_cache(self):
+        """Test caching operator norm estimates on disk.
+        """
+        x = Variable((16, 16))
+        kernel = np.random.rand(3, 3)
+        path = tempfile.mkdtemp()
+        try:
+            K = CompGraph(vstack([conv_nofft(kernel, x), grad(x)]))
+            Knorm = est_CompGraph_norm(K, try_fast_norm=False, cache=NormCache(path))
+            self.assertTrue(len(os.listdir(path)) == 2)
+
+            # A new process finds the estimate on disk.
+            K = CompGraph(vstack([conv_nofft(kernel, x), grad(x)]))
+            K.gram().forward = None
+            self.assertEqual(est_CompGraph_norm(K, try_fast_norm=False,
+                                                cache=NormCache(path)), Knorm)
+
+            # New parameters warm start from the cached eigenvector.
+            K = CompGraph(vstack([conv_nofft(1.01 * kernel, x), grad(x)]))
+            cold = est_CompGraph_norm(K, tol=1e-6, try_fast_norm=False,
+                                      cache=NormCache(''))
+            warm = est_CompGraph_norm(K, tol=1e-6, try_fast_norm=False,
+                                      cache=NormCache(path))
+            self.assertAlmostEqual(warm, cold)
+
+            # Closures have no key stable across runs.
+            box = LinOpFactory(x.shape, x.shape, lambda a, b: np.copyto(b, kernel[0, 0] * a),
+                               lambda a, b: np.copyto(b, kernel[0, 0] * a))
+            self.assertEqual(CompGraph(box(x)).norm_keys(), (None, None))
+
+            # The default cache is on disk only if $PROXIMAL_CACHE_DIR is set
+            # when it is used.
+            cache = NormCache()
+            self.assertEqual(cache.path, '')
+            os.environ['PROXIMAL_CACHE_DIR'] = path
+            try:
+                self.assertEqual(cache.path, path)
+            finally:
+                del os.environ['PROXIMAL_CACHE_DIR']
+        finally:
+            shutil.rmtree(path)
+
+    def test_diag_norm(self):
+        """Test the exact norm of Gram diagonal graphs.
+        """
+        x = Variable((8, 8))
+        kernels = [np.random.rand(3, 3), np.random.randn(5, 5)]
+        W = np.random.rand(8, 8)
+        for expr in [vstack([conv(kernels[0], x), conv(kernels[1], x), 2 * x]),
+                     vstack([mul_elemwise(W, x), 3 * x]),
+                     conv(kernels[0], x) - W]:
+            K = CompGraph(expr)
+            KtK = np.array([K.adjoint(K.forward(col, np.zeros(K.output_size)),
+                                      np.zeros(K.input_size))
+                            for col in np.eye(K.input_size)])
+            Knorm = np.sqrt(np.max(np.linalg.eigvalsh(KtK)))
+            self.assertAlmostEqual(K.diag_norm(), Knorm)
+            self.assertAlmostEqual(est_CompGraph_norm(K, cache=NormCache('')), Knorm)
+
+        # Not diagonal, or several variables.
+        self.assertTrue(CompGraph(vstack([conv(kernels[0], x), grad(x)])).diag_norm() is None)
+        self.assertTrue(CompGraph(vstack([x, 2 * Variable((8, 8))])).diag_norm() is None)
+
+    def test_c_backend(self):
+        """Test evaluating the graph with generated C kernels.
+        """
+        if c_compiler_available():
+            x = Variable((8, 6))
+            y = Variable((6, 8))
+            kernel = np.random.rand(3, 3)
+            W = np.random.rand(8, 6)
+            expr = vstack([grad(x), subsample(x, (2, 3)), 2 * conv(kernel, x),
+                           mul_elemwise(W, x) + transpose(y, (1, 0))])
+            path = tempfile.mkdtemp()
+            os.environ['PROXIMAL_CACHE_DIR'] = path
+            try:
+                for dtype in [np.float64, np.float32]:
+                    K = CompGraph(expr, dtype=dtype)
+                    Kc = CompGraph(expr, implem=Impl['c'], dtype=dtype)
+                    val = np.random.randn(K.input_size).astype(dtype)
+                    out = np.random.randn(K.output_size).astype(dtype)
+                    self.assertItemsAlmostEqual(Kc.forward(val, np.zeros(K.output_size, dtype)),
+                                                K.forward(val, np.zeros(K.output_size, dtype)),
+                                                places=4)
+                    self.assertItemsAlmostEqual(Kc.adjoint(out, np.zeros(K.input_size, dtype)),
+                                                K.adjoint(out, np.zeros(K.input_size, dtype)),
+                                                places=4)
+                    # conv and mul_elemwise have no kernels and run in numpy.
+                    self.assertEqual(len(Kc.c_forward_subgraphs.dependent_subgraphs), 2)
+
+                # Several branches from the same input add up in the adjoint.
+                sub = subsample(x, (2, 1))
+                for expr in [vstack([sub, sub]),
+                             vstack([subsample(x, (2, 1)), subsample(x, (2, 1))]),
+                             vstack([sub, 2 * x, sub + sub])]:
+                    K = CompGraph(expr)
+                    Kc = CompGraph(expr, implem=Impl['c'])
+                    val = np.random.randn(K.input_size)
+                    out = np.random.randn(K.output_size)
+                    Kval = Kc.forward(val, np.zeros(K.output_size))
+                    KTout = Kc.adjoint(out, np.zeros(K.input_size))
+                    self.assertItemsAlmostEqual(Kval, K.forward(val, np.zeros(K.output_size)))
+                    self.assertItemsAlmostEqual(KTout, K.adjoint(out, np.zeros(K.input_size)))
+                    self.assertAlmostEqual(np.dot(Kval, out), np.dot(val, KTout))
+                self.assertTrue(len(os.listdir(os.path.join(path, 'c'))) > 0)
+            finally:
+                del os.environ['PROXIMAL_CACHE_DIR']
+                shutil.rmtree(path)
+
+    def test_c_backend_root(self):
+        """Test the C kernels of graphs that do not end in a vstack.
+        """
+        if c_compiler_available():
+            x = Variable((6, 5))
+            y = Variable((6, 5))
+            kernel = np.random.rand(3, 3)
+            W1 = np.random.rand(6, 5)
+            W2 = np.random.rand(6, 5)
+            b = np.random.rand(6, 5)
+            exprs = [scale(3., x), x + x + y, subsample(conv(kernel, x), (2, 2)),
+                     mul_elemwise(W1, mul_elemwise(W2, x)), x + b + b]
+            path = tempfile.mkdtemp()
+            os.environ['PROXIMAL_CACHE_DIR'] = path
+            try:
+                for expr in exprs:
+                    K = CompGraph(expr)
+                    Kc = CompGraph(expr, implem=Impl['c'])
+                    val = np.random.randn(K.input_size)
+                    out = np.random.randn(K.output_size)
+                    self.assertItemsAlmostEqual(Kc.forward(val, np.zeros(K.output_size)),
+                                                K.forward(val, np.zeros(K.output_size)))
+                    self.assertItemsAlmostEqual(Kc.adjoint(out, np.zeros(K.input_size)),
+                                                K.adjoint(out, np.zeros(K.input_size)))
+                    # The kernels are built on first use, and neither direction
+                    # fell back to numpy.
+                    self.assertTrue(Kc.c_forward_subgraphs is not None)
+                    self.assertTrue(Kc.c_forward_subgraphs is not NotImplemented)
+                    self.assertTrue(Kc.c_adjoint_subgraphs is not None)
+                    self.assertTrue(Kc.c_adjoint_subgraphs is not NotImplemented)
+            finally:
+                del os.environ['PROXIMAL_CACHE_DIR']
+                shutil.rmtree(path)
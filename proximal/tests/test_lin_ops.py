@@ -1,7 +1,7 @@
 from __future__ import division
 from proximal.tests.base_test import BaseTest
 from proximal.lin_ops import (Variable, subsample, conv, sum, vstack, LinOpFactory,
-                              mul_elemwise, CompGraph)
+                              mul_elemwise, conv_nofft, warp, CompGraph)
 from proximal.halide.halide import Halide, halide_installed
 from proximal.utils.utils import im2nparray, psf2otf
 import numpy as np
@@ -274,6 +274,29 @@ class TestLinOps(BaseTest):
         assert expr.is_gram_diag(freq=True)
 
 
+    def test_shared_value(self):
+        """Test evaluating expressions with shared subtrees.
+        """
+        x = Variable((4, 3))
+        x.value = np.random.randn(4, 3)
+        b = np.ones((4, 3))
+        expr = x - b
+        # Evaluated naively, the value takes 2^30 forward calls.
+        for _ in range(30):
+            expr = 0.5 * expr + 0.5 * expr
+        self.assertItemsAlmostEqual(expr.value, x.value - b)
+        self.assertEqual(expr.variables(), [x])
+
+        self.assertEqual(len(expr.constants()), 1)
+
+        # Variables follow changes to the inputs of nested nodes.
+        y = Variable((4, 3))
+        inner = x + y
+        node = 2 * inner
+        self.assertEqual(len(node.variables()), 2)
+        inner.input_nodes = inner.input_nodes[:1]
+        self.assertEqual(node.variables(), [x])
+
     def test_black_box(self):
         """Test custom linear operators.
         """
@@ -294,6 +317,42 @@ class TestLinOps(BaseTest):
         expr.adjoint([val], [output])
         self.assertItemsAlmostEqual(output, 2 * val)
 
+    def test_norm_bounds(self):
+        """Test the norm bounds of lin ops without a closed form norm.
+        """
+        def spectral_norm(op, shape):
+            size = int(np.prod(shape))
+            A = np.zeros((op.size, size))
+            unit = np.zeros(size)
+            output = np.zeros(op.shape)
+            for idx in range(size):
+                unit[:] = 0
+                unit[idx] = 1
+                op.forward([np.reshape(unit, shape)], [output])
+                A[:, idx] = output.flatten()
+            return np.sqrt(np.max(np.linalg.eigvalsh(A.T.dot(A))))
+
+        # Edge padding makes the norm exceed ||kernel||_1.
+        x = Variable((12, 12))
+        for kernel in [np.ones((3, 3)), np.random.rand(5, 5), np.random.randn(3, 5)]:
+            op = conv_nofft(kernel, x)
+            self.assertTrue(spectral_norm(op, x.shape) <= op.norm_bound([1]) + 1e-6)
+
+        x = Variable((10, 12, 3))
+        zoom = np.diag([2., 2., 1.])
+        tilt = np.array([[1.1, 0.05, 0.001], [-0.03, 0.9, 0.002], [1.5, -0.7, 1.]])
+        for H in [np.eye(3), zoom, tilt, np.stack([zoom, tilt], axis=-1)]:
+            op = warp(x, H)
+            self.assertTrue(spectral_norm(op, x.shape) <= op.norm_bound([1]) + 1e-6)
+        self.assertAlmostEqual(warp(x, np.eye(3)).norm_bound([1]), 1)
+
+        # Black boxes without a bound estimate their norm.
+        M = np.random.randn(6, 4)
+        my_op = LinOpFactory((4,), (6,), lambda a, b: np.copyto(b, M.dot(a)),
+                             lambda a, b: np.copyto(b, M.T.dot(a)))
+        self.assertAlmostEqual(my_op(Variable(4)).norm_bound([2]),
+                               2 * np.sqrt(np.max(np.linalg.eigvalsh(M.T.dot(M)))))
+
     def test_op_overloading(self):
         """Test operator overloading.
         """
@@ -1,7 +1,8 @@
 from proximal.tests.base_test import BaseTest
-from proximal.lin_ops import Variable, mul_elemwise, subsample
+from proximal.lin_ops import Variable, mul_elemwise, subsample, conv, grad
 from proximal.prox_fns import norm1, sum_squares
-from proximal.algorithms import Problem
+from proximal.algorithms import Problem, ImplCache
+from proximal.algorithms.autotune import tune_key
 from proximal.utils.utils import Impl
 import cvxpy as cvx
 import numpy as np
@@ -89,3 +90,54 @@ class TestProblem(BaseTest):
         prob.solve(solver="admm", eps_rel=1e-6, eps_abs=1e-6)
         self.assertItemsAlmostEqual(x.value, [1, 2, 3], places=3)
         self.assertItemsAlmostEqual(y.value, [1, 0, 2, 0, 3, 0], places=3)
+
+    def test_dtype(self):
+        """Test solving in single precision.
+        """
+        np.random.seed(1)
+        X = Variable((12, 10))
+        kernel = np.random.rand(3, 3)
+        B = np.random.rand(12, 10)
+        prox_fns = [sum_squares(conv(kernel, X), b=B), norm1(0.1 * grad(X))]
+        for solver in ["pc", "admm", "ladmm"]:
+            prob = Problem(prox_fns)
+            prob.solve(solver=solver, eps_abs=1e-5, eps_rel=1e-5)
+            X64 = X.value.copy()
+            prob.set_dtype(np.float32)
+            prob.solve(solver=solver, eps_abs=1e-5, eps_rel=1e-5)
+            self.assertEqual(X.value.dtype, np.float32)
+            self.assertItemsAlmostEqual(X.value, X64, places=2)
+
+    def test_autotune(self):
+        """Test picking the implementation of each node by timing.
+        """
+        np.random.seed(1)
+        X = Variable((12, 10))
+        kernel = np.random.rand(3, 3)
+        B = np.random.rand(12, 10)
+        K = conv(kernel, X)
+        prox_fns = [sum_squares(K, b=B), norm1(0.1 * grad(X))]
+        prob = Problem(prox_fns)
+        prob.solve(solver="pc", eps_abs=1e-5, eps_rel=1e-5)
+        X_ref = X.value.copy()
+
+        # Only nodes with several implementations have a choice to make.
+        cache = ImplCache('')
+        implems = [Impl['numpy'], Impl['halide']]
+        self.assertEqual(prob.autotune(cache=cache, implems=[Impl['numpy']]), {})
+        choices = prob.autotune(cache=cache, implems=implems)
+        self.assertTrue(K in choices)
+        self.assertTrue(set(choices.values()) <= set(implems))
+        self.assertEqual(len(cache.entries), len(choices))
+        # Choices depend on the float type they were timed with.
+        self.assertNotEqual(tune_key(K, implems), tune_key(K, implems, np.float32))
+
+        # Later runs use the recorded choice.
+        for key in cache.entries:
+            cache.entries[key] = np.array([Impl['numpy']])
+        K.set_implementation(Impl['halide'])
+        prob.autotune(cache=cache, implems=implems)
+        self.assertEqual(K.implementation, Impl['numpy'])
+
+        prob.solve(solver="pc", eps_abs=1e-5, eps_rel=1e-5)
+        self.assertItemsAlmostEqual(X.value, X_ref, places=3)
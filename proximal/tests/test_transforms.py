@@ -154,3 +154,8 @@ class TestTransforms(BaseTest):
         fn = sum_squares(expr)
         new_fn = absorb_offset(fn)
         self.assertItemsAlmostEqual(b, new_fn.b)
+        # The original lin op keeps its constants.
+        self.assertItemsAlmostEqual(-b, expr.get_offset())
+        self.assertEqual(len(expr.constants()), 1)
+        self.assertEqual(len(new_fn.lin_op.constants()), 1)
+        self.assertItemsAlmostEqual(np.zeros(10), new_fn.lin_op.get_offset())
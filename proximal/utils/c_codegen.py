@@ -0,0 +1,231 @@
+import os
+import re
+import ctypes
+import hashlib
+import logging
+import shutil
+import subprocess
+import tempfile
+import timeit
+import numpy as np
+
+from .cuda_codegen import (CudaSubGraph, ProxyNode, ReverseInOut, ind2sub,
+                           indent, replace_local_floats_with_double)
+from .norm_cache import default_cache_dir
+
+# Libraries loaded by compile_c_kernel, by digest of the code.
+c_libraries = {}
+
+# Helpers used by the generated kernel code.
+C_HEADER = """\
+#include <math.h>
+
+static inline int min(int a, int b) { return a < b ? a : b; }
+static inline int max(int a, int b) { return a > b ? a : b; }
+
+"""
+
+
+def c_compiler():
+    """The command of the C compiler, $CC or cc.
+    """
+    return os.environ.get('CC', 'cc')
+
+
+def c_compiler_available():
+    """Returns whether a C compiler is installed.
+    """
+    return shutil.which(c_compiler()) is not None
+
+
+def replace_floats_with_double(src):
+    """
+    This function replaces all float variables, constants and pointers with doubles.
+    """
+    return re.sub(r"\bfloat\b", "double", replace_local_floats_with_double(src))
+
+
+def compile_c_kernel(c_kernel_code):
+    """
+    compiles c kernel code into a shared library and returns the loaded library.
+
+    Libraries are kept under a digest of the code, so each kernel is only
+    built once, and on disk if $PROXIMAL_CACHE_DIR is set. The kernels are
+    built with OpenMP if the compiler supports it.
+    """
+    code = C_HEADER + c_kernel_code
+    digest = hashlib.sha1(code.encode('utf-8')).hexdigest()
+    if digest in c_libraries:
+        return c_libraries[digest]
+    cache_dir = default_cache_dir()
+    if cache_dir:
+        path = os.path.join(cache_dir, 'c')
+        if not os.path.isdir(path):
+            os.makedirs(path)
+    else:
+        path = None
+    tmpdir = tempfile.mkdtemp(dir=path)
+    try:
+        libname = os.path.join(path if path else tmpdir, 'kernel-%s.so' % digest)
+        if not os.path.exists(libname):
+            srcname = os.path.join(tmpdir, 'kernel.c')
+            tmpname = os.path.join(tmpdir, 'kernel.so')
+            with open(srcname, 'w') as f:
+                f.write(code)
+            logging.debug("Compiling c code:\n" + code)
+            cmd = [c_compiler(), '-O3', '-fPIC', '-shared', srcname, '-o', tmpname, '-lm']
+            for flags in [['-fopenmp'], []]:
+                proc = subprocess.Popen(cmd + flags, stdout=subprocess.PIPE,
+                                        stderr=subprocess.STDOUT)
+                output = proc.communicate()[0]
+                if proc.returncode == 0:
+                    break
+            if proc.returncode != 0:
+                logging.error(code)
+                logging.error("C compilation error:")
+                logging.error(output.decode('utf-8', 'replace'))
+                raise RuntimeError("C compilation failed.")
+            # Rename last so other processes never load a partial library.
+            os.rename(tmpname, libname)
+        # The library stays loaded after its file is removed.
+        lib = ctypes.CDLL(libname)
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+    c_libraries[digest] = lib
+    return lib
+
+
+def c_function(lib, function_name, additional_arguments=()):
+    """
+    Returns a callable for function <function_name> from the compiled c kernel <lib>.
+
+    The callable's signature matches the c kernel signature (additional_arguments
+    are appended) and returns the execution time in seconds. Arrays are passed by
+    pointer and must be contiguous.
+    """
+    c_func = getattr(lib, function_name)
+    c_func.restype = None
+    pointers = tuple(ctypes.c_void_p(a.ctypes.data) for a in additional_arguments)
+
+    def result(*args):
+        start = timeit.default_timer()
+        c_func(*(tuple(ctypes.c_void_p(a.ctypes.data) for a in args) + pointers))
+        t = timeit.default_timer() - start
+        logging.debug("C function %s execution time: %.2f ms", function_name, t*1000)
+        return t
+    return result
+
+
+class CSubGraph(CudaSubGraph):
+    """
+    Same as CudaSubGraph, but the kernel code of each subgraph is built for the
+    cpu, with the elements computed in an OpenMP parallel loop. Nodes without
+    kernels run their numpy forward and adjoint operators.
+    """
+
+    def gen_code(self, fcn, parent=None, shape=None, dtype=np.float32):
+        """
+        generates and builds the c kernel code. fcn should either be
+        "forward_cuda_kernel" or "adjoint_cuda_kernel"
+        """
+        self.c_args = []
+        self.fcn = fcn
+        self.dtype = dtype
+        # do we need additional arguments for the kernel except x (=input) and y (=output)
+        for n in self.kernel_nodes:
+            try:
+                buffers = n.cuda_additional_buffers()
+            except AttributeError:
+                buffers = []
+            for aname, aval in buffers:
+                if isinstance(aval, np.ndarray) and aval.dtype == np.int32:
+                    self.c_args.append((aname, np.ascontiguousarray(aval), "int"))
+                else:
+                    aval = np.ascontiguousarray(aval, dtype=dtype)
+                    self.c_args.append((aname, aval, "float"))
+
+        for cn in self.nokernel_nodes:
+            for n in cn:
+                o = self.orig_output_nodes(n)
+                assert len(o) == 1
+                o = o[0]
+                rshape = n.shape if fcn == "forward_cuda_kernel" else o.shape
+                o = np.zeros(rshape, dtype=dtype)
+                self.nokernel_results[n] = o
+            n = cn[-1]
+            self.c_args.append(("linop_proxy_output_%d" % n.linop_id, o, "float"))
+            self.nokernel_proxynodes[n] = ProxyNode(n, self.c_args[-1][0], rshape)
+
+        add_args = "".join((", %s *%s" % (x[2], x[0]) for x in self.c_args))
+
+        cg = self if fcn == "forward_cuda_kernel" else ReverseInOut(self, reverseNodes=False)
+        self.shape = shape if shape is not None else self.end.shape
+        # generate the c kernel for this subgraph
+        ccode, var, num_tmp_vars = getattr(self.end, fcn)(cg, 0, ind2sub("yidx", self.shape),
+                                                          parent)
+        ccode = indent(ccode, 8)
+        dimy = int(np.prod(self.shape))
+        subgraph_id = self.subgraph_id
+        code = """\
+void %(fcn)s_%(subgraph_id)d(const float *x, float *y%(add_args)s)
+{
+    int yidx;
+    #pragma omp parallel for
+    for( yidx = 0; yidx < %(dimy)d; ++yidx )
+    {
+        %(ccode)s
+        y[yidx] = %(var)s;
+    }
+}
+
+""" % locals()
+        if np.dtype(dtype) == np.float64:
+            code = replace_floats_with_double(code)
+
+        # generate the c kernels for the dependent subgraphs
+        for i, dsg in enumerate(self.dependent_subgraphs):
+            cn = self.nokernel_nodes[i]
+            if fcn == "forward_cuda_kernel":
+                parent = self.orig_input_nodes(cn[0])
+                assert len(parent) == 1
+                parent = parent[0]
+            else:
+                parent = cn[0]
+            dsg.gen_code(fcn, cn[0], parent.shape, dtype)
+            for ni, n in enumerate(cn):
+                if ni == 0:
+                    self.nokernel_inputs[n] = np.zeros(dsg.shape, dtype=dtype)
+                else:
+                    self.nokernel_inputs[n] = self.nokernel_results[cn[ni-1]]
+
+        self._c_code = code
+        self.c_lib = compile_c_kernel(code)
+        arg_vals = tuple(x[1] for x in self.c_args)
+        self.c_kernel_func = c_function(self.c_lib, "%(fcn)s_%(subgraph_id)d" % locals(), arg_vals)
+
+    def apply(self, x, y):
+        """
+        apply the compiled c kernels and all dependent subgraphs
+        """
+        t = 0.0
+        for i, dsg in enumerate(self.dependent_subgraphs):
+            cn = self.nokernel_nodes[i]
+            n = cn[0]
+            t += dsg.apply(x, self.nokernel_inputs[n])
+        for i, cn in enumerate(self.nokernel_nodes):
+            if self.fcn == "forward_cuda_kernel":
+                for n in cn:
+                    n.forward([self.nokernel_inputs[n]], [self.nokernel_results[n]])
+            else:
+                for n in cn:
+                    n.adjoint([self.nokernel_inputs[n]], [self.nokernel_results[n]])
+        t += self.c_kernel_func(x, y)
+        self.output = np.reshape(y, self.shape)
+        return t
+
+    @property
+    def c_code(self):
+        """
+        return the c code for this and the dependent kernels
+        """
+        return self._c_code + "\n".join([x.c_code for x in self.dependent_subgraphs])
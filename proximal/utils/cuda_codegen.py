@@ -208,6 +208,14 @@ class NodeReverseInOut(object):
     def size(self):
         return self.n.size
 
+def unwrap_node(n):
+    """
+    Returns the node wrapped by NodeReverseInOut objects.
+    """
+    while isinstance(n, NodeReverseInOut):
+        n = n.n
+    return n
+
 class ReverseInOut(object):
     """
     When generating cuda kernels, the graphs are traversed implicitely.
@@ -358,7 +366,7 @@ class CudaSubGraph:
                 self.nokernel_nodes.append(cn)
         self.dependent_subgraphs = []
         for n in nokernel_innodes:
-            dsg = CudaSubGraph(get_input_nodes, get_output_nodes, n)
+            dsg = type(self)(get_input_nodes, get_output_nodes, n)
             self.dependent_subgraphs.append(dsg)
 
         self.orig_input_nodes = get_input_nodes
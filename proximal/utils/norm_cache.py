@@ -0,0 +1,107 @@
+import os
+import numpy as np
+
+
+def default_cache_dir():
+    """The directory of the caches on disk, $PROXIMAL_CACHE_DIR.
+
+    Returns '' if it is not set, and the caches are kept in memory only.
+    """
+    return os.environ.get('PROXIMAL_CACHE_DIR', '')
+
+
+class NormCache(object):
+    """Operator norm estimates, kept in memory and, if a cache directory is
+    set, on disk.
+
+    Norms are stored under a digest of a graph with its parameters, along
+    with the tolerance they were computed with. The top eigenvector of K^TK
+    is stored under a digest of the graph structure alone, to warm start the
+    estimate when only the parameters change.
+    """
+
+    # Prefixes of the entry names, used to find the files to clear.
+    prefixes = ('norm-', 'vec-')
+
+    def __init__(self, path=None):
+        """path is the cache directory, or '' to keep results in memory only.
+
+        Defaults to $PROXIMAL_CACHE_DIR, read when the cache is used.
+        """
+        self._path = path
+        self.entries = {}
+
+    @property
+    def path(self):
+        if self._path is None:
+            return default_cache_dir()
+        return self._path
+
+    def get_norm(self, key, tol):
+        """Returns the norm stored for key if computed with tolerance tol or
+        smaller, else None.
+        """
+        entry = self.load('norm-' + key)
+        if entry is not None and entry[0] <= tol:
+            return float(entry[1])
+        return None
+
+    def set_norm(self, key, tol, norm):
+        self.store('norm-' + key, np.array([tol, norm]))
+
+    def get_vector(self, key, size):
+        """Returns the eigenvector stored for key if it has the given size.
+        """
+        vector = self.load('vec-' + key)
+        if vector is not None and vector.size == size:
+            return vector
+        return None
+
+    def set_vector(self, key, vector):
+        self.store('vec-' + key, np.asarray(vector, dtype=np.float64))
+
+    def filename(self, name):
+        return os.path.join(self.path, name + '.npy')
+
+    def load(self, name):
+        if name not in self.entries and self.path:
+            try:
+                self.entries[name] = np.load(self.filename(name))
+            except (IOError, OSError, ValueError):
+                return None
+        return self.entries.get(name)
+
+    def store(self, name, value):
+        self.entries[name] = value
+        path = self.path
+        if not path:
+            return
+        # Write to a temporary file first so readers never see partial data.
+        tmpname = self.filename(name) + '.%d.tmp' % os.getpid()
+        try:
+            if not os.path.isdir(path):
+                os.makedirs(path)
+            with open(tmpname, 'wb') as f:
+                np.save(f, value)
+            os.rename(tmpname, self.filename(name))
+        except (IOError, OSError):
+            pass
+
+    def clear(self):
+        """Drops all entries, in memory and on disk.
+        """
+        names = list(self.entries)
+        path = self.path
+        if path and os.path.isdir(path):
+            names += [name[:-len('.npy')] for name in os.listdir(path)
+                      if name.startswith(self.prefixes) and name.endswith('.npy')]
+        for name in set(names):
+            try:
+                os.remove(self.filename(name))
+            except (IOError, OSError):
+                pass
+        self.entries.clear()
+
+
+# Cache used by est_CompGraph_norm.
+norm_cache = NormCache()
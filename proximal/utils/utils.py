@@ -2,7 +2,14 @@ from __future__ import print_function, division
 
 # Imports
 import numpy as np
-from numpy.fft import fftn, ifftn, fft2, ifft2
+# Exported for the callers of this module.
+from numpy.fft import fftn, ifftn, fft2, ifft2  # noqa: F401
+try:
+    # The fftd/ifftd kernels keep single precision inputs in single precision.
+    import scipy.fft as _fft
+except ImportError:
+    import numpy.fft as _fft
+import scipy.sparse as sp
 import cv2
 import timeit
 import sys
@@ -11,7 +18,7 @@ import sys
 # Implementations supported
 ###############################################################################
 
-Impl = {'numpy': 0, 'halide': 1, 'pycuda': 2}
+Impl = {'numpy': 0, 'halide': 1, 'pycuda': 2, 'c': 3}
 
 ###############################################################################
 # TODO: DIRTY HACK FOR BACKWARDS COMPATIBILITY!
@@ -105,28 +112,32 @@ def toc(t=[]):
 ###############################################################################
 
 
-def fftd(I, dims=None):
+def fftd(I, dims=None, lead=0):
 
-    # Compute fft
-    if dims is None:
-        X = fftn(I)
+    # Compute fft over the first dims axes after the lead (batch) axes
+    if dims is None and lead == 0:
+        X = _fft.fftn(I)
+    elif dims is None:
+        X = _fft.fftn(I, axes=tuple(range(lead, I.ndim)))
     elif dims == 2:
-        X = fft2(I, axes=(0, 1))
+        X = _fft.fft2(I, axes=(lead, lead + 1))
     else:
-        X = fftn(I, axes=tuple(range(dims)))
+        X = _fft.fftn(I, axes=tuple(range(lead, lead + dims)))
 
     return X
 
 
-def ifftd(I, dims=None):
+def ifftd(I, dims=None, lead=0):
 
-    # Compute fft
-    if dims is None:
-        X = ifftn(I)
+    # Compute fft over the first dims axes after the lead (batch) axes
+    if dims is None and lead == 0:
+        X = _fft.ifftn(I)
+    elif dims is None:
+        X = _fft.ifftn(I, axes=tuple(range(lead, I.ndim)))
     elif dims == 2:
-        X = ifft2(I, axes=(0, 1))
+        X = _fft.ifft2(I, axes=(lead, lead + 1))
     else:
-        X = ifftn(I, axes=tuple(range(dims)))
+        X = _fft.ifftn(I, axes=tuple(range(lead, lead + dims)))
 
     return X
 
@@ -159,7 +170,8 @@ def psf2otf(K, outsize, dims=None):
 
     Kfull = circshift(Kfull, shifts)
 
-    # Compute otf
+    # Compute otf in double precision, the callers cast it to their dtype.
+    Kfull = Kfull.astype(np.result_type(Kfull, np.float64), copy=False)
     otf = fftd(Kfull, dims)
 
     # Estimate the rough number of operations involved in the computation of the FFT.
@@ -179,6 +191,19 @@ def psf2otf(K, outsize, dims=None):
 
     return otf
 
+###############################################################################
+# Sparse utils
+###############################################################################
+
+
+def selection_matrix(indices, size):
+    """Sparse matrix picking the entries indices out of a vector of length size.
+    """
+    indices = np.ravel(indices)
+    return sp.csr_matrix((np.ones(len(indices)),
+                          (np.arange(len(indices)), indices)),
+                         shape=(len(indices), size))
+
 ###############################################################################
 # Image metrics
 ###############################################################################